@@ -4,12 +4,21 @@ from PyQt5.QtCore import QTimer
 import cv2
 import time
 import sys
+import os
 from datetime import datetime, timedelta
-import mediapipe as mp
-
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-from utils.visualize import visualize
+from utils.visualize import visualize_boxes
+from utils.zones import feet
+from utils.zone_engine import ZoneEngine
+from utils.zone_state import ZoneStateMachine
+from utils.floor import FloorCalibration
+from utils.motion import MotionGate
+from utils.preprocess import FramePreprocessor
+from utils.telemetry import telemetry
+from utils.detection_worker import DetectionWorker
+from utils.detectors import create_detector
+from utils.frame_history import FrameHistory
+from utils.roi import RoiDetector, zone_roi
+from utils.tracker import PersonTracker
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
     QGridLayout, QTableWidget, QTableWidgetItem, QWidget
@@ -19,12 +28,8 @@ import numpy as np
 import pyttsx3
 import queue
 
-# Global variables to calculate FPS
-COUNTER, FPS = 0, 0
-START_TIME = time.time()
-
 class ObjectPage(QWidget):
-    def __init__(self, main_window, model="models/efficientdet_lite0.tflite", max_results=5, score_threshold=0.3, width=640, height=480):
+    def __init__(self, main_window, model=None, max_results=5, score_threshold=0.3, width=640, height=480):
         super().__init__()
         self.main_window = main_window
 
@@ -67,6 +72,7 @@ class ObjectPage(QWidget):
         first_col_layout.addWidget(self.camera_label)
 
         # Table with random data (row 2)
+        self.log_table_date = None  # Day the table was last read for
         self.table = QTableWidget(5, 3)  # 5 rows, 3 columns
         self.table.setHorizontalHeaderLabels(["Column 1", "Column 2", "Column 3"])
         self.table.setMaximumSize(640, 480)  # Set maximum size
@@ -159,40 +165,58 @@ class ObjectPage(QWidget):
         self.text_color = (0, 0, 0)  # black
         self.font_size = 1
         self.font_thickness = 1
-        fps_avg_frame_count = 10
 
         self.detection_frame = None
-        self.detection_result_list = []
-        
-        def save_result(result: vision.ObjectDetectorResult, unused_output_image: mp.Image, timestamp_ms: int):
-            global FPS, COUNTER, START_TIME
-
-            # Calculate the FPS
-            if COUNTER % fps_avg_frame_count == 0:
-                FPS = fps_avg_frame_count / (time.time() - START_TIME)
-                START_TIME = time.time()
-
-            self.detection_result_list.append(result)
-            COUNTER += 1
-
-        # Initialize the object detection model
-        base_options = python.BaseOptions(model_asset_path=model)
-        options = vision.ObjectDetectorOptions(base_options=base_options,
-                                                running_mode=vision.RunningMode.LIVE_STREAM,
-                                                max_results=max_results, score_threshold=score_threshold,
-                                                result_callback=save_result)
-        self.detector = vision.ObjectDetector.create_from_options(options)
+        self.stream = self.main_window.camera.bus.subscribe('object_page', size=(400, 300))
+        self.main_window.camera.add_listener(self.on_vision_changed)
+        self.vision_pool = self.main_window.vision_pool
+        self.motion_gate = MotionGate.from_env()
+        telemetry.add_collector(self.motion_gate.telemetry_gauges)
+        self.preprocessor = FramePreprocessor(size=(400, 300))
+        self.history = FrameHistory()
+        self.last_pool_seq = 0
+        self.decision_latency = 0.0
+
+        # Object detection runs on its own thread, finished results are picked up in update_frame.
+        # The backend is chosen with CAPSTONE_DETECTOR, see utils/detectors.py. With CAPSTONE_ROI=1 it
+        # runs on a full resolution crop around the zones instead of the 400x300 frame, with
+        # CAPSTONE_ROI=tiles on full resolution tiles near the zones.
+        def detector_factory():
+            return create_detector(model=model, max_results=max_results, score_threshold=score_threshold)
+        detector = RoiDetector.from_env(detector_factory(), detector_factory)
+        self.roi_detector = detector if isinstance(detector, RoiDetector) else None
+        self.detection_scale = (1.0, 1.0)
+        self.detector = DetectionWorker(detector)
+
+        # Person tracks carry the boxes between detector runs, so zone checks run on every frame and the
+        # detector only has to see every CAPSTONE_DETECT_EVERY-th frame while people are tracked
+        self.tracker = PersonTracker.from_env(score_threshold, self.motion_gate.max_interval)
+        self.detect_every = int(os.environ.get("CAPSTONE_DETECT_EVERY", 1))
+        self.frames_since_submit = 0
+        self.tracks_in_zone = []
+        self.zone_engine = ZoneEngine()
+
+        # Debounced robot state, so a person on a zone boundary does not flip it every frame
+        self.zone_state = ZoneStateMachine.from_env()
+        self.nearest_distance = None
+        self.zone_held = (False, False)  # Somebody still within the exit band of the stop / slow zone
+
+        # Zones come from the in-memory repository and are only re-applied when SetupPage saved new ones
+        self.zones_version = None
+        self.main_window.zones.subscribe(self.on_zones_changed)
 
         self.timer.start(30)  # Update every 30 ms
 
     def showEvent(self, event):
         """
-        Called when the page becomes visible. Fetch the latest zone data.
+        Called when the page becomes visible. Apply zone changes that were not applied yet.
         """
         super().showEvent(event)
-        print("ObjectPage is now visible. Fetching zone data.")
-        self.fetch_zone_coordinates()
-        self.populate_table_with_log_data(self.table)
+        print("ObjectPage is now visible.")
+        if self.zones_version != self.main_window.zones.version(self.main_window.robot_id):
+            self.fetch_zone_coordinates()
+        if self.log_table_date != datetime.now().date():
+            self.populate_table_with_log_data(self.table)  # Today's logs, otherwise kept up to date on every log
         self.main_window.robot.stop()
 
         if self.main_window.robot.connected:
@@ -207,31 +231,39 @@ class ObjectPage(QWidget):
         self.engine.say("Testing Speaker")
         self.engine.runAndWait()
 
+    def on_zones_changed(self, robot_id, version):
+        """
+        Called by the zone repository after zones or the floor calibration were saved.
+        """
+        if robot_id == self.main_window.robot_id:
+            self.fetch_zone_coordinates()
+
     def fetch_zone_coordinates(self):
         """
-        Fetch slow zone and stop zone coordinates using get_zone_data.
+        Apply the slow zone and stop zone coordinates of this robot from the zone repository.
         """
         try:
-            results = self.main_window.db.get_zone_data()  # Call the function from the main window
-            if results:
-                result = results[0]  # Assuming only one record exists for robot_id = 1
-                self.stop_zone = {
-                    'top_left': (result['stop_zone_tl_x'], result['stop_zone_tl_y']),
-                    'top_right': (result['stop_zone_tr_x'], result['stop_zone_tr_y']),
-                    'bottom_left': (result['stop_zone_bl_x'], result['stop_zone_bl_y']),
-                    'bottom_right': (result['stop_zone_br_x'], result['stop_zone_br_y']),
-                }
-                self.slow_zone = {
-                    'top_left': (result['slow_zone_tl_x'], result['slow_zone_tl_y']),
-                    'top_right': (result['slow_zone_tr_x'], result['slow_zone_tr_y']),
-                    'bottom_left': (result['slow_zone_bl_x'], result['slow_zone_bl_y']),
-                    'bottom_right': (result['slow_zone_br_x'], result['slow_zone_br_y']),
-                }
+            zones = self.main_window.zones
+            self.zones_version = zones.version(self.main_window.robot_id)
+            stop_zone, slow_zone = zones.get(self.main_window.robot_id)
+            if stop_zone is not None:
+                self.stop_zone, self.slow_zone = stop_zone, slow_zone  # One record per robot
+                self.zone_engine.set_zones({"stop": self.stop_zone, "slow": self.slow_zone})
+                if self.roi_detector is not None:
+                    self.roi_detector.set_region(zone_roi(self.stop_zone, self.slow_zone))
+                if self.vision_pool is not None:
+                    self.vision_pool.set_zones(self.stop_zone, self.slow_zone)
                 print("Zone data updated.")
                 self.database_connection_label.setText("True")
                 self.database_connection_label.setStyleSheet("font-size: 20px; color: green;")
             else:
-                print("No zone data found for robot_id = 1.")
+                print(f"No zone data found for robot_id = {self.main_window.robot_id}.")
+
+            # Metric zone checks and distances once the floor of this camera was calibrated on the setup page
+            calibration = zones.calibration(self.main_window.robot_id)
+            self.zone_engine.set_floor(FloorCalibration.from_dict(calibration) if calibration else None)
+            if self.vision_pool is not None:
+                self.vision_pool.set_floor(calibration)
         except Exception as e:
             print(f"Error fetching zone coordinates: {e}")
 
@@ -244,7 +276,8 @@ class ObjectPage(QWidget):
         """
         try:
             # Retrieve today's log data
-            log_data = self.main_window.db.get_log_data_today()
+            log_data = self.main_window.db.get_log_data_today(self.main_window.robot_id)
+            self.log_table_date = datetime.now().date()
 
             if not log_data:
                 print("No data found for today's logs.")
@@ -306,7 +339,9 @@ class ObjectPage(QWidget):
                 current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')  # Format datetime as string
 
                 data = (zone_type, current_time)  # Create the tuple for the query
-                self.main_window.db.insert_log(data)  # Call the function
+                self.main_window.db.insert_log(data, self.main_window.robot_id)  # Call the function
+                if self.tracks_in_zone:
+                    print(f"Stop zone entered by track(s) {self.tracks_in_zone}")
 
                 self.populate_table_with_log_data(self.table)
 
@@ -327,12 +362,27 @@ class ObjectPage(QWidget):
                 current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')  # Format datetime as string
 
                 data = (zone_type, current_time)  # Create the tuple for the query
-                self.main_window.db.insert_log(data)  # Call the function
+                self.main_window.db.insert_log(data, self.main_window.robot_id)  # Call the function
+                if self.tracks_in_zone:
+                    print(f"Slow zone entered by track(s) {self.tracks_in_zone}")
 
                 self.populate_table_with_log_data(self.table)
 
                 self.speak_queue.put("Inside slow zone please be cautions")
 
+            elif new_state == "vision_lost":
+                try:
+                    self.main_window.robot.stop()
+                    self.robot_connection_label.setText("True")
+                    self.robot_connection_label.setStyleSheet("font-size: 20px; color: green;")
+                except:
+                    self.robot_connection_label.setText("False")
+                    self.robot_connection_label.setStyleSheet("font-size: 20px; color: red;")
+                self.status_label.setText("Vision Lost")
+                self.status_label.setStyleSheet("font-size: 20px; color: red;")
+
+                self.speak_queue.put("Camera connection lost")
+
             elif new_state == "normal":
                 try:
                     self.main_window.robot.start()
@@ -358,6 +408,16 @@ class ObjectPage(QWidget):
                 self.status_label.setStyleSheet("font-size: 20px; color: black;")
                 print("Robot commands are disabled.")
 
+    def on_vision_changed(self, vision_lost):
+        """
+        Called from the camera supervisor thread. Stop the robot right away instead of waiting for the next GUI tick.
+        """
+        if vision_lost and self.current_state != "disabled":
+            try:
+                self.main_window.robot.stop()
+            except Exception as e:
+                print(f"Error stopping robot on vision loss: {e}")
+
     def run(self):
         while not self.stop_event.is_set():
             try:
@@ -383,36 +443,132 @@ class ObjectPage(QWidget):
                 break
 
     def update_frame(self):
-        # Update IP camera stream
-        ip_success, ip_frame = (self.main_window.ip_cap.read() if self.main_window.ip_cap else (False, None))
-        if not ip_success or ip_frame is None:
-            self.camera_label.setText("Failed to read IP camera frame.")
+        # Keep the robot stopped and the last frame on screen until the camera is back. Worker processes
+        # that stopped answering are treated the same, their last result would otherwise stay on forever.
+        if self.main_window.camera.is_stale() or (self.vision_pool is not None and self.vision_pool.is_stale()):
+            if self.current_state != "disabled":
+                self.update_robot_state("vision_lost")
+            self.motion_gate.reset()
+            if self.tracker is not None:
+                self.tracker.reset()
             return
 
-        # Resize the frame to 400x300
-        ip_frame = cv2.resize(ip_frame, (400, 300))
+        # Update IP camera stream
+        packet = self.stream.poll()
+        if packet is None:
+            if self.stream.last_frame_id == 0:
+                self.camera_label.setText("Failed to read IP camera frame.")
+            return  # No new frame since the last tick
+
+        # 400x300 BGR display frame in a reused buffer, the detector converts colours itself
+        current_frame, _ = self.preprocessor.process(packet.frame, rgb=False)
+        self.history.store(current_frame, packet.timestamp)
+
+        # Object detection, done by the worker processes when the vision pool is enabled.
+        # Static scenes skip the detector, it always runs while someone is inside a zone.
+        gate_view = self.stream.get(packet, size=self.motion_gate.size, color="gray")
+        person_in_zone = self.current_state in ("stop", "slow")
+        self.frames_since_submit += 1
+        tracking = self.tracker is not None and len(self.tracker) > 0
+        detection_due = not tracking or self.frames_since_submit >= self.detect_every
+        if (self.vision_pool is None and detection_due
+                and self.motion_gate.should_run(gate_view, packet.timestamp, force=person_in_zone)):
+            self.frames_since_submit = 0
+            if self.roi_detector is not None:
+                # The crop is cut from the full resolution frame, boxes are scaled back to 400x300
+                frame_height, frame_width = packet.frame.shape[:2]
+                self.detection_scale = (current_frame.shape[1] / frame_width, current_frame.shape[0] / frame_height)
+                self.detector.submit(packet.frame, packet.timestamp)
+            else:
+                self.detector.submit(current_frame, packet.timestamp)
+
+        # Only finished results, never waits for inference
+        pool_result = None
+        detection = None
+        if self.vision_pool is not None:
+            pool_result = self.vision_pool.latest_result()
+            if pool_result is not None and pool_result.seq == self.last_pool_seq:
+                pool_result = None  # Already shown
+            result_timestamp = pool_result.timestamp if pool_result is not None else None
+            pending = self.vision_pool.in_flight > 0
+        else:
+            detection = self.detector.latest()
+            result_timestamp = detection.timestamp if detection is not None else None
+            pending = self.detector.in_flight() > 0
 
-        # Object detection
-        ip_rgb = cv2.cvtColor(ip_frame, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=ip_rgb)
-        self.detector.detect_async(mp_image, time.time_ns() // 1_000_000)
+        if result_timestamp is not None:
+            self.decision_latency = time.time() - result_timestamp
+            telemetry.observe("capture_to_decision", self.decision_latency)
 
-        # Show FPS on IP camera frame (for object detection)
-        fps_text = f'FPS: {FPS:.1f}'
+        person_detected = False
+        person_boxes = None
+        person_feet = None
+        track_ids = None
+        if self.tracker is not None:
+            # New results update the tracks, the tracks extrapolated to the live frame are drawn and
+            # evaluated on every tick
+            if pool_result is not None:
+                self.last_pool_seq = pool_result.seq
+                self.tracker.update(pool_result.boxes, pool_result.scores, pool_result.timestamp)
+                pool_result = None  # Zones are evaluated on the tracks below
+            elif detection is not None:
+                persons = detection.detections.persons()
+                if self.roi_detector is not None:
+                    persons = persons.transformed(*self.detection_scale)
+                measured = feet(persons.boxes, persons.keypoints) if persons.keypoints is not None else None
+                self.tracker.update(persons.boxes, persons.scores, detection.timestamp, measured)
+            track_ids, person_boxes, track_scores = self.tracker.boxes_at(packet.timestamp)
+            # Feet measured by a pose model move with their track, the others are estimated from the box
+            tracked_feet = self.tracker.feet_at(packet.timestamp)
+            estimated_feet = feet(person_boxes)
+            person_feet = tuple(np.where(np.isnan(tracked), estimated, tracked)
+                                for tracked, estimated in zip(tracked_feet, estimated_feet))
+            telemetry.gauge("tracks_active", len(track_ids))
+            detection_frame, person_detected = visualize_boxes(current_frame, person_boxes, track_scores)
+            for track_id, (origin_x, origin_y, _, _) in zip(track_ids, person_boxes):
+                cv2.putText(detection_frame, f"#{track_id}", (int(origin_x), max(12, int(origin_y) - 4)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 1)
+        else:
+            if result_timestamp is None:
+                if pending:
+                    return  # Keep the last annotated frame until the result for a newer frame arrives
+                detection_frame = current_frame  # Detector idle (static scene), show the live frame
+            else:
+                # Draw and evaluate on the frame the result was computed on
+                detection_frame = self.history.get(result_timestamp)
+                if detection_frame is None:
+                    detection_frame = current_frame  # Fell out of the history, should not happen with a sane size
+
+            if pool_result is not None:
+                self.last_pool_seq = pool_result.seq
+                detection_frame, person_detected = visualize_boxes(detection_frame, pool_result.boxes,
+                                                                   pool_result.scores)
+            elif detection is not None:
+                persons = detection.detections.persons()
+                if self.roi_detector is not None:
+                    persons = persons.transformed(*self.detection_scale)
+                person_boxes = persons.boxes
+                person_feet = feet(persons.boxes, persons.keypoints)
+                detection_frame, person_detected = visualize_boxes(detection_frame, persons.boxes, persons.scores)
+
+        # Show detection FPS, frames skipped by the motion gate and capture-to-decision latency
+        fps_text = (f'FPS: {self.detector.fps:.1f}  Skipped: {self.motion_gate.stats()["skip_ratio"]:.0%}  '
+                    f'Latency: {1000 * self.decision_latency:.0f} ms')
         text_location = (self.left_margin, self.row_size)
-        current_frame = ip_frame
-        cv2.putText(current_frame, fps_text, text_location, cv2.FONT_HERSHEY_DUPLEX,
+        cv2.putText(detection_frame, fps_text, text_location, cv2.FONT_HERSHEY_DUPLEX,
+                    self.font_size, self.text_color, self.font_thickness, cv2.LINE_AA)
+        # Zones are only checked in metres once the floor of this camera is calibrated
+        zone_mode = "Zones: floor (m)" if self.zone_engine.metric() else "Zones: image (floor not calibrated)"
+        cv2.putText(detection_frame, zone_mode, (self.left_margin, 2 * self.row_size), cv2.FONT_HERSHEY_DUPLEX,
                     self.font_size, self.text_color, self.font_thickness, cv2.LINE_AA)
-
-        detection_frame = current_frame.copy()
-        person_detected = False
-        if self.detection_result_list:
-            detection_frame, person_detected = visualize(current_frame, self.detection_result_list[0])
 
         # ---------------------
         # Draw Slow Zone Lines
         # ---------------------
-        if self.slow_zone is not None:
+        if self.slow_zone is not None and self.slow_zone.get('polygon'):
+            # Polygon Slow Zone, drawn closed since every edge bounds it
+            cv2.polylines(detection_frame, [np.array(self.slow_zone['polygon'], dtype=np.int32)], True, (0, 255, 255), 2)
+        elif self.slow_zone is not None:
             # Vertical line for Slow Zone (top_left to bottom_left)
             X_slow_tl, Y_slow_tl = self.slow_zone['top_left']
             X_slow_bl, Y_slow_bl = self.slow_zone['bottom_left']
@@ -426,7 +582,10 @@ class ObjectPage(QWidget):
         # ---------------------
         # Draw Stop Zone Lines
         # ---------------------
-        if self.stop_zone is not None:
+        if self.stop_zone is not None and self.stop_zone.get('polygon'):
+            # Polygon Stop Zone, drawn closed since every edge bounds it
+            cv2.polylines(detection_frame, [np.array(self.stop_zone['polygon'], dtype=np.int32)], True, (0, 0, 255), 2)
+        elif self.stop_zone is not None:
             # Vertical line for Stop Zone (top_left to bottom_left)
             X_stop_tl, Y_stop_tl = self.stop_zone['top_left']
             X_stop_bl, Y_stop_bl = self.stop_zone['bottom_left']
@@ -438,110 +597,52 @@ class ObjectPage(QWidget):
             cv2.line(detection_frame, (X_stop_bl2, Y_stop_bl2), (X_stop_br, Y_stop_br), (0, 0, 255), 2)
 
         # If a person is detected, perform zone checks
-        if person_detected:
+        zones_started = time.perf_counter()
+        self.nearest_distance = None
+        self.zone_held = (False, False)
+        if pool_result is not None:
+            # Zones were already evaluated by the worker process
+            self.stop_detected = pool_result.stop_detected
+            self.slow_detected = pool_result.slow_detected
+            self.zone_held = pool_result.held
+        elif person_detected or track_ids is not None:
             self.stop_detected = False
             self.slow_detected = False
-
-            def point_side_of_line(line_x1, line_y1, line_x2, line_y2, x, y):
-                # Cross product: (y - y1)*dx - (x - x1)*dy
-                dx = line_x2 - line_x1
-                dy = line_y2 - line_y1
-                return (y - line_y1)*dx - (x - line_x1)*dy
-
-            # Check each detected person
-            for detection in self.detection_result_list[0].detections:
-                category_name = detection.categories[0].category_name
-                if category_name == "person":
-                    bbox = detection.bounding_box
-                    X_person_tl = bbox.origin_x
-                    Y_person_tl = bbox.origin_y
-                    Y_person_br = bbox.origin_y + bbox.height * 7 / 8
-                    X_person_br = bbox.origin_x + bbox.width
-
-                    # Person's bottom-left foot corner (same Y as bottom-right)
-                    X_person_bl = bbox.origin_x + bbox.width / 6
-                    Y_person_bl = bbox.origin_y + bbox.height 
-
-                    # Draw significant points on the frame
-                    point_radius = 5  # Radius of the circle
-                    point_color = (0, 255, 0)  # Green color
-                    point_thickness = -1  # Filled circle
-
-                    # Draw bottom-right foot corner (person_br)
-                    # cv2.circle(detection_frame, (int(X_person_br), int(Y_person_br)), point_radius, point_color, point_thickness)
-
-                    # # Draw bottom-left foot corner (person_bl)
-                    # cv2.circle(detection_frame, (int(X_person_bl), int(Y_person_bl)), point_radius, point_color, point_thickness)
-
-                    # ---------------------
-                    # Stop Zone Checks
-                    # ---------------------
-                    if self.stop_zone is not None:
-                        # 1) Vertical stop line (top_left to bottom_left)
-                        # Similar logic as slow zone vertical line
-                        side_right_foot_stop_vert = point_side_of_line(X_stop_tl, Y_stop_tl, X_stop_bl, Y_stop_bl,
-                                                                    X_person_br, Y_person_br)
-                        inside_right_stop_vert = (side_right_foot_stop_vert < 500)
-
-                        # 2) Horizontal stop line (bottom_left to bottom_right)
-                        # Inside if > 0 means above the line
-                        side_left_foot_stop_horz = point_side_of_line(X_stop_bl2, Y_stop_bl2, X_stop_br, Y_stop_br,
-                                                                    X_person_bl, Y_person_bl)
-                        inside_left_stop_horz = (side_left_foot_stop_horz < 500)
-
-                        stop_confirm_right = point_side_of_line(X_stop_bl2, Y_stop_bl2, X_stop_br, Y_stop_br,
-                                            X_person_br, Y_person_br)
-                        stop_confirm_front = point_side_of_line(X_stop_tl, Y_stop_tl, X_stop_bl, Y_stop_bl,
-                                                                    X_person_bl, Y_person_bl)
-                        stop_confirm = (stop_confirm_right > 0) and (stop_confirm_front > 0)
-
-                        if inside_left_stop_horz and inside_right_stop_vert and not stop_confirm:
-                            # print("Person crosses stop zone horizontal line! (Above)")
-                            cv2.putText(detection_frame, "INSIDE STOP ZONE!", (int(X_person_bl), int(Y_person_bl)),
-                                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                            self.stop_detected = True
-                            
-                        # else:
-                        #     print("Person is on stop zone horizontal boundary!")
-                            # cv2.putText(detection_frame, "STOP ZONE HORIZ BOUNDARY!", (int(X_person_bl), int(Y_person_bl)),
-                            #             cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-                            
-                    # ---------------------
-                    # Slow Zone Checks
-                    # ---------------------
-                    if self.slow_zone is not None:
-                        # 1) Vertical slow line (top_left to bottom_left)
-                        # Using original logic: inside if < 0
-                        
-                        side_right_foot_slow_vert = point_side_of_line(X_slow_tl, Y_slow_tl, X_slow_bl, Y_slow_bl,
-                                                                    X_person_br, Y_person_br)
-                        inside_right_slow_vert = (side_right_foot_slow_vert < 0)
-
-                        side_left_foot_slow_horz = point_side_of_line(X_slow_bl2, Y_slow_bl2, X_slow_br, Y_slow_br,
-                                            X_person_bl, Y_person_bl)
-                        inside_left_slow_horz = (side_left_foot_slow_horz < 0)
-
-                        slow_confirm_right = point_side_of_line(X_slow_bl2, Y_slow_bl2, X_slow_br, Y_slow_br,
-                                            X_person_br, Y_person_br)
-                        slow_confirm_front = point_side_of_line(X_slow_tl, Y_slow_tl, X_slow_bl, Y_slow_bl,
-                                                                    X_person_bl, Y_person_bl)
-                        slow_confirm = (slow_confirm_right > 0) and (slow_confirm_front > 0)
-
-                        if  inside_right_slow_vert and inside_left_slow_horz and not self.stop_detected and not slow_confirm:
-                            # print(f"Person crosses slow zone vertical line! (Right side) {side_right_foot_slow_vert}")
-                            cv2.putText(detection_frame, "INSIDE SLOW ZONE", (int(X_person_tl), int(Y_person_br)),
-                                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-                            self.slow_detected = True
-                        # else:
-                        #     print("Person is not inside slow zone!")
-                            # cv2.putText(detection_frame, "SLOW ZONE >= 0", (int(X_person_tl), int(Y_person_br)),
-                            #             cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-
-                        # print(f"front: {inside_right_slow_vert} Right: {inside_left_slow_horz} Left: {inside_up_slow} ")
-
-        self.detection_result_list.clear()
+            self.tracks_in_zone = []
+
+            # All persons against all zones in one call
+            membership = self.zone_engine.membership(*person_feet)
+            self.stop_detected, self.slow_detected = self.zone_engine.decide(membership)
+            self.zone_held = self.zone_engine.held(*person_feet)
+            stop = self.zone_engine.index("stop")
+            slow = self.zone_engine.index("slow")
+            distances = self.zone_engine.distances(*person_feet)
+            if distances is not None and np.isfinite(distances).any():
+                self.nearest_distance = float(np.nanmin(distances))
+
+            for i, (origin_x, origin_y, width, height) in enumerate(person_boxes):
+                right_foot, left_foot = person_feet[0][i], person_feet[1][i]
+                cv2.circle(detection_frame, (int(right_foot[0]), int(right_foot[1])), 3, (255, 0, 255), -1)
+                cv2.circle(detection_frame, (int(left_foot[0]), int(left_foot[1])), 3, (255, 0, 255), -1)
+                if distances is not None and not np.isnan(distances[i]):
+                    cv2.putText(detection_frame, f"{distances[i]:.1f} m", (int(origin_x), int(origin_y + height) + 14),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+
+                if stop is not None and membership[i, stop]:
+                    cv2.putText(detection_frame, "INSIDE STOP ZONE!", (int(left_foot[0]), int(left_foot[1])),
+                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                elif slow is not None and membership[i, slow]:
+                    cv2.putText(detection_frame, "INSIDE SLOW ZONE", (int(origin_x), int(right_foot[1])),
+                                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+                else:
+                    continue
+                if track_ids is not None:
+                    self.tracks_in_zone.append(int(track_ids[i]))
+
+        telemetry.observe("zone_evaluation", time.perf_counter() - zones_started)
 
         # Convert BGR to QImage for IP camera label
+        render_started = time.perf_counter()
         ip_height, ip_width, ip_channel = detection_frame.shape
         ip_bytes_per_line = ip_channel * ip_width
         ip_qt_image = QImage(detection_frame.data, ip_width, ip_height, ip_bytes_per_line, QImage.Format_BGR888)
@@ -551,10 +652,18 @@ class ObjectPage(QWidget):
 
         # Directly set the pixmap since we already resized the frame
         self.camera_label.setPixmap(ip_qt_pixmap)
+        telemetry.observe("render", time.perf_counter() - render_started)
 
 
     # Update robot state based on detection
-        if self.current_state != "disabled":  # Skip updates if in "disabled" state
+        if self.current_state != "disabled" and self.zone_state is not None:
+            if self.zone_state.state != self.current_state:
+                # Started, or back from vision loss: debounce from the state the robot is in now
+                self.zone_state.reset(self.current_state)
+            self.update_robot_state(self.zone_state.update(self.stop_detected, self.slow_detected, packet.timestamp,
+                                                           self.zone_held))
+            telemetry.gauge("zone_transitions_suppressed", self.zone_state.stats()["suppressed"])
+        elif self.current_state != "disabled":  # Skip updates if in "disabled" state
             if self.stop_detected:
                 self.update_robot_state("stop")
             elif self.slow_detected:
@@ -1,32 +1,37 @@
 import cv2
 import os
-from ultralytics import YOLO
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QHBoxLayout
+    QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QHBoxLayout, QInputDialog
 )
 from PyQt5.QtGui import QImage, QPixmap, QPainter, QPen, QColor, QFont
 from PyQt5.QtCore import QTimer, Qt, QPoint
 import sys
+from utils.detectors import UltralyticsDetector
+from utils.floor import FloorCalibration
+from utils.zones import corners_from_polygon
 
-# Load YOLOv8 model
-model = YOLO("models/capstone_model_2.pt")
+# Load the YOLOv8 zone model (Ultralytics' default thresholds)
+zone_detector = UltralyticsDetector("models/capstone_model_2.pt", score_threshold=0.25, iou_threshold=0.7)
 
 class AdjustableImageLabel(QLabel):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setMouseTracking(True)
-        self.adjustable_boxes = []  # [([ [x_tl,y_tl], [x_tr,y_tr], [x_bl,y_bl], [x_br,y_br] ], cls_id), ...]
+        self.adjustable_boxes = []  # [([ [x0,y0], [x1,y1], ... ] polygon vertices in drawing order, cls_id), ...]
         self.adjustable_colors = {}
         self.dragging = None
         self.captured_image = None
         self.corner_radius = 6
         self.font = QFont("Arial", 10)
+        self.calibrating = False
+        self.calibration_points = []  # [([x, y] pixel, (x, y) floor metres), ...]
+        self.on_calibration_click = None
 
     def set_data(self, image, adjustable_boxes, adjustable_colors, class_names):
         """
         Set the image and boxes data.
         image: BGR frame (numpy array)
-        adjustable_boxes: list of corners and cls_ids
+        adjustable_boxes: list of polygon vertices and cls_ids
         adjustable_colors: dict mapping class_id to (B,G,R)
         class_names: name list from model
         """
@@ -50,38 +55,38 @@ class AdjustableImageLabel(QLabel):
 
     def paintEvent(self, event):
         super().paintEvent(event)
-        if self.captured_image is None or not self.adjustable_boxes:
+        if self.captured_image is None or not (self.adjustable_boxes or self.calibration_points):
             return
         painter = QPainter(self)
         painter.setRenderHint(QPainter.Antialiasing)
 
-        # Draw boxes
-        for corners, cls_id in self.adjustable_boxes:
+        # Draw floor calibration points with their measured position
+        painter.setFont(self.font)
+        for (x, y), (floor_x, floor_y) in self.calibration_points:
+            painter.setPen(QPen(QColor(255, 255, 0), 2))
+            painter.drawLine(x - 6, y, x + 6, y)
+            painter.drawLine(x, y - 6, x, y + 6)
+            painter.drawText(x + 8, y - 4, f"{floor_x:g}, {floor_y:g} m")
+
+        # Draw zones
+        for vertices, cls_id in self.adjustable_boxes:
             color = self.adjustable_colors[cls_id]
             pen = QPen(QColor(color[2], color[1], color[0]), 2)  # Convert BGR to RGB
             painter.setPen(pen)
 
-            # Draw lines between corners
-            # corners: [tl, tr, bl, br]
-            tl = QPoint(corners[0][0], corners[0][1])
-            tr = QPoint(corners[1][0], corners[1][1])
-            bl = QPoint(corners[2][0], corners[2][1])
-            br = QPoint(corners[3][0], corners[3][1])
+            # Draw the closed outline through all vertices
+            points = [QPoint(x, y) for x, y in vertices]
+            for start, end in zip(points, points[1:] + points[:1]):
+                painter.drawLine(start, end)
 
-            painter.drawLine(tl, tr)  # top edge
-            painter.drawLine(tl, bl)  # left edge
-            painter.drawLine(tr, br)  # right edge
-            painter.drawLine(bl, br)  # bottom edge
-
-            # Draw corner circles (white)
+            # Draw vertex circles (white)
             painter.setPen(Qt.NoPen)
             painter.setBrush(QColor(255, 255, 255))
-            painter.drawEllipse(tl, self.corner_radius, self.corner_radius)
-            painter.drawEllipse(tr, self.corner_radius, self.corner_radius)
-            painter.drawEllipse(bl, self.corner_radius, self.corner_radius)
-            painter.drawEllipse(br, self.corner_radius, self.corner_radius)
+            for point in points:
+                painter.drawEllipse(point, self.corner_radius, self.corner_radius)
 
-            # Display class name above top-left corner
+            # Display class name above the first (top-left) vertex
+            tl = points[0]
             painter.setPen(Qt.black)
             painter.setFont(self.font)
             label = f"{self.class_names[cls_id]}"
@@ -100,30 +105,64 @@ class AdjustableImageLabel(QLabel):
             painter.setPen(Qt.black)
             painter.drawText(text_x + 3, text_y, label)
 
+    def vertex_at(self, x, y):
+        """Return (zone index, vertex index) of the vertex near (x, y), or None."""
+        for i, (vertices, cls_id) in enumerate(self.adjustable_boxes):
+            for vertex_idx, (vx, vy) in enumerate(vertices):
+                if abs(x - vx) < 10 and abs(y - vy) < 10:
+                    return i, vertex_idx
+        return None
+
     def mousePressEvent(self, event):
-        if event.button() == Qt.LeftButton and self.captured_image is not None and self.adjustable_boxes:
-            x, y = event.x(), event.y()
-            # Check if near a corner
-            for i, (corners, cls_id) in enumerate(self.adjustable_boxes):
-                for corner_idx, (cx, cy) in enumerate(corners):
-                    if abs(x - cx) < 10 and abs(y - cy) < 10:
-                        self.dragging = (i, corner_idx)
-                        break
-                if self.dragging is not None:
-                    break
+        if self.calibrating and event.button() == Qt.LeftButton and self.captured_image is not None:
+            # While calibrating, clicks mark floor points instead of moving zone corners
+            if self.on_calibration_click is not None:
+                self.on_calibration_click(event.x(), event.y())
+            return
+        if self.captured_image is None or not self.adjustable_boxes:
+            return
+        x, y = event.x(), event.y()
+        if event.button() == Qt.LeftButton:
+            # Check if near a vertex
+            self.dragging = self.vertex_at(x, y)
+        elif event.button() == Qt.RightButton:
+            # Right click removes a vertex, a zone keeps at least 3
+            hit = self.vertex_at(x, y)
+            if hit is not None and len(self.adjustable_boxes[hit[0]][0]) > 3:
+                del self.adjustable_boxes[hit[0]][0][hit[1]]
+                self.update_display()
+
+    def mouseDoubleClickEvent(self, event):
+        """Double click on an edge inserts a vertex there, so zones can follow any floor outline."""
+        if event.button() != Qt.LeftButton or self.captured_image is None:
+            return
+        x, y = event.x(), event.y()
+        best = None
+        for i, (vertices, cls_id) in enumerate(self.adjustable_boxes):
+            for j, (start, end) in enumerate(zip(vertices, vertices[1:] + vertices[:1])):
+                dx, dy = end[0] - start[0], end[1] - start[1]
+                length = dx * dx + dy * dy
+                t = 0 if length == 0 else max(0.0, min(1.0, ((x - start[0]) * dx + (y - start[1]) * dy) / length))
+                distance = (x - start[0] - t * dx) ** 2 + (y - start[1] - t * dy) ** 2
+                if distance < 100 and (best is None or distance < best[0]):
+                    best = (distance, i, j + 1)
+        if best is not None:
+            _, i, position = best
+            self.adjustable_boxes[i][0].insert(position, [max(0, min(x, 399)), max(0, min(y, 299))])
+            self.update_display()
 
     def mouseMoveEvent(self, event):
         if self.dragging is not None:
-            i, corner_idx = self.dragging
-            corners, cls_id = self.adjustable_boxes[i]
+            i, vertex_idx = self.dragging
+            vertices, cls_id = self.adjustable_boxes[i]
 
             # Clamp coordinates to the range [0, 399] for x and [0, 299] for y
-            # This ensures the corner stays within the 400x300 image area.
+            # This ensures the vertex stays within the 400x300 image area.
             new_x = max(0, min(event.x(), 399))
             new_y = max(0, min(event.y(), 299))
 
-            corners[corner_idx] = [new_x, new_y]
-            self.adjustable_boxes[i] = (corners, cls_id)
+            vertices[vertex_idx] = [new_x, new_y]
+            self.adjustable_boxes[i] = (vertices, cls_id)
             self.update_display()
 
     def mouseReleaseEvent(self, event):
@@ -179,8 +218,14 @@ class SetupPage(QWidget):
         self.capture_button_3.clicked.connect(self.confirm)
         button_row_layout.addWidget(self.capture_button_3)
 
-        self.status_label = QLabel("Draw the zone carefully based on the floor")
-        self.status_label.setMaximumHeight(30)
+        self.calibrate_button = QPushButton("Calibrate Floor")
+        self.calibrate_button.clicked.connect(self.toggle_calibration)
+        button_row_layout.addWidget(self.calibrate_button)
+        self.captured_image_label.on_calibration_click = self.add_calibration_point
+
+        self.status_label = QLabel("Draw the zone carefully based on the floor\n"
+                                   "Double click an edge to add a corner, right click a corner to remove it")
+        self.status_label.setMaximumHeight(60)
         self.status_label.setStyleSheet("font-size: 20px; color: black;")
 
         second_col_layout.addLayout(button_row_layout)
@@ -201,6 +246,7 @@ class SetupPage(QWidget):
         #     sys.exit()
 
         # Timer for updating camera stream
+        self.stream = self.main_window.camera.bus.subscribe("setup_page", size=(400, 300), color="rgb")
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_stream)
         self.timer.start(30)  # Update every 30 ms
@@ -217,17 +263,14 @@ class SetupPage(QWidget):
             # Clear previously stored coordinates if needed
             self.main_window.class_coordinates = []
 
-            for corners, cls_id in self.captured_image_label.adjustable_boxes:
+            for vertices, cls_id in self.captured_image_label.adjustable_boxes:
                 class_name = self.captured_image_label.class_names[cls_id]
+                polygon = [(x, y) for x, y in vertices]
                 # Append a dictionary or tuple with all relevant info
                 self.main_window.class_coordinates.append({
                     'class_name': class_name,
-                    'corners': {
-                        'top_left': (corners[0][0], corners[0][1]),
-                        'top_right': (corners[1][0], corners[1][1]),
-                        'bottom_left': (corners[2][0], corners[2][1]),
-                        'bottom_right': (corners[3][0], corners[3][1])
-                    }
+                    'corners': corners_from_polygon(polygon),
+                    'polygon': polygon
                 })
             """
             Save the coordinates for "slow_zone" and "stop_zone" to the database.
@@ -245,7 +288,7 @@ class SetupPage(QWidget):
             slow_corners = slow_zone['corners']
 
             data = (
-                1,  # robot_id
+                self.main_window.robot_id,
                 stop_corners['top_left'][0], stop_corners['top_left'][1],
                 stop_corners['top_right'][0], stop_corners['top_right'][1],
                 stop_corners['bottom_left'][0], stop_corners['bottom_left'][1],
@@ -258,7 +301,8 @@ class SetupPage(QWidget):
 
             # Call the insert_zone method
             try:
-                self.main_window.db.insert_zone(data)
+                self.main_window.zones.save_zones(self.main_window.robot_id, data,
+                                                  polygons=(stop_zone['polygon'], slow_zone['polygon']))
             except Exception as e:
                 print(f"Error saving zones to the database: {e}")
 
@@ -268,34 +312,89 @@ class SetupPage(QWidget):
             self.status_label.setText("No boxes to confirm.")
 
 
+    def toggle_calibration(self):
+        """
+        Start the floor calibration, or finish it and save the homography of this camera.
+        Floor points are measured in metres from the robot base, at least 4 of them on the floor.
+        """
+        label = self.captured_image_label
+        if not label.calibrating:
+            if label.captured_image is None:
+                self.status_label.setText("Capture a frame before calibrating the floor.")
+                return
+            label.calibrating = True
+            label.calibration_points = []
+            self.calibrate_button.setText("Save Calibration")
+            self.status_label.setText("Click 4 or more floor points and enter their\n"
+                                      "position in metres from the robot base")
+            label.update_display()
+            return
+
+        if len(label.calibration_points) < 4:
+            self.status_label.setText("Error: At least 4 floor points are needed.")
+            return
+        try:
+            calibration = FloorCalibration([pixel for pixel, _ in label.calibration_points],
+                                           [floor for _, floor in label.calibration_points])
+        except ValueError as e:
+            self.status_label.setText(f"Error: {e}")
+            return
+
+        try:
+            self.main_window.zones.save_calibration(self.main_window.robot_id, calibration.to_dict())
+        except Exception as e:
+            print(f"Error saving floor calibration to the database: {e}")
+        self.status_label.setText(f"Floor calibrated, error {calibration.error():.2f} m. "
+                                  f"Zones are now checked in metres on the floor.")
+        label.calibrating = False
+        label.calibration_points = []
+        self.calibrate_button.setText("Calibrate Floor")
+        label.update_display()
+
+    def add_calibration_point(self, x, y):
+        text, ok = QInputDialog.getText(self, "Floor Point", "Position in metres from the robot base (x, y):")
+        if not ok:
+            return
+        try:
+            floor_x, floor_y = (float(value) for value in text.replace(";", ",").split(","))
+        except ValueError:
+            self.status_label.setText("Error: Enter the position as x, y in metres.")
+            return
+        self.captured_image_label.calibration_points.append(([x, y], (floor_x, floor_y)))
+        self.status_label.setText(f"{len(self.captured_image_label.calibration_points)} floor point(s) marked")
+        self.captured_image_label.update_display()
+
     def clear(self):
         self.captured_image_label.captured_image = None
         self.captured_image_label.adjustable_boxes = []
+        self.captured_image_label.calibrating = False
+        self.captured_image_label.calibration_points = []
+        self.calibrate_button.setText("Calibrate Floor")
         self.captured_image_label.update_display()
 
     def update_stream(self):
         """Update the camera stream in the first column."""
-        ret, frame = self.main_window.ip_cap.read()
-        if not ret:
-            self.camera_label.setText("Failed to fetch camera stream!")
+        packet = self.stream.poll()
+        if packet is None:
+            if self.stream.last_frame_id == 0:
+                self.camera_label.setText("Failed to fetch camera stream!")
             return
 
-        # Resize and display the frame
-        display_frame = cv2.resize(frame, (400, 300))
-        frame_rgb = cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB)
+        # Resized RGB view shared through the frame bus
+        frame_rgb = self.stream.get(packet)
         height, width, channel = frame_rgb.shape
         bytes_per_line = channel * width
         qt_image = QImage(frame_rgb.data, width, height, bytes_per_line, QImage.Format_RGB888)
         self.camera_label.setPixmap(QPixmap.fromImage(qt_image))
 
         # Save the current frame (original resolution) for capture purposes
-        self.current_frame = frame
+        self.current_frame = packet.frame
 
     def capture_callback(self):
         """Capture the current frame, run YOLO, and show adjustable boxes in the captured_image_label."""
         if self.current_frame is not None:
             # Run YOLO model on the captured frame
-            results = model.predict(self.current_frame)
+            detections = zone_detector.detect(self.current_frame)
 
             adjustable_boxes = []
             adjustable_colors = {}
@@ -312,23 +411,17 @@ class SetupPage(QWidget):
             h_original, w_original = self.current_frame.shape[:2]
             target_w, target_h = 400, 300  # Desired display size in the UI
 
-            # Process detections
-            for r in results:
-                for box in r.boxes:
-                    b_xyxy = box.xyxy[0].cpu().numpy()
-                    x1, y1, x2, y2 = b_xyxy
-                    cls_id = int(box.cls)
-                    confidence = box.conf.item()
-
-                    class_name = model.names[cls_id]
-
-                    # Keep only the box with the highest confidence for each zone
-                    if class_name == "stop_zone":
-                        if not highest_confidence_stop_zone or confidence > highest_confidence_stop_zone[2]:
-                            highest_confidence_stop_zone = (b_xyxy, cls_id, confidence)
-                    elif class_name == "slow_zone":
-                        if not highest_confidence_slow_zone or confidence > highest_confidence_slow_zone[2]:
-                            highest_confidence_slow_zone = (b_xyxy, cls_id, confidence)
+            # Keep only the box with the highest confidence for each zone
+            stop_zones = detections.of_class("stop_zone")
+            if len(stop_zones):
+                best = stop_zones.scores.argmax()
+                highest_confidence_stop_zone = (stop_zones.xyxy()[best], int(stop_zones.class_ids[best]),
+                                                float(stop_zones.scores[best]))
+            slow_zones = detections.of_class("slow_zone")
+            if len(slow_zones):
+                best = slow_zones.scores.argmax()
+                highest_confidence_slow_zone = (slow_zones.xyxy()[best], int(slow_zones.class_ids[best]),
+                                                float(slow_zones.scores[best]))
 
             # If no stop_zone detected, manually create a smaller bounding box in the center
             if not highest_confidence_stop_zone:
@@ -361,8 +454,8 @@ class SetupPage(QWidget):
                 corners = [
                     [x1, y1],  # top-left
                     [x2, y1],  # top-right
-                    [x1, y2],  # bottom-left
-                    [x2, y2]   # bottom-right
+                    [x2, y2],  # bottom-right
+                    [x1, y2]   # bottom-left
                 ]
 
                 adjustable_boxes.append((corners, cls_id))
@@ -385,7 +478,7 @@ class SetupPage(QWidget):
                 scaled_boxes.append((scaled_corners, cls_id))
 
             # Update the label to show the final bounding boxes (stop_zone & slow_zone)
-            self.captured_image_label.set_data(displayed_frame, scaled_boxes, adjustable_colors, model.names)
+            self.captured_image_label.set_data(displayed_frame, scaled_boxes, adjustable_colors, detections.names)
 
 
 if __name__ == "__main__":
@@ -4,8 +4,7 @@ from PyQt5.QtCore import QTimer
 import cv2
 import time
 import numpy as np
-import tensorflow as tf
-from ultralytics import YOLO
+from utils.detectors import TFLiteDetector
 
 
 class TestPage(QWidget):
@@ -43,40 +42,19 @@ class TestPage(QWidget):
 
         # Camera properties
         self.cap = None
+        self.stream = self.main_window.camera.bus.subscribe("test_page")
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_frame)
 
-        # Load TFLite model
-        self.interpreter = tf.lite.Interpreter(model_path=model)
-        self.interpreter.allocate_tensors()
-
-        # Get input and output details
-        self.input_details = self.interpreter.get_input_details()
-        self.output_details = self.interpreter.get_output_details()
+        # Load TFLite model, see TFLiteDetector for the preprocessing and YOLOv8 output decoding
+        self.detector = TFLiteDetector(model)
 
         self.running = True
         self.timer.start(30)
 
-    def preprocess(self, frame):
-        """Preprocess the frame for YOLO model input."""
-        input_shape = self.input_details[0]['shape'][1:3]  # Get input size (e.g., 640x640)
-        frame_resized = cv2.resize(frame, (input_shape[1], input_shape[0]))
-        frame_normalized = frame_resized / 255.0  # Normalize to [0, 1]
-        return np.expand_dims(frame_normalized.astype(np.float32), axis=0)  # Add batch dimension
-
     def detect(self, frame):
         """Run detection on the frame."""
-        input_data = self.preprocess(frame)
-        self.interpreter.set_tensor(self.input_details[0]['index'], input_data)
-        self.interpreter.invoke()
-
-        # Get outputs (e.g., bounding boxes, class IDs, scores)
-        # boxes = self.interpreter.get_tensor(self.output_details[0]['index'])  # Bounding boxes
-        # class_ids = self.interpreter.get_tensor(self.output_details[1]['index'])  # Class IDs
-        # scores = self.interpreter.get_tensor(self.output_details[2]['index'])  # Confidence scores
-        # return boxes, class_ids, scores
-        output_data = self.interpreter.get_tensor(self.output_details[0]['index'])  # Single output tensor
-        print(output_data)
+        return self.detector.detect(frame)
 
     def start_detection(self):
         """Start the camera and detection."""
@@ -97,19 +75,17 @@ class TestPage(QWidget):
 
     def update_frame(self):
         """Read frame, run detection, and update the GUI."""
-        if not self.main_window.ip_cap or not self.main_window.ip_cap.isOpened():
-            self.camera_label.setText("Failed to read camera frame.")
-            return
-
-        ret, frame = self.main_window.ip_cap.read()
-        if not ret:
-            self.camera_label.setText("Failed to capture frame.")
+        packet = self.stream.poll()
+        if packet is None:
+            if self.stream.last_frame_id == 0:
+                self.camera_label.setText("Failed to capture frame.")
             return
+        frame = packet.frame
 
         # Object detection
         if self.running:
-            self.detect(frame)
-            # frame = self.draw_detections(frame, boxes, class_ids, scores)
+            detections = self.detect(frame)
+            frame = self.draw_detections(frame.copy(), detections)  # Bus frames are read-only
 
         # Convert to QImage and display in QLabel
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -117,14 +93,16 @@ class TestPage(QWidget):
         q_img = QImage(rgb_frame.data, w, h, ch * w, QImage.Format_RGB888)
         self.camera_label.setPixmap(QPixmap.fromImage(q_img))
 
-    def draw_detections(self, frame, boxes, class_ids, scores, threshold=0.3):
+    def draw_detections(self, frame, detections, threshold=0.3):
         """Draw detections on the frame."""
-        for box, class_id, score in zip(boxes, class_ids, scores):
+        if detections.masks is not None and len(detections):
+            # One blend over the union of the instance masks
+            union = detections.masks[detections.scores > threshold].any(axis=0)
+            frame[union] = (0.5 * frame[union] + (0, 127, 0)).astype(np.uint8)
+
+        for box, class_id, score in zip(detections.xyxy(), detections.class_ids, detections.scores):
             if score > threshold:
-                # Extract box coordinates and scale them to the frame size
-                ymin, xmin, ymax, xmax = box
-                h, w, _ = frame.shape
-                xmin, xmax, ymin, ymax = int(xmin * w), int(xmax * w), int(ymin * h), int(ymax * h)
+                xmin, ymin, xmax, ymax = box.astype(int)
 
                 # Draw bounding box and label
                 label = f"ID: {int(class_id)} | {score:.2f}"
@@ -0,0 +1,233 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.replay import ReplaySource
+
+
+# (label, backend, model) of the models we can ship
+CANDIDATES = [
+    ("mediapipe-efficientdet_lite0", "mediapipe", "models/efficientdet_lite0.tflite"),
+    ("yolov8n-pt", "ultralytics", "models/yolov8n.pt"),
+    ("yolov8n-ncnn", "ncnn", "models/yolov8n_ncnn_model"),
+    ("yolov8n-seg-fp16-tflite", "tflite", "models/yolov8n-seg_float16.tflite"),
+    ("yolo11n-pose-ncnn", "ncnn", "models/yolo11n-pose_ncnn_model"),
+]
+
+# Backends that ignore the input size and thread settings, they are benchmarked once instead of swept
+FIXED_BACKENDS = {"mediapipe"}
+
+# Hand labelled person boxes of a few images of the default dataset
+DEFAULT_LABELS = "datasets/data/20 Dec/labels.json"
+
+FIELDS = ["name", "backend", "model", "size", "threads", "frames", "fps", "p50_ms", "p95_ms", "p99_ms",
+          "peak_rss_mb", "recall", "error"]
+
+
+def load_labels(path):
+    """
+    Person boxes of a labelled subset, a JSON file {"image name": [[x1, y1, x2, y2], ...]} in pixels of the
+    original images. Images without an entry are not used for recall.
+    :return: {} without a path, raises FileNotFoundError when the file does not exist
+    """
+    if not path:
+        return {}
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Labels file {path} not found")
+    with open(path) as f:
+        return {name: np.asarray(boxes, dtype=np.float32).reshape(-1, 4) for name, boxes in json.load(f).items()}
+
+
+def check_labels(parser, path):
+    """
+    Recall needs a labels file, fail when the given one is missing and warn loudly when none is given,
+    instead of silently reporting an empty recall column.
+    """
+    if path is None:
+        print("WARNING: no --labels given, the recall column stays empty", file=sys.stderr)
+    elif not os.path.exists(path):
+        parser.error(f"labels file {path} not found")
+
+
+def check_coverage(labels, frames, dataset):
+    """
+    Warn when none of the labelled images is part of the replayed dataset, recall would stay empty.
+    """
+    if labels and not any(name in labels for name, _ in frames):
+        print(f"WARNING: none of the labelled images is in {dataset}, the recall column stays empty",
+              file=sys.stderr)
+
+
+def box_iou(a, b):
+    """
+    IoU matrix between (N, 4) and (M, 4) x1, y1, x2, y2 boxes.
+    """
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def load_frames(path, limit=None):
+    """
+    :return: list of (name, frame) from a folder or zip, or numbered frames of a video
+    """
+    source = ReplaySource(path, pacing="max", loop=False)
+    names = source.names or [f"frame_{i:05d}" for i in range(10 ** 6)]
+    frames = []
+    for name, (frame, _) in zip(names, source.frames()):
+        frames.append((os.path.basename(name), frame))
+        if limit and len(frames) >= limit:
+            break
+    return frames
+
+
+def run_config(name, backend, model, size, threads, dataset, labels_path, warmup, repeat, limit):
+    """
+    Benchmark one (model, size, threads) combination. Runs in its own process so peak RSS and thread
+    settings of one run do not leak into the next.
+    """
+    import resource
+
+    row = {"name": name, "backend": backend, "model": model, "size": size, "threads": threads}
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    cv2.setNumThreads(threads)
+    from utils.detectors import create_detector
+
+    frames = load_frames(dataset, limit)
+    labels = load_labels(labels_path)
+    if not frames:
+        raise ValueError(f"No frames in {dataset}")
+    check_coverage(labels, frames, dataset)
+
+    # Frames are resized to the benchmark width before detection, Ultralytics also runs at imgsz=size
+    scaled = []
+    for image_name, frame in frames:
+        scale = size / frame.shape[1]
+        scaled.append((image_name, cv2.resize(frame, (size, int(round(frame.shape[0] * scale)))), scale))
+
+    detector = create_detector(backend, model, threads=threads, imgsz=size)
+    for i in range(warmup):
+        detector.detect(scaled[i % len(scaled)][1])
+
+    latencies = []
+    matched = 0
+    labelled = 0
+    started = time.perf_counter()
+    for run in range(repeat):
+        for image_name, frame, scale in scaled:
+            frame_started = time.perf_counter()
+            persons = detector.detect(frame).persons()
+            latencies.append(time.perf_counter() - frame_started)
+
+            if run == 0 and image_name in labels:
+                truth = labels[image_name]
+                labelled += len(truth)
+                if len(truth) and len(persons):
+                    iou = box_iou(truth, persons.xyxy() / scale)
+                    matched += int(np.count_nonzero(iou.max(axis=1) >= 0.5))
+    elapsed = time.perf_counter() - started
+    detector.close()
+
+    latencies_ms = 1000.0 * np.asarray(latencies)
+    row.update({
+        "frames": len(latencies),
+        "fps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "recall": matched / labelled if labelled else None,
+    })
+    return row
+
+
+def run_isolated(args, queue):
+    try:
+        queue.put(run_config(*args))
+    except Exception as e:
+        queue.put({"name": args[0], "backend": args[1], "model": args[2], "size": args[3], "threads": args[4],
+                   "error": f"{type(e).__name__}: {e}"})
+
+
+def collect(process, queue, name, backend, model, size, threads):
+    """
+    Wait for the result of a benchmark process, a crash inside a native backend becomes an error row.
+    """
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except Exception:
+            if not process.is_alive():
+                return {"name": name, "backend": backend, "model": model, "size": size, "threads": threads,
+                        "error": f"process exited with code {process.exitcode}"}
+
+
+def write_table(rows, output, fmt):
+    stream = open(output, "w", newline="") if output else sys.stdout
+    try:
+        if fmt == "json":
+            for row in rows:
+                stream.write(json.dumps(row) + "\n")
+        else:
+            writer = csv.DictWriter(stream, fieldnames=FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({key: round(value, 3) if isinstance(value, float) else value
+                                 for key, value in row.items()})
+    finally:
+        if output:
+            stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare detector backends on replayed dataset images.")
+    parser.add_argument("--dataset", default="datasets/data/20 Dec", help="Folder, zip or video to replay")
+    parser.add_argument("--labels", default=DEFAULT_LABELS,
+                        help='JSON {"image": [[x1, y1, x2, y2], ...]} person boxes of images in --dataset, '
+                             'recall is only measured with labels')
+    parser.add_argument("--models", nargs="*", help="Candidate names to run, default all available")
+    parser.add_argument("--sizes", nargs="*", type=int, default=[320, 480, 640], help="Input widths")
+    parser.add_argument("--threads", nargs="*", type=int, default=[1, 2, 4], help="Thread counts")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the dataset")
+    parser.add_argument("--limit", type=int, default=None, help="Use only the first N images")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    parser.add_argument("--output", help="Write the table to this file instead of stdout")
+    args = parser.parse_args()
+    check_labels(parser, args.labels)
+
+    candidates = [c for c in CANDIDATES if not args.models or c[0] in args.models]
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for name, backend, model in candidates:
+        if not os.path.exists(model):
+            print(f"Skipping {name}: {model} not found", file=sys.stderr)
+            continue
+        fixed = backend in FIXED_BACKENDS
+        for size in args.sizes[:1] if fixed else args.sizes:
+            for threads in args.threads[:1] if fixed else args.threads:
+                print(f"Running {name} size={size} threads={threads}", file=sys.stderr)
+                queue = context.Queue()
+                process = context.Process(target=run_isolated, args=(
+                    (name, backend, model, size, threads, args.dataset, args.labels, args.warmup, args.repeat,
+                     args.limit), queue))
+                process.start()
+                rows.append(collect(process, queue, name, backend, model, size, threads))
+                process.join()
+
+    write_table(rows, args.output, args.format)
+
+
+if __name__ == "__main__":
+    # python utils/benchmark.py --sizes 320 640 --threads 1 4 --format json --output bench.jsonl
+    main()
@@ -0,0 +1,220 @@
+import threading
+import time
+from utils.frame_bus import FrameBus
+from utils.ingest import CameraSource
+from utils.telemetry import telemetry
+
+
+class CameraStream:
+    def __init__(self, source, settings=None, stale_after=1.0, max_failures=5,
+                 backoff_initial=0.5, backoff_max=10.0, hang_after=15.0, name="camera"):
+        """
+        Continuously decode frames from a camera on a background thread and keep only the newest one.
+
+        A supervisor thread watches the stream. When no frame arrived for `stale_after` seconds the stream
+        is marked as vision lost, the last good frame keeps being served and listeners are notified.
+        The grabber reopens a dead stream with exponential backoff, and a grabber stuck inside FFmpeg for
+        `hang_after` seconds is abandoned and replaced by a fresh one.
+        :param source: RTSP url or camera index, or a frame source object such as ReplaySource
+        :param settings: CaptureSettings for the low-latency ingest, defaults to CaptureSettings.from_env()
+        :param stale_after: Seconds without a new frame before vision is considered lost
+        :param max_failures: Consecutive failed reads before the stream is reopened
+        :param backoff_initial: First delay between reconnect attempts in seconds
+        :param backoff_max: Upper bound of the reconnect delay in seconds
+        :param hang_after: Seconds a single read/open may block before the grabber is replaced
+        :param name: Prefix of this stream's telemetry metrics
+        """
+        if isinstance(source, (str, int)):
+            source = CameraSource(source, settings)
+        self.source = source
+        self.name = name
+        self.stale_after = stale_after
+        self.max_failures = max_failures
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.hang_after = hang_after
+
+        self.reader = None
+        self.bus = FrameBus()
+        self.running = False
+        self.thread = None
+        self.supervisor_thread = None
+        self.generation = 0
+        self.reconnects = 0
+        self.ended = False  # The source has no more frames, e.g. a replay that does not loop
+
+        self.vision_lost = threading.Event()
+        self.listeners = []
+        self.last_frame_time = 0.0
+        self.heartbeat = 0.0
+        telemetry.add_collector(self.telemetry_gauges)
+
+    def isOpened(self):
+        return self.reader is not None
+
+    def start(self):
+        """
+        Start the grabber and supervisor threads. The camera is opened on the grabber thread.
+        """
+        if self.running:
+            return
+        self.running = True
+        self.last_frame_time = time.time()
+        self.start_grabber()
+        self.supervisor_thread = threading.Thread(target=self.supervise, daemon=True)
+        self.supervisor_thread.start()
+
+    def stop(self):
+        """
+        Stop the grabber thread and release the camera.
+        """
+        self.running = False
+        for thread in (self.thread, self.supervisor_thread):
+            if thread is not None:
+                thread.join(timeout=2)
+        self.thread = None
+        self.supervisor_thread = None
+
+    def add_listener(self, callback):
+        """
+        Register callback(vision_lost: bool), called from the supervisor thread whenever the stream is lost
+        or recovers. Keep it short and do not touch Qt widgets from it.
+        """
+        self.listeners.append(callback)
+
+    def start_grabber(self):
+        self.generation += 1
+        self.heartbeat = time.time()
+        self.thread = threading.Thread(target=self.run, args=(self.generation,), daemon=True)
+        self.thread.start()
+
+    def wait(self, seconds, generation):
+        """
+        Sleep in small steps so stop() and the supervisor are not kept waiting.
+        """
+        deadline = time.time() + seconds
+        while self.running and generation == self.generation and time.time() < deadline:
+            self.heartbeat = time.time()
+            time.sleep(0.05)
+
+    def run(self, generation):
+        reader = None
+        failures = 0
+        backoff = self.backoff_initial
+
+        while self.running and generation == self.generation:
+            self.heartbeat = time.time()
+
+            if reader is None:
+                reader = self.source.open()
+                if generation != self.generation:
+                    break  # Replaced by the supervisor while opening
+                if reader is None and getattr(self.source, "finished", False):
+                    # End of stream, not a failure: stop instead of reconnecting forever. The supervisor
+                    # reports vision lost once when the last frame gets stale.
+                    print("Camera source ended, no more frames.")
+                    self.ended = True
+                    break
+                if reader is None:
+                    print(f"Unable to open camera, retrying in {backoff:.1f}s")
+                    self.wait(backoff, generation)
+                    backoff = min(backoff * 2, self.backoff_max)
+                    continue
+                self.reader = reader
+                failures = 0
+                backoff = self.backoff_initial
+
+            ret, frame, timestamp = reader.read()
+            if generation != self.generation:
+                break  # Replaced by the supervisor while blocked in read()
+
+            if not ret or frame is None:
+                failures += 1
+                if failures >= self.max_failures:
+                    print("Camera stream dropped, reconnecting...")
+                    reader.release()
+                    reader = None
+                    self.reader = None
+                    self.reconnects += 1
+                    telemetry.count(f"{self.name}_reconnects")
+                else:
+                    time.sleep(0.01)
+                continue
+
+            failures = 0
+            self.bus.publish(frame, timestamp)
+            self.last_frame_time = time.time()
+            telemetry.mark(f"{self.name}_decoded_frames")
+
+        if reader is not None:
+            reader.release()
+
+    def supervise(self):
+        while self.running:
+            now = time.time()
+            stale = now - self.last_frame_time > self.stale_after
+
+            if stale and not self.vision_lost.is_set():
+                print("Vision lost: no camera frame received.")
+                self.vision_lost.set()
+                self.notify(True)
+            elif not stale and self.vision_lost.is_set():
+                print("Vision restored.")
+                self.vision_lost.clear()
+                self.notify(False)
+
+            if not self.ended and now - self.heartbeat > self.hang_after:
+                # The grabber is stuck inside FFmpeg, leave it behind and reconnect on a new thread
+                print("Camera grabber is blocked, starting a new one.")
+                self.reconnects += 1
+                telemetry.count(f"{self.name}_reconnects")
+                self.start_grabber()
+
+            time.sleep(0.1)
+
+    def notify(self, vision_lost):
+        for callback in self.listeners:
+            try:
+                callback(vision_lost)
+            except Exception as e:
+                print(f"Error in vision listener: {e}")
+
+    def telemetry_gauges(self):
+        """
+        Frame bus drop counters and vision state, read when telemetry is scraped.
+        """
+        gauges = {f"{self.name}_vision_lost": int(self.is_stale())}
+        for subscriber, stats in self.bus.stats().items():
+            gauges[f"{self.name}_{subscriber}_dropped_frames"] = stats["dropped"]
+        return gauges
+
+    def is_stale(self):
+        """
+        True while the frame returned by get_latest_frame is the last good frame of a lost stream.
+        """
+        return self.vision_lost.is_set()
+
+    def get_latest_frame(self):
+        """
+        Return the newest decoded frame without blocking on the camera.
+        The frame is shared with other pages and read-only, copy it before drawing on it.
+        :return: (frame, capture timestamp, frame id), frame is None until the first frame arrives
+        """
+        packet = self.bus.latest()
+        if packet is None:
+            return None, None, 0
+        return packet.frame, packet.timestamp, packet.frame_id
+
+    def latency_stats(self):
+        """
+        Capture-to-availability latency of the recent frames, see LatencyMonitor.stats().
+        """
+        latency = getattr(self.source, "latency", None)
+        return latency.stats() if latency is not None else {}
+
+    def read(self):
+        """
+        cv2.VideoCapture compatible read that returns the newest frame immediately.
+        """
+        frame, _, _ = self.get_latest_frame()
+        return frame is not None, frame
@@ -2,14 +2,16 @@ from pymodbus.client import ModbusTcpClient
 import time
 
 class RobotController:
-    def __init__(self, ip_address = "192.168.0.2", port=502):
+    def __init__(self, ip_address = "192.168.0.2", port=502, observe=None):
         """
         Initialize the RobotController.
         :param ip_address: IP address of the robot controller
         :param port: Modbus TCP port (default is 502)
+        :param observe: Optional callback(name, seconds) timing the register writes, e.g. telemetry.observe
         """
         self.ip_address = ip_address
         self.port = port
+        self.observe = observe
         self.client = None
         self.connected = False
 
@@ -47,12 +49,15 @@ class RobotController:
                 print("Reconnecting...")
                 self.connect()
             
+            started = time.perf_counter()
             try:
                 response = self.client.write_register(register_address*2+1, value, slave=slave_id)
             except BrokenPipeError:
                 self.client = ModbusTcpClient(self.ip_address, port=self.port)
                 self.connected = self.client.connect()
                 response = self.client.write_register(register_address*2+1, value, slave=slave_id)
+            if self.observe is not None:
+                self.observe("modbus_write", time.perf_counter() - started)
 
             if response.isError():
                 raise ValueError(f"Error writing to register {register_address}: {response}")
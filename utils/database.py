@@ -1,15 +1,19 @@
+import json
 import mysql.connector
 from mysql.connector import Error
 from datetime import datetime
+import time
 
 class MySQLHandler:
-    def __init__(self, host="192.168.146.165", user="rpi", password="pi"):
+    def __init__(self, host="192.168.146.165", user="rpi", password="pi", observe=None):
         """
         Initialize the MySQLHandler class with database connection parameters.
+        observe: Optional callback(name, seconds) timing the log inserts, e.g. telemetry.observe.
         """
         self.host = host
         self.user = user
         self.password = password
+        self.observe = observe
         self.database = "sys"
         self.connection = None
 
@@ -63,6 +67,16 @@ class MySQLHandler:
             """)
             print("Verified or created RobotZones table.")
 
+            # Polygon zones with any number of vertices, stored as JSON [[x, y], ...] next to the corner columns
+            cursor.execute("SHOW COLUMNS FROM RobotZones LIKE 'stop_zone_polygon'")
+            if cursor.fetchone() is None:
+                cursor.execute("""
+                    ALTER TABLE RobotZones
+                        ADD COLUMN stop_zone_polygon TEXT NULL,
+                        ADD COLUMN slow_zone_polygon TEXT NULL
+                """)
+                print("Added polygon columns to RobotZones table.")
+
             # Create ZoneLogs table if not exists
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS ZoneLogs (
@@ -74,57 +88,75 @@ class MySQLHandler:
             """)
             print("Verified or created ZoneLogs table.")
 
+            # Create FloorCalibrations table if not exists, one ground plane calibration per robot as JSON
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS FloorCalibrations (
+                    robot_id INT PRIMARY KEY,
+                    calibration TEXT NOT NULL
+                )
+            """)
+            print("Verified or created FloorCalibrations table.")
+
             cursor.close()
         except Error as e:
             print(f"Error ensuring tables exist: '{e}'")
 
-    def insert_log(self, data):
+    def insert_log(self, data, robot_id=1):
         """
         Insert data into the specified table.
+
+        Parameters:
+        - data: A tuple of (zone_type, log_datetime).
+        - robot_id: Robot the log entry belongs to.
         """
         try:
             cursor = self.connection.cursor()
             
-            query = "INSERT INTO ZoneLogs (robot_id, zone_type, log_datetime) VALUES (1, %s, %s)"
-            cursor.execute(query, data)
+            started = time.perf_counter()
+            query = "INSERT INTO ZoneLogs (robot_id, zone_type, log_datetime) VALUES (%s, %s, %s)"
+            cursor.execute(query, (robot_id,) + tuple(data))
             self.connection.commit()
+            if self.observe is not None:
+                self.observe("db_write", time.perf_counter() - started)
             print("Data inserted successfully!")
             cursor.close()
         except Error as e:
             print(f"Error inserting data: '{e}'")
 
-    def zone_available(self):
+    def zone_available(self, robot_id=1):
         try:
             if self.connection is not None:
                 cursor = self.connection.cursor()
 
-                # Check if robot_id = 1 exists
-                check_query = "SELECT COUNT(*) FROM RobotZones WHERE robot_id = 1"
-                cursor.execute(check_query)
+                # Check if the robot has zones
+                check_query = "SELECT COUNT(*) FROM RobotZones WHERE robot_id = %s"
+                cursor.execute(check_query, (robot_id,))
                 result = cursor.fetchone()
                 cursor.close()
                 return result[0] > 0
         except Error as e:
             print(f"Error in insert_or_update_robot_zones: '{e}'")
 
-    def insert_zone(self, data):
+    def insert_zone(self, data, polygons=None):
         """
-        Insert a new record into the RobotZones table if `robot_id = 1` does not exist.
+        Insert a new record into the RobotZones table if the robot (first value of data) does not exist.
         Otherwise, update the record.
         
         Parameters:
         - data: A tuple containing the values for robot_id and all coordinates.
+        - polygons: Optional (stop polygon, slow polygon) lists of (x, y) vertices drawn on the setup page.
+          Without polygons the zones are corners only and stored polygons are cleared.
         """
         try:
             cursor = self.connection.cursor()
 
-            # Check if robot_id = 1 exists
-            check_query = "SELECT COUNT(*) FROM RobotZones WHERE robot_id = 1"
-            cursor.execute(check_query)
+            # Check if the robot already has zones
+            check_query = "SELECT COUNT(*) FROM RobotZones WHERE robot_id = %s"
+            cursor.execute(check_query, (data[0],))
             result = cursor.fetchone()
 
             if result[0] > 0:
-                # If robot_id = 1 exists, update the record
+                # If the robot exists, update the record
                 update_query = """
                     UPDATE RobotZones
                     SET 
@@ -136,12 +168,12 @@ class MySQLHandler:
                         slow_zone_tr_x = %s, slow_zone_tr_y = %s,
                         slow_zone_bl_x = %s, slow_zone_bl_y = %s,
                         slow_zone_br_x = %s, slow_zone_br_y = %s
-                    WHERE robot_id = 1
+                    WHERE robot_id = %s
                 """
-                cursor.execute(update_query, data[1:])  # Exclude robot_id for update
+                cursor.execute(update_query, tuple(data[1:]) + (data[0],))  # robot_id goes last for update
                 print("Record updated successfully!")
             else:
-                # If robot_id = 1 does not exist, insert a new record
+                # If the robot does not exist, insert a new record
                 insert_query = """
                     INSERT INTO RobotZones (
                         robot_id, stop_zone_tl_x, stop_zone_tl_y,
@@ -154,35 +186,117 @@ class MySQLHandler:
                 cursor.execute(insert_query, data)
                 print("Record inserted successfully!")
 
+            # Always written, so corners saved after a polygon do not keep the old polygon (NULL clears it)
+            polygon_query = "UPDATE RobotZones SET stop_zone_polygon = %s, slow_zone_polygon = %s WHERE robot_id = %s"
+            cursor.execute(polygon_query, tuple(
+                json.dumps([[int(x), int(y)] for x, y in polygon]) if polygon else None
+                for polygon in (polygons or (None, None))
+            ) + (data[0],))
+
             # Commit the transaction
             self.connection.commit()
             cursor.close()
         except Error as e:
             print(f"Error in insert_or_update_robot_zones: '{e}'")
 
-    def get_zone_data(self):
+    def insert_calibration(self, robot_id, calibration):
+        """
+        Insert or replace the floor calibration of a robot.
+
+        Parameters:
+        - robot_id: Robot the camera belongs to.
+        - calibration: dict from FloorCalibration.to_dict().
+        """
+        try:
+            cursor = self.connection.cursor()
+            query = """
+                INSERT INTO FloorCalibrations (robot_id, calibration) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE calibration = VALUES(calibration)
+            """
+            cursor.execute(query, (robot_id, json.dumps(calibration)))
+            self.connection.commit()
+            print("Floor calibration saved successfully!")
+            cursor.close()
+        except Error as e:
+            print(f"Error saving floor calibration: '{e}'")
+
+    def get_calibration(self, robot_id=1, strict=False):
+        """
+        Retrieve the floor calibration of a robot as a dict, None when the camera was never calibrated.
+        :param strict: Raise database errors instead of returning None, so a failed query can be told apart
+        """
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT calibration FROM FloorCalibrations WHERE robot_id = %s", (robot_id,))
+            result = cursor.fetchone()
+            cursor.close()
+            return json.loads(result[0]) if result else None
+        except Error as e:
+            print(f"Error retrieving floor calibration: '{e}'")
+            if strict:
+                raise
+            return None
+
+    def get_all_calibrations(self, strict=False):
+        """
+        Retrieve the floor calibrations of all robots as {robot_id: dict}.
+        :param strict: Raise database errors instead of returning {}
+        """
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT robot_id, calibration FROM FloorCalibrations")
+            results = cursor.fetchall()
+            cursor.close()
+            return {robot_id: json.loads(calibration) for robot_id, calibration in results}
+        except Error as e:
+            print(f"Error retrieving floor calibrations: '{e}'")
+            if strict:
+                raise
+            return {}
+
+    def get_all_zone_data(self, strict=False):
+        """
+        Retrieve the RobotZones records of all robots.
+        :param strict: Raise database errors instead of returning []
+        """
+        try:
+            cursor = self.connection.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM RobotZones")
+            results = cursor.fetchall()
+            cursor.close()
+            return results
+        except Error as e:
+            print(f"Error retrieving data: '{e}'")
+            if strict:
+                raise
+            return []
+
+    def get_zone_data(self, robot_id=1, strict=False):
         """
         Retrieve data from the RobotZones table based on a condition.
+        :param strict: Raise database errors instead of returning [], so a failed query can be told apart
         """
         try:
             cursor = self.connection.cursor(dictionary=True)
-            query = f"SELECT * FROM RobotZones WHERE robot_id = 1"
-            cursor.execute(query)
+            query = "SELECT * FROM RobotZones WHERE robot_id = %s"
+            cursor.execute(query, (robot_id,))
             results = cursor.fetchall()
             cursor.close()
             return results
         except Error as e:
             print(f"Error retrieving data: '{e}'")
+            if strict:
+                raise
             return []
 
-    def get_log_data(self):
+    def get_log_data(self, robot_id=1):
         """
         Retrieve data from the ZoneLogs table based on a condition.
         """
         try:
             cursor = self.connection.cursor(dictionary=True)
-            query = f"SELECT * FROM ZoneLogs where robot_id = 1"
-            cursor.execute(query)
+            query = "SELECT * FROM ZoneLogs where robot_id = %s"
+            cursor.execute(query, (robot_id,))
             results = cursor.fetchall()
             cursor.close()
             return results
@@ -190,7 +304,7 @@ class MySQLHandler:
             print(f"Error retrieving log data: '{e}'")
             return []
         
-    def get_log_data_today(self):
+    def get_log_data_today(self, robot_id=1):
         """
         Retrieve data from the ZoneLogs table for logs created today.
         """
@@ -200,8 +314,8 @@ class MySQLHandler:
 
             # Query to filter logs based on today's date
             cursor = self.connection.cursor(dictionary=True)
-            query = f"SELECT * FROM ZoneLogs WHERE DATE(log_datetime) = '{today_date}' and robot_id = 1 order by Id desc"
-            cursor.execute(query)
+            query = "SELECT * FROM ZoneLogs WHERE DATE(log_datetime) = %s and robot_id = %s order by Id desc"
+            cursor.execute(query, (today_date, robot_id))
             results = cursor.fetchall()
             cursor.close()
             return results
@@ -0,0 +1,162 @@
+import threading
+import time
+import numpy as np
+
+from utils.detectors import create_detector
+from utils.telemetry import telemetry
+
+
+class ResultSlot:
+    def __init__(self):
+        """
+        Bounded latest-wins channel of size one between the detector thread and the GUI.
+        A result that is replaced before anybody took it is counted as dropped.
+        """
+        self.lock = threading.Lock()
+        self.item = None
+        self.stored = 0
+        self.taken = 0
+        self.dropped = 0
+
+    def put(self, item):
+        with self.lock:
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.stored += 1
+
+    def take(self):
+        """
+        :return: The newest unconsumed item or None, never blocks
+        """
+        with self.lock:
+            item = self.item
+            self.item = None
+            if item is not None:
+                self.taken += 1
+            return item
+
+
+class DetectionResult:
+    def __init__(self, detections, timestamp, latency):
+        """
+        A finished detection.
+        :param detections: Detections of the frame
+        :param timestamp: Capture timestamp of the frame the result was computed on, in seconds
+        :param latency: Seconds between submitting the frame and the result arriving
+        """
+        self.detections = detections
+        self.timestamp = timestamp
+        self.latency = latency
+
+
+class DetectionWorker:
+    def __init__(self, detector=None, fps_avg_frame_count=10):
+        """
+        Runs a Detector backend (see utils/detectors.py) on its own thread.
+
+        submit() never blocks: while the previous frame is still being processed the frame is skipped and
+        counted. Results are written to a ResultSlot, the GUI takes the newest one with latest() and never
+        sees results that piled up between ticks.
+        :param detector: Detector, defaults to create_detector() which follows CAPSTONE_DETECTOR
+        :param fps_avg_frame_count: Results averaged for the detection FPS
+        """
+        self.detector = detector if detector is not None else create_detector()
+        self.fps_avg_frame_count = fps_avg_frame_count
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.frame = None
+        self.timestamp = None
+        self.submitted_at = None
+        self.busy = False
+        self.slot = ResultSlot()
+        self.submitted = 0
+        self.skipped = 0
+        self.completed = 0
+        self.fps = 0.0
+        self.fps_start = time.time()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, timestamp):
+        """
+        Hand a frame to the detector unless it is busy.
+        :param frame: BGR frame, copied into the worker's own buffer so the caller may reuse it right away
+        :param timestamp: Capture timestamp in seconds
+        :return: True if the frame was submitted, False if it was skipped
+        """
+        with self.lock:
+            if self.busy:
+                self.skipped += 1
+                return False
+            if self.frame is None or self.frame.shape != frame.shape:
+                self.frame = np.empty_like(frame)
+            np.copyto(self.frame, frame)
+            self.timestamp = timestamp
+            self.submitted_at = time.perf_counter()
+            self.busy = True
+            self.submitted += 1
+            telemetry.gauge("detector_queue_depth", 1)
+        self.wake.set()
+        return True
+
+    def run(self):
+        while self.running:
+            if not self.wake.wait(timeout=0.1):
+                continue
+            self.wake.clear()
+            if not self.running:
+                break
+
+            try:
+                detections = self.detector.detect(self.frame)
+            except Exception as e:
+                print(f"Detection error: {e}")
+                detections = None
+            latency = time.perf_counter() - self.submitted_at
+            if detections is not None:
+                telemetry.observe("detector_inference", latency)
+                self.slot.put(DetectionResult(detections, self.timestamp, latency))
+
+            with self.lock:
+                self.busy = False
+                self.completed += 1
+                telemetry.gauge("detector_queue_depth", 0)
+
+                # Calculate the FPS
+                if self.completed % self.fps_avg_frame_count == 0:
+                    self.fps = self.fps_avg_frame_count / (time.time() - self.fps_start)
+                    self.fps_start = time.time()
+
+    def in_flight(self):
+        """
+        Number of submitted frames whose result has not arrived yet.
+        """
+        with self.lock:
+            return 1 if self.busy else 0
+
+    def latest(self):
+        """
+        :return: The newest DetectionResult not consumed yet, or None
+        """
+        return self.slot.take()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "submitted": self.submitted,
+                "skipped": self.skipped,
+                "completed": self.completed,
+                "in_flight": 1 if self.busy else 0,
+                "results_dropped": self.slot.dropped,
+                "fps": self.fps,
+            }
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self.thread.join(timeout=2)
+        self.detector.close()
@@ -0,0 +1,428 @@
+import os
+import cv2
+import numpy as np
+
+from utils.preprocess import FramePreprocessor
+
+
+DEFAULT_MODELS = {
+    "mediapipe": "models/efficientdet_lite0.tflite",
+    "ultralytics": "models/yolov8n.pt",
+    "ncnn": "models/yolov8n_ncnn_model",
+    "tflite": "models/yolov8n-seg_float16.tflite",
+    "pose": "models/yolo11n-pose_ncnn_model",
+}
+
+
+class Detections:
+    def __init__(self, boxes, scores, class_ids, names, masks=None, keypoints=None):
+        """
+        Compact detection result shared by all backends.
+        :param boxes: float32 array (N, 4) as origin_x, origin_y, width, height in pixels of the input frame
+        :param scores: float32 array (N,)
+        :param class_ids: int32 array (N,)
+        :param names: dict class id -> class name
+        :param masks: Optional bool array (N, height, width) of instance masks in pixels of the input frame
+        :param keypoints: Optional float32 array (N, 17, 3) of COCO keypoints as x, y, confidence in pixels
+                          of the input frame, see utils/zones.py for the ankles
+        """
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.class_ids = np.asarray(class_ids, dtype=np.int32).reshape(-1)
+        self.names = names
+        self.masks = masks
+        self.keypoints = keypoints
+
+    @classmethod
+    def empty(cls, names=None):
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0), names or {})
+
+    def __len__(self):
+        return len(self.scores)
+
+    def select(self, keep):
+        """
+        Subset by boolean mask or index array.
+        """
+        masks = self.masks[keep] if self.masks is not None else None
+        keypoints = self.keypoints[keep] if self.keypoints is not None else None
+        return Detections(self.boxes[keep], self.scores[keep], self.class_ids[keep], self.names, masks, keypoints)
+
+    def class_id(self, name):
+        for class_id, class_name in self.names.items():
+            if class_name == name:
+                return class_id
+        return None
+
+    def of_class(self, name):
+        class_id = self.class_id(name)
+        if class_id is None:
+            return self.select(np.zeros(len(self), dtype=bool))
+        return self.select(self.class_ids == class_id)
+
+    def persons(self):
+        return self.of_class("person")
+
+    def mask_overlap(self, region):
+        """
+        Fraction of each instance mask inside a region, so segmented persons can be tested against a zone.
+        :param region: bool array (height, width) in pixels of the input frame
+        :return: float32 array (N,), None if the backend produced no masks
+        """
+        if self.masks is None:
+            return None
+        area = self.masks.sum(axis=(1, 2))
+        inside = (self.masks & region).sum(axis=(1, 2))
+        return (inside / np.maximum(area, 1)).astype(np.float32)
+
+    def transformed(self, scale_x, scale_y, offset_x=0.0, offset_y=0.0):
+        """
+        Boxes mapped with x * scale_x + offset_x and y * scale_y + offset_y, e.g. from a crop or a
+        resized frame back into the coordinates of the original frame. Masks are left out.
+        """
+        boxes = self.boxes * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)
+        boxes[:, 0] += offset_x
+        boxes[:, 1] += offset_y
+        keypoints = None
+        if self.keypoints is not None:
+            keypoints = self.keypoints * np.array([scale_x, scale_y, 1.0], dtype=np.float32)
+            keypoints[:, :, 0] += offset_x
+            keypoints[:, :, 1] += offset_y
+        return Detections(boxes, self.scores, self.class_ids, self.names, keypoints=keypoints)
+
+    def xyxy(self):
+        """
+        Boxes as x1, y1, x2, y2.
+        """
+        xyxy = self.boxes.copy()
+        xyxy[:, 2:] += xyxy[:, :2]
+        return xyxy
+
+
+class Detector:
+    """
+    Common interface of the inference backends: detect() takes a decoded BGR frame of any size and
+    returns Detections in pixels of that frame.
+    """
+    name = "detector"
+    input_size = None  # (width, height) the model runs at, None when the backend does not expose it
+
+    def detect(self, frame):
+        raise NotImplementedError
+
+    def detect_batch(self, frames):
+        """
+        Detections of several frames, backends with a batch API override this.
+        """
+        return [self.detect(frame) for frame in frames]
+
+    def close(self):
+        pass
+
+
+class MediaPipeDetector(Detector):
+    name = "mediapipe"
+
+    def __init__(self, model=DEFAULT_MODELS["mediapipe"], max_results=5, score_threshold=0.3, **unused):
+        """
+        MediaPipe Tasks object detector (efficientdet_lite0) in IMAGE mode.
+        """
+        import mediapipe as mp
+        from mediapipe.tasks import python
+        from mediapipe.tasks.python import vision
+
+        self.mp = mp
+        base_options = python.BaseOptions(model_asset_path=model)
+        options = vision.ObjectDetectorOptions(base_options=base_options,
+                                               running_mode=vision.RunningMode.IMAGE,
+                                               max_results=max_results, score_threshold=score_threshold)
+        self.detector = vision.ObjectDetector.create_from_options(options)
+        self.preprocessor = FramePreprocessor()
+        self.names = {}
+
+    def detect(self, frame):
+        rgb = self.preprocessor.buffer("rgb", frame.shape)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+        result = self.detector.detect(self.mp.Image(image_format=self.mp.ImageFormat.SRGB, data=rgb))
+
+        count = len(result.detections)
+        boxes = np.empty((count, 4), dtype=np.float32)
+        scores = np.empty(count, dtype=np.float32)
+        class_ids = np.empty(count, dtype=np.int32)
+        for i, detection in enumerate(result.detections):
+            bbox = detection.bounding_box
+            category = detection.categories[0]
+            boxes[i] = (bbox.origin_x, bbox.origin_y, bbox.width, bbox.height)
+            scores[i] = category.score
+            class_ids[i] = category.index
+            self.names[category.index] = category.category_name
+        return Detections(boxes, scores, class_ids, self.names)
+
+    def close(self):
+        self.detector.close()
+
+
+class UltralyticsDetector(Detector):
+    name = "ultralytics"
+
+    def __init__(self, model=DEFAULT_MODELS["ultralytics"], imgsz=640, score_threshold=0.3, iou_threshold=0.45,
+                 threads=None, **unused):
+        """
+        Ultralytics YOLO model, a .pt file or any export Ultralytics can load (NCNN, TFLite, ONNX).
+        Detect, segment and pose models all work, only their boxes are used here.
+        :param threads: Torch CPU threads, None keeps the default
+        """
+        from ultralytics import YOLO
+
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = YOLO(model)
+        self.imgsz = imgsz
+        self.input_size = (imgsz, imgsz)
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+
+    def detect(self, frame):
+        result = self.model.predict(frame, imgsz=self.imgsz, conf=self.score_threshold, iou=self.iou_threshold,
+                                    verbose=False)[0]
+        return self.to_detections(result)
+
+    def detect_batch(self, frames):
+        results = self.model.predict(list(frames), imgsz=self.imgsz, conf=self.score_threshold,
+                                     iou=self.iou_threshold, verbose=False)
+        return [self.to_detections(result) for result in results]
+
+    @staticmethod
+    def to_detections(result):
+        boxes = result.boxes.xyxy.cpu().numpy()
+        boxes[:, 2:] -= boxes[:, :2]
+        return Detections(boxes, result.boxes.conf.cpu().numpy(), result.boxes.cls.cpu().numpy(), result.names)
+
+
+class NcnnDetector(UltralyticsDetector):
+    name = "ncnn"
+
+    def __init__(self, model=DEFAULT_MODELS["ncnn"], **options):
+        """
+        NCNN export of a YOLO model (see utils/ncnn_creator.py), run through the Ultralytics NCNN backend.
+        """
+        if not os.path.isdir(model):
+            raise ValueError(f"{model} is not an NCNN export folder")
+        super().__init__(model, **options)
+
+
+class PoseDetector(UltralyticsDetector):
+    name = "pose"
+
+    def __init__(self, model=DEFAULT_MODELS["pose"], **options):
+        """
+        YOLO pose model (yolo11n-pose, see "Core Pose Estimation Collection"). One pass gives the person boxes
+        and their keypoints, the ankles are used as ground contact points by the zone checks.
+        """
+        super().__init__(model, **options)
+
+    @staticmethod
+    def to_detections(result):
+        detections = UltralyticsDetector.to_detections(result)
+        if result.keypoints is not None and len(detections):
+            detections.keypoints = result.keypoints.data.cpu().numpy().astype(np.float32).reshape(-1, 17, 3)
+        return detections
+
+
+class TFLiteDetector(Detector):
+    name = "tflite"
+
+    def __init__(self, model=DEFAULT_MODELS["tflite"], threads=None, score_threshold=0.3, iou_threshold=0.45,
+                 num_classes=80, names=None, classes=(0,), max_candidates=300, **unused):
+        """
+        Raw TFLite interpreter for Ultralytics YOLOv8 detect and segment exports.
+
+        Post-processing is vectorised NumPy: box decode, class argmax, confidence filter, batched NMS and,
+        for segmentation models, prototype mask assembly for the kept instances only.
+        :param threads: Interpreter threads, defaults to all cores
+        :param num_classes: Classes of the model, the remaining output channels are mask coefficients
+        :param names: dict class id -> name, defaults to COCO where class 0 is person
+        :param classes: Class ids to keep (persons by default), None keeps all
+        :param max_candidates: Highest scoring boxes passed to NMS
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.interpreter = Interpreter(model_path=model, num_threads=threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        self.input_height, self.input_width = self.input_details[0]['shape'][1:3]
+        self.input_size = (int(self.input_width), int(self.input_height))
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self.num_classes = num_classes
+        self.names = names or {0: "person"}
+        self.classes = None if classes is None else np.asarray(classes)
+        self.max_candidates = max_candidates
+        self.preprocessor = FramePreprocessor()
+
+        # Segmentation exports have a second, 4D output with the mask prototypes
+        self.detection_output = None
+        self.proto_output = None
+        for output in self.output_details:
+            if len(output['shape']) == 3:
+                self.detection_output = output
+            elif len(output['shape']) == 4:
+                self.proto_output = output
+
+    def output(self, details):
+        """
+        Output tensor as float32, dequantised for INT8 models.
+        """
+        tensor = self.interpreter.get_tensor(details['index'])
+        if tensor.dtype != np.float32:
+            scale, zero_point = details['quantization']
+            tensor = (tensor.astype(np.float32) - zero_point) * scale
+        return tensor
+
+    def detect(self, frame):
+        input_data = self.preprocessor.tensor(frame, (self.input_width, self.input_height))
+        if self.input_details[0]['dtype'] != np.float32:
+            scale, zero_point = self.input_details[0]['quantization']
+            input_data = np.clip(np.round(input_data / scale + zero_point),
+                                 np.iinfo(self.input_details[0]['dtype']).min,
+                                 np.iinfo(self.input_details[0]['dtype']).max).astype(self.input_details[0]['dtype'])
+        self.interpreter.set_tensor(self.input_details[0]['index'], input_data)
+        self.interpreter.invoke()
+        output = self.output(self.detection_output)
+        protos = self.output(self.proto_output) if self.proto_output is not None else None
+        return self.decode(output, frame.shape[1], frame.shape[0], protos)
+
+    def decode(self, output, frame_width, frame_height, protos=None):
+        """
+        Decode a (1, 4 + classes [+ mask coefficients], anchors) YOLOv8 output.
+        :param protos: Optional (1, mask height, mask width, coefficients) prototypes of a segmentation model
+        """
+        predictions = output[0].T  # (anchors, channels), a view
+        class_scores = predictions[:, 4:4 + self.num_classes]
+        if self.classes is not None:
+            class_scores = class_scores[:, self.classes]
+        best = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(best)), best]
+        candidates = np.flatnonzero(scores > self.score_threshold)
+        if len(candidates) == 0:
+            return Detections.empty(self.names)
+        if len(candidates) > self.max_candidates:
+            candidates = candidates[np.argsort(scores[candidates])[::-1][:self.max_candidates]]
+
+        class_ids = best[candidates] if self.classes is None else self.classes[best[candidates]]
+        scores = scores[candidates]
+        boxes = predictions[candidates, :4].astype(np.float32)
+
+        # cx, cy, w, h -> origin_x, origin_y, w, h in input pixels. Recent exports are normalised to [0, 1].
+        if boxes.max() <= 2.0:
+            boxes *= np.array([self.input_width, self.input_height] * 2, dtype=np.float32)
+        boxes[:, :2] -= boxes[:, 2:] / 2
+        boxes *= np.array([frame_width / self.input_width, frame_height / self.input_height] * 2, dtype=np.float32)
+
+        keep = batched_nms(boxes, scores, class_ids, self.iou_threshold)
+        boxes, scores, class_ids = boxes[keep], scores[keep], class_ids[keep]
+
+        masks = None
+        if protos is not None:
+            coefficients = predictions[candidates[keep], 4 + self.num_classes:]
+            masks = assemble_masks(coefficients, protos[0], boxes, frame_width, frame_height)
+        return Detections(boxes, scores, class_ids, self.names, masks)
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold):
+    """
+    Greedy per-class non-maximum suppression, vectorised over the remaining boxes of each step.
+    Classes are separated by offsetting their boxes so they never overlap each other.
+    :param boxes: (N, 4) origin_x, origin_y, width, height
+    :return: Indices of the kept boxes, highest score first
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offset = class_ids.astype(np.float32)[:, None] * (float((boxes[:, :2] + boxes[:, 2:]).max()) + 1.0)
+    x1y1 = boxes[:, :2] + offset
+    x2y2 = x1y1 + boxes[:, 2:]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    order = np.argsort(scores)[::-1]
+    keep = []
+    while len(order):
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        size = np.clip(np.minimum(x2y2[i], x2y2[rest]) - np.maximum(x1y1[i], x1y1[rest]), 0, None)
+        intersection = size[:, 0] * size[:, 1]
+        iou = intersection / (areas[i] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def assemble_masks(coefficients, protos, boxes, frame_width, frame_height):
+    """
+    Instance masks from YOLOv8-seg prototypes: sigmoid(coefficients @ protos) > 0.5, scaled to the frame
+    in one resize and cropped to each box.
+    :param coefficients: (N, C) mask coefficients of the kept instances
+    :param protos: (mask height, mask width, C) prototypes, (C, mask height, mask width) is accepted too
+    :param boxes: (N, 4) origin_x, origin_y, width, height in frame pixels
+    :return: bool array (N, frame_height, frame_width)
+    """
+    count = len(coefficients)
+    if count == 0:
+        return np.zeros((0, frame_height, frame_width), dtype=bool)
+    if protos.shape[0] == coefficients.shape[1]:
+        protos = protos.transpose(1, 2, 0)
+    mask_height, mask_width, channels = protos.shape
+
+    # Logits > 0 is the same as sigmoid > 0.5, no need for the exponential
+    logits = protos.reshape(-1, channels) @ coefficients.T  # (mask pixels, N)
+    logits = logits.reshape(mask_height, mask_width, count).astype(np.float32)
+    scaled = np.empty((frame_height, frame_width, count), dtype=np.float32)
+    for start in range(0, count, 512):  # cv2.resize handles at most 512 channels
+        chunk = cv2.resize(logits[:, :, start:start + 512], (frame_width, frame_height),
+                           interpolation=cv2.INTER_LINEAR)
+        scaled[:, :, start:start + 512] = chunk.reshape(frame_height, frame_width, -1)
+    masks = scaled.transpose(2, 0, 1) > 0
+
+    xs = np.arange(frame_width, dtype=np.float32)
+    ys = np.arange(frame_height, dtype=np.float32)
+    inside_x = (xs >= boxes[:, 0:1]) & (xs < boxes[:, 0:1] + boxes[:, 2:3])
+    inside_y = (ys >= boxes[:, 1:2]) & (ys < boxes[:, 1:2] + boxes[:, 3:4])
+    masks &= inside_y[:, :, None] & inside_x[:, None, :]
+    return masks
+
+
+BACKENDS = {
+    "mediapipe": MediaPipeDetector,
+    "ultralytics": UltralyticsDetector,
+    "ncnn": NcnnDetector,
+    "tflite": TFLiteDetector,
+    "pose": PoseDetector,
+}
+
+
+def create_detector(backend=None, model=None, **options):
+    """
+    Create the configured detector backend.
+
+    Without arguments the backend comes from CAPSTONE_DETECTOR (mediapipe, ultralytics, ncnn, tflite or pose) and
+    the model from CAPSTONE_DETECTOR_MODEL, with CAPSTONE_DETECTOR_THREADS, CAPSTONE_DETECTOR_IMGSZ and
+    CAPSTONE_DETECTOR_SCORE as optional tuning.
+    :return: Detector
+    """
+    backend = backend or os.environ.get("CAPSTONE_DETECTOR", "mediapipe")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown detector backend '{backend}', choose one of {', '.join(BACKENDS)}")
+    model = model or os.environ.get("CAPSTONE_DETECTOR_MODEL") or DEFAULT_MODELS[backend]
+
+    if "CAPSTONE_DETECTOR_THREADS" in os.environ:
+        options.setdefault("threads", int(os.environ["CAPSTONE_DETECTOR_THREADS"]))
+    if "CAPSTONE_DETECTOR_IMGSZ" in os.environ:
+        options.setdefault("imgsz", int(os.environ["CAPSTONE_DETECTOR_IMGSZ"]))
+    if "CAPSTONE_DETECTOR_SCORE" in os.environ:
+        options.setdefault("score_threshold", float(os.environ["CAPSTONE_DETECTOR_SCORE"]))
+    return BACKENDS[backend](model, **options)
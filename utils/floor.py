@@ -0,0 +1,155 @@
+import os
+import cv2
+import numpy as np
+
+
+def floor_radii():
+    """
+    Metric zone radii around the robot from CAPSTONE_STOP_DISTANCE / CAPSTONE_SLOW_DISTANCE (metres).
+    :return: dict zone kind -> radius, empty when none is configured
+    """
+    return floor_settings("DISTANCE")
+
+
+def floor_margins():
+    """
+    Metric margins around the drawn zones from CAPSTONE_STOP_MARGIN / CAPSTONE_SLOW_MARGIN (metres).
+    :return: dict zone kind -> margin, empty when none is configured
+    """
+    return floor_settings("MARGIN")
+
+
+def floor_settings(suffix):
+    values = {}
+    for name in ("stop", "slow"):
+        value = os.environ.get(f"CAPSTONE_{name.upper()}_{suffix}")
+        if value:
+            values[name] = float(value)
+    return values
+
+
+class FloorCalibration:
+    def __init__(self, image_points, floor_points, size=(400, 300)):
+        """
+        Ground plane calibration of one camera.
+
+        Four or more floor points are clicked in the image and their floor positions are measured in metres
+        from the robot base. The homography between the two maps any image point on the floor to its floor
+        position. It is evaluated once for every pixel into a lookup table, so the floor position and the
+        distance to the robot of a foot point cost a single table read per frame.
+        :param image_points: (N, 2) clicked pixels at the processing resolution, N >= 4
+        :param floor_points: (N, 2) floor positions of these pixels in metres, the robot base at (0, 0)
+        :param size: (width, height) of the image the points were clicked on
+        """
+        self.image_points = np.asarray(image_points, dtype=np.float64).reshape(-1, 2)
+        self.floor_points = np.asarray(floor_points, dtype=np.float64).reshape(-1, 2)
+        self.size = tuple(size)
+        if len(self.image_points) < 4 or len(self.image_points) != len(self.floor_points):
+            raise ValueError("A floor calibration needs at least 4 image points with a floor position each")
+
+        # Least squares over all points, every click is a measured point so none is treated as an outlier
+        self.homography, _ = cv2.findHomography(self.image_points, self.floor_points, 0)
+        if self.homography is None:
+            raise ValueError("Floor points are degenerate, use 4 points of which no 3 lie on a line")
+        # The homography is only defined up to scale, make w positive on the floor so the horizon test works
+        if np.median(np.c_[self.image_points, np.ones(len(self.image_points))] @ self.homography[2]) < 0:
+            self.homography = -self.homography
+
+        # x, y on the floor and the distance to the robot for every pixel, NaN above the horizon
+        width, height = self.size
+        xs, ys = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        projected = np.stack([xs, ys, np.ones_like(xs)], axis=-1) @ self.homography.T
+        w = projected[..., 2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            floor = projected[..., :2] / w[..., None]
+        floor[w <= 0] = np.nan
+        self.lut = np.concatenate([floor, np.linalg.norm(floor, axis=-1, keepdims=True)], axis=-1).astype(np.float32)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["image_points"], data["floor_points"], data.get("size", (400, 300)))
+
+    def to_dict(self):
+        return {"image_points": self.image_points.tolist(), "floor_points": self.floor_points.tolist(),
+                "size": list(self.size)}
+
+    def lookup(self, points):
+        """
+        :param points: (N, 2) x, y pixels
+        :return: float32 (N, 3) floor x, floor y and distance to the robot in metres, NaN outside the frame
+        """
+        points = np.round(np.asarray(points, dtype=np.float32).reshape(-1, 2))
+        width, height = self.size
+        valid = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+        x = np.clip(points[:, 0], 0, width - 1).astype(np.intp)
+        y = np.clip(points[:, 1], 0, height - 1).astype(np.intp)
+        return np.where(valid[:, None], self.lut[y, x], np.nan)
+
+    def distances(self, right_feet, left_feet):
+        """
+        :return: float32 (N,) distance of the foot nearer to the robot in metres, NaN when neither is on the floor
+        """
+        distances = np.stack([self.lookup(right_feet)[:, 2], self.lookup(left_feet)[:, 2]], axis=1)
+        nearest = np.where(np.isnan(distances), np.inf, distances).min(axis=1)
+        return np.where(np.isinf(nearest), np.nan, nearest).astype(np.float32)
+
+    def to_floor(self, image_points):
+        """
+        Project image points onto the floor.
+        :return: (N, 2) floor positions in metres, None when a point lies on or above the horizon
+        """
+        points = np.asarray(image_points, dtype=np.float64).reshape(-1, 2)
+        if (np.c_[points, np.ones(len(points))] @ self.homography[2] <= 0).any():
+            return None
+        return cv2.perspectiveTransform(points.reshape(-1, 1, 2), self.homography).reshape(-1, 2)
+
+    def zone_mask(self, outline, margin=0.0, radius=None, resolution=0.02):
+        """
+        Pixels whose floor position lies in a zone, tested in metres on the floor.
+
+        The outline drawn in the image is projected onto the floor and rasterized there at `resolution` metres
+        per cell. A margin grows the floor polygon by that many metres in every direction, and with a radius
+        everything closer to the robot is in the zone as well. Every pixel then reads its cell through the
+        floor position table, so the per-frame test stays a single lookup.
+        :param outline: (N, 2) zone vertices in pixels, see zones.zone_points()
+        :param margin: Metres around the floor polygon that still count as inside
+        :param radius: Optional distance to the robot in metres that always counts as inside
+        :return: bool (height, width) mask, None when the outline reaches above the horizon
+        """
+        polygon = self.to_floor(outline)
+        if polygon is None:
+            return None
+        origin = polygon.min(axis=0) - margin - resolution
+        extent = polygon.max(axis=0) + margin + resolution - origin
+        resolution = max(resolution, float(extent.max()) / 2000)  # At most 2000 x 2000 cells
+        cells_x, cells_y = (np.ceil(extent / resolution).astype(int) + 1).tolist()
+        grid = np.zeros((cells_y, cells_x), dtype=np.uint8)
+        cv2.fillPoly(grid, [np.round((polygon - origin) / resolution).astype(np.int32)], 1)
+        if margin > 0:
+            grid = (cv2.distanceTransform(1 - grid, cv2.DIST_L2, 5) * resolution <= margin).astype(np.uint8)
+
+        floor = self.lut[:, :, :2]
+        cells = np.round((floor - origin) / resolution)
+        valid = ~np.isnan(cells).any(axis=-1)
+        cells = np.where(valid[..., None], cells, -1)
+        valid &= (cells[..., 0] >= 0) & (cells[..., 0] < cells_x) & (cells[..., 1] >= 0) & (cells[..., 1] < cells_y)
+        x = np.clip(cells[..., 0], 0, cells_x - 1).astype(np.intp)
+        y = np.clip(cells[..., 1], 0, cells_y - 1).astype(np.intp)
+        mask = valid & (grid[y, x] > 0)
+        if radius is not None:
+            mask |= self.lut[:, :, 2] < radius  # NaN compares False
+        return mask
+
+    def to_image(self, floor_points):
+        """
+        Project floor positions back into the image, e.g. to draw a metric radius around the robot.
+        """
+        points = np.asarray(floor_points, dtype=np.float64).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(points, np.linalg.inv(self.homography)).reshape(-1, 2)
+
+    def error(self):
+        """
+        :return: RMS distance in metres between the measured floor points and where the homography puts them
+        """
+        projected = cv2.perspectiveTransform(self.image_points.reshape(-1, 1, 2), self.homography).reshape(-1, 2)
+        return float(np.sqrt(np.mean(np.sum((projected - self.floor_points) ** 2, axis=1))))
@@ -0,0 +1,154 @@
+import threading
+import time
+import cv2
+
+
+COLOR_CONVERSIONS = {
+    "rgb": cv2.COLOR_BGR2RGB,
+    "gray": cv2.COLOR_BGR2GRAY,
+}
+
+
+class FramePacket:
+    def __init__(self, bus, frame, timestamp, frame_id):
+        """
+        One decoded frame as handed to subscribers.
+        :param bus: FrameBus that produced the frame
+        :param frame: Full resolution BGR frame (read-only)
+        :param timestamp: Capture timestamp in seconds
+        :param frame_id: Increasing frame counter
+        """
+        self.bus = bus
+        self.frame = frame
+        self.timestamp = timestamp
+        self.frame_id = frame_id
+
+    def get(self, size=None, color="bgr"):
+        """
+        Return a read-only view of the frame in the requested format.
+        :param size: (width, height) or None for the decoded resolution
+        :param color: "bgr", "rgb" or "gray"
+        """
+        return self.bus.convert(self, size, color)
+
+
+class Subscription:
+    def __init__(self, bus, name, size=None, color="bgr", max_fps=None):
+        """
+        A consumer of the frame bus that pulls frames at its own rate.
+        :param bus: FrameBus to read from
+        :param name: Name used in the drop statistics
+        :param size: Default (width, height) for FramePacket.get
+        :param color: Default colour format for FramePacket.get
+        :param max_fps: Optional upper bound on the delivery rate
+        """
+        self.bus = bus
+        self.name = name
+        self.size = size
+        self.color = color
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.last_frame_id = 0
+        self.last_delivery = 0.0
+        self.received = 0
+        self.dropped = 0
+
+    def poll(self):
+        """
+        Return the newest frame if it has not been delivered to this subscriber yet.
+        Frames published in between are counted as dropped.
+        :return: FramePacket or None
+        """
+        packet = self.bus.latest()
+        if packet is None or packet.frame_id == self.last_frame_id:
+            return None
+
+        now = time.time()
+        if now - self.last_delivery < self.min_interval:
+            return None
+
+        if self.last_frame_id:
+            self.dropped += packet.frame_id - self.last_frame_id - 1
+        self.received += 1
+        self.last_frame_id = packet.frame_id
+        self.last_delivery = now
+        return packet
+
+    def get(self, packet, size=None, color=None):
+        """
+        Shortcut for packet.get using this subscription's default format.
+        """
+        return packet.get(size or self.size, color or self.color)
+
+
+class FrameBus:
+    def __init__(self):
+        """
+        Single-decode publish/subscribe hub. Each published frame is resized and colour converted
+        at most once per requested format no matter how many subscribers ask for it.
+        """
+        self.lock = threading.Lock()
+        self.packet = None
+        self.frame_id = 0
+        self.cache = {}
+        self.subscribers = {}
+
+    def publish(self, frame, timestamp):
+        """
+        Publish a newly decoded BGR frame. The bus takes ownership of the array.
+        """
+        frame.flags.writeable = False
+        with self.lock:
+            self.frame_id += 1
+            self.packet = FramePacket(self, frame, timestamp, self.frame_id)
+            self.cache = {}
+
+    def latest(self):
+        with self.lock:
+            return self.packet
+
+    def subscribe(self, name, size=None, color="bgr", max_fps=None):
+        subscription = Subscription(self, name, size, color, max_fps)
+        with self.lock:
+            self.subscribers[name] = subscription
+        return subscription
+
+    def unsubscribe(self, name):
+        with self.lock:
+            self.subscribers.pop(name, None)
+
+    def convert(self, packet, size, color):
+        if size is not None:
+            size = tuple(size)
+        if size is None and color == "bgr":
+            return packet.frame
+
+        key = (size, color)
+        with self.lock:
+            is_current = packet.frame_id == self.frame_id
+            if is_current and key in self.cache:
+                return self.cache[key]
+
+        if color == "bgr":
+            out = cv2.resize(packet.frame, size)
+        else:
+            # Resize once and share the resized BGR frame between colour formats
+            source = self.convert(packet, size, "bgr")
+            out = cv2.cvtColor(source, COLOR_CONVERSIONS[color])
+        out.flags.writeable = False
+
+        if is_current:
+            with self.lock:
+                if packet.frame_id == self.frame_id:
+                    self.cache[key] = out
+        return out
+
+    def stats(self):
+        """
+        Per-subscriber delivery statistics.
+        :return: {name: {"received": int, "dropped": int}}
+        """
+        with self.lock:
+            return {
+                name: {"received": sub.received, "dropped": sub.dropped}
+                for name, sub in self.subscribers.items()
+            }
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+class FrameHistory:
+    def __init__(self, size=16):
+        """
+        Short history of display frames keyed by capture timestamp, so a detection result can be drawn on
+        and evaluated against the frame it was computed on instead of whatever frame is current.
+
+        Frames are copied into a ring of preallocated buffers, nothing is allocated once the ring is warm.
+        :param size: Frames kept, must cover the detector latency in GUI ticks
+        """
+        self.size = size
+        self.buffers = [None] * size
+        self.timestamps = [None] * size
+        self.index = 0
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, frame, timestamp):
+        """
+        Copy a frame into the history, overwriting the oldest one.
+        :return: The stored copy
+        """
+        buf = self.buffers[self.index]
+        if buf is None or buf.shape != frame.shape or buf.dtype != frame.dtype:
+            buf = self.buffers[self.index] = np.empty_like(frame)
+        np.copyto(buf, frame)
+        self.timestamps[self.index] = timestamp
+        self.index = (self.index + 1) % self.size
+        return buf
+
+    def get(self, timestamp):
+        """
+        :return: The writable stored frame with exactly this capture timestamp, or None if it was overwritten
+        """
+        for i, stored in enumerate(self.timestamps):
+            if stored == timestamp:
+                self.hits += 1
+                return self.buffers[i]
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,114 @@
+import os
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    def __init__(self, size=(80, 60), threshold=15, min_changed=0.003, learning_rate=0.05, max_interval=1.0,
+                 enabled=True):
+        """
+        Cheap change detector that decides whether the full person detector has to run on a frame.
+
+        Frames are shrunk to a small blurred grayscale image and compared with a running-average background.
+        When only a tiny fraction of the pixels changed the scene is considered static and the detector is
+        skipped. A full check is still forced every `max_interval` seconds, and callers force it while a
+        person is known to be in a zone so somebody standing still is never missed.
+        :param size: (width, height) the frames are compared at
+        :param threshold: Grey level difference above which a pixel counts as changed
+        :param min_changed: Fraction of changed pixels that counts as motion
+        :param learning_rate: How fast the background follows slow changes such as lighting
+        :param max_interval: Longest time in seconds between two detector runs
+        :param enabled: When False every frame is processed, only the statistics are kept
+        """
+        self.size = size
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.learning_rate = learning_rate
+        self.max_interval = max_interval
+        self.enabled = enabled
+
+        self.background = None
+        self.last_run = None
+        self.last_changed = 0.0
+        self.processed = 0
+        self.skipped = 0
+        self.forced = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the gate from CAPSTONE_MOTION_* environment variables, CAPSTONE_MOTION_GATE=0 turns it off.
+        """
+        return cls(
+            threshold=int(os.environ.get("CAPSTONE_MOTION_THRESHOLD", 15)),
+            min_changed=float(os.environ.get("CAPSTONE_MOTION_MIN_CHANGED", 0.003)),
+            learning_rate=float(os.environ.get("CAPSTONE_MOTION_LEARNING_RATE", 0.05)),
+            max_interval=float(os.environ.get("CAPSTONE_MOTION_MAX_INTERVAL", 1.0)),
+            enabled=os.environ.get("CAPSTONE_MOTION_GATE", "1") == "1",
+        )
+
+    def prepare(self, frame):
+        """
+        Small blurred grayscale copy of the frame, accepts BGR or already grey frames of any size.
+        """
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(frame, (5, 5), 0)
+
+    def should_run(self, frame, timestamp, force=False):
+        """
+        Decide whether the detector must run on this frame and update the background.
+        :param frame: Frame to check, ideally the small grey view from the frame bus
+        :param timestamp: Capture timestamp of the frame in seconds
+        :param force: Run regardless of motion, e.g. while a person is inside a zone
+        :return: True if the detector should run
+        """
+        motion = True
+        if self.enabled:
+            small = self.prepare(frame)
+            if self.background is None:
+                self.background = small.astype(np.float32)
+            else:
+                diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+                self.last_changed = float(np.count_nonzero(diff > self.threshold)) / diff.size
+                motion = self.last_changed >= self.min_changed
+                cv2.accumulateWeighted(small, self.background, self.learning_rate)
+
+        due = self.last_run is None or timestamp - self.last_run >= self.max_interval
+        if not (motion or force or due):
+            self.skipped += 1
+            return False
+
+        if not (motion or force):
+            self.forced += 1
+        self.processed += 1
+        self.last_run = timestamp
+        return True
+
+    def reset(self):
+        """
+        Forget the background, e.g. after the camera reconnected.
+        """
+        self.background = None
+        self.last_run = None
+
+    def stats(self):
+        """
+        :return: dict with processed, skipped and forced frame counts and the skipped fraction
+        """
+        total = self.processed + self.skipped
+        return {
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "forced": self.forced,
+            "skip_ratio": self.skipped / total if total else 0.0,
+            "changed": self.last_changed,
+        }
+
+    def telemetry_gauges(self, prefix="motion"):
+        """
+        Processed versus skipped frames as telemetry gauges, so /metrics shows the detector time saved.
+        """
+        return {f"{prefix}_{name}": value for name, value in self.stats().items()}
@@ -0,0 +1,95 @@
+import cv2
+import numpy as np
+
+
+class FramePreprocessor:
+    def __init__(self, size=(400, 300)):
+        """
+        Preprocessing stage for the detection loop that writes into preallocated buffers.
+
+        The frame is resized once into a BGR buffer that is also drawn on for display, and converted to RGB
+        exactly once for the detector. Buffers are only (re)allocated when the input size changes, so in
+        steady state a frame costs no new arrays. Every allocation is counted to make that visible.
+        The returned arrays are reused by the next call, hand out copies if they must outlive a tick.
+        :param size: (width, height) of the display and detector frames
+        """
+        self.size = tuple(size)
+        self.buffers = {}
+        self.allocations = 0
+        self.frame_allocations = 0
+        self.frames = 0
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """
+        Return the named buffer, allocating it only when missing or when the shape changed.
+        """
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self.buffers[name] = buf
+            self.count_allocation()
+        return buf
+
+    def count_allocation(self):
+        self.allocations += 1
+        self.frame_allocations += 1
+
+    def checked(self, out, buf):
+        """
+        OpenCV silently allocates a new array when dst does not fit, count that as well.
+        """
+        if out is not buf:
+            self.count_allocation()
+        return out
+
+    def resize(self, frame, size, name="bgr"):
+        width, height = size
+        if frame.shape[1] == width and frame.shape[0] == height:
+            buf = self.buffer(name, frame.shape, frame.dtype)
+            np.copyto(buf, frame)
+            return buf
+        buf = self.buffer(name, (height, width) + frame.shape[2:], frame.dtype)
+        return self.checked(cv2.resize(frame, (width, height), dst=buf), buf)
+
+    def process(self, frame, rgb=True):
+        """
+        Resize a decoded BGR frame for display and detection.
+        :param frame: Decoded BGR frame of any size, it is not modified
+        :param rgb: Also produce the RGB frame for the detector
+        :return: (writable BGR display frame, RGB frame or None)
+        """
+        self.frames += 1
+        self.frame_allocations = 0
+
+        bgr = self.resize(frame, self.size)
+        if not rgb:
+            return bgr, None
+        rgb_frame = self.buffer("rgb", bgr.shape)
+        return bgr, self.checked(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=rgb_frame), rgb_frame)
+
+    def tensor(self, frame, input_size):
+        """
+        Model input (1, height, width, 3) float32 RGB in [0, 1], converted without float64 temporaries.
+        :param frame: Decoded BGR frame
+        :param input_size: (width, height) of the model input
+        """
+        self.frames += 1
+        self.frame_allocations = 0
+
+        width, height = input_size
+        resized = self.resize(frame, input_size, name="model_bgr")
+        rgb_frame = self.buffer("model_rgb", resized.shape)
+        rgb_frame = self.checked(cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=rgb_frame), rgb_frame)
+        tensor = self.buffer("tensor", (1, height, width, 3), np.float32)
+        np.multiply(rgb_frame, np.float32(1.0 / 255.0), out=tensor[0])
+        return tensor
+
+    def stats(self):
+        """
+        :return: dict with total allocations, allocations during the last frame and frames processed
+        """
+        return {
+            "allocations": self.allocations,
+            "last_frame_allocations": self.frame_allocations,
+            "frames": self.frames,
+        }
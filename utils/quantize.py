@@ -0,0 +1,280 @@
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utils.benchmark import DEFAULT_LABELS, box_iou, check_coverage, check_labels, collect, load_frames, load_labels
+from utils.replay import IMAGE_EXTENSIONS
+
+
+# (name, float model) of the models we ship
+MODELS = [
+    ("zone", "models/capstone_model_2.pt"),
+    ("person", "models/yolov8n.pt"),
+    ("pose", "models/yolo11n-pose.pt"),
+]
+
+FIELDS = ["model", "format", "precision", "path", "frames", "fps", "p50_ms", "p95_ms", "peak_rss_mb", "speedup",
+          "agreement", "recall", "error"]
+
+
+def calibration_images(root, count, exclude=()):
+    """
+    Spread `count` site images evenly over all recordings below root, so every day and lighting is seen.
+    :param exclude: Folders left out, e.g. the report dataset and test/, so the INT8 model is not
+        calibrated on the images it is evaluated on
+    """
+    excluded = [os.path.join(os.path.abspath(path), "") for path in exclude]
+    images = sorted(path for path in glob.glob(os.path.join(root, "**", "*"), recursive=True)
+                    if path.lower().endswith(IMAGE_EXTENSIONS)
+                    and not any(os.path.abspath(path).startswith(folder) for folder in excluded))
+    if len(images) > count:
+        images = [images[i] for i in np.linspace(0, len(images) - 1, count).astype(int)]
+    return images
+
+
+def export_tflite(model_path, images, imgsz):
+    """
+    TFLite export with full INT8 quantisation calibrated on the site images. Ultralytics writes the float32
+    and int8 variants next to each other in <model>_saved_model.
+    :return: (float path, int8 path)
+    """
+    from ultralytics import YOLO
+
+    model = YOLO(model_path)
+    with tempfile.TemporaryDirectory() as calibration:
+        # Ultralytics reads calibration images through a dataset yaml
+        image_dir = os.path.join(calibration, "images")
+        os.makedirs(image_dir)
+        for i, image in enumerate(images):
+            shutil.copy(image, os.path.join(image_dir, f"{i:05d}{os.path.splitext(image)[1].lower()}"))
+        data = os.path.join(calibration, "calibration.yaml")
+        with open(data, "w") as f:
+            names = [model.names[i] for i in sorted(model.names)]
+            json.dump({"path": calibration, "train": "images", "val": "images", "names": names}, f)
+        model.export(format="tflite", int8=True, data=data, imgsz=imgsz)
+
+    saved_model = os.path.splitext(model_path)[0] + "_saved_model"
+    float_path = glob.glob(os.path.join(saved_model, "*_float32.tflite"))
+    int8_path = glob.glob(os.path.join(saved_model, "*_int8.tflite"))
+    if not float_path or not int8_path:
+        raise RuntimeError(f"TFLite export of {model_path} did not produce float32 and int8 models")
+    return float_path[0], int8_path[0]
+
+
+def export_ncnn(model_path, images, imgsz, threads):
+    """
+    NCNN export, quantised to INT8 with the ncnn2table/ncnn2int8 tools of the NCNN toolchain (KL calibration
+    on the site images). The int8 model gets its own <model>_int8_ncnn_model folder Ultralytics can load.
+    :return: (float folder, int8 folder)
+    """
+    from ultralytics import YOLO
+
+    for tool in ("ncnn2table", "ncnn2int8"):
+        if shutil.which(tool) is None:
+            raise RuntimeError(f"{tool} not found, install the NCNN tools to quantise NCNN models")
+
+    float_dir = YOLO(model_path).export(format="ncnn", imgsz=imgsz)
+    int8_dir = os.path.splitext(model_path)[0] + "_int8_ncnn_model"
+    shutil.rmtree(int8_dir, ignore_errors=True)
+    shutil.copytree(float_dir, int8_dir)
+
+    param = os.path.join(float_dir, "model.ncnn.param")
+    weights = os.path.join(float_dir, "model.ncnn.bin")
+    table = os.path.join(int8_dir, "model.table")
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as image_list:
+        image_list.write("\n".join(os.path.abspath(image) for image in images) + "\n")
+    try:
+        # YOLO inputs are RGB scaled to [0, 1]
+        subprocess.run(["ncnn2table", param, weights, image_list.name, table, "mean=[0,0,0]",
+                        "norm=[0.003922,0.003922,0.003922]", f"shape=[{imgsz},{imgsz},3]", "pixel=RGB",
+                        f"thread={threads}", "method=kl"], check=True)
+        subprocess.run(["ncnn2int8", param, weights, os.path.join(int8_dir, "model.ncnn.param"),
+                        os.path.join(int8_dir, "model.ncnn.bin"), table], check=True)
+    finally:
+        os.remove(image_list.name)
+    return float_dir, int8_dir
+
+
+def evaluate(path, imgsz, threads, dataset, labels_path, warmup, repeat, limit):
+    """
+    Latency and detections of one exported model. Runs in its own process like utils/benchmark.py.
+    :return: row dict with the per-image detections under "detections"
+    """
+    import resource
+    import cv2
+
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    cv2.setNumThreads(threads)
+    from utils.detectors import UltralyticsDetector
+
+    frames = load_frames(dataset, limit)
+    labels = load_labels(labels_path)
+    if not frames:
+        raise ValueError(f"No frames in {dataset}")
+    check_coverage(labels, frames, dataset)
+
+    detector = UltralyticsDetector(path, imgsz=imgsz, threads=threads)
+    for i in range(warmup):
+        detector.detect(frames[i % len(frames)][1])
+
+    latencies = []
+    detections = {}
+    matched = 0
+    labelled = 0
+    started = time.perf_counter()
+    for run in range(repeat):
+        for image_name, frame in frames:
+            frame_started = time.perf_counter()
+            result = detector.detect(frame)
+            latencies.append(time.perf_counter() - frame_started)
+            if run:
+                continue
+            detections[image_name] = (result.xyxy().tolist(), result.class_ids.tolist())
+            persons = result.persons()
+            if image_name in labels:
+                truth = labels[image_name]
+                labelled += len(truth)
+                if len(truth) and len(persons):
+                    matched += int(np.count_nonzero(box_iou(truth, persons.xyxy()).max(axis=1) >= 0.5))
+    elapsed = time.perf_counter() - started
+    detector.close()
+
+    latencies_ms = 1000.0 * np.asarray(latencies)
+    return {
+        "frames": len(latencies),
+        "fps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "recall": matched / labelled if labelled else None,
+        "detections": detections,
+    }
+
+
+def run_isolated(args, queue):
+    try:
+        queue.put(evaluate(*args))
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def agreement(baseline, candidate, iou_threshold=0.5):
+    """
+    Share of the float model's boxes the quantised model reproduces with the same class at IoU >= 0.5.
+    Needs no labels, so it also covers the zone model.
+    """
+    found = 0
+    total = 0
+    for image_name, (boxes, class_ids) in baseline.items():
+        total += len(boxes)
+        other_boxes, other_ids = candidate.get(image_name, ([], []))
+        if not len(boxes) or not len(other_boxes):
+            continue
+        iou = box_iou(np.asarray(boxes, dtype=np.float32), np.asarray(other_boxes, dtype=np.float32))
+        iou[np.asarray(class_ids)[:, None] != np.asarray(other_ids)[None, :]] = 0
+        found += int(np.count_nonzero(iou.max(axis=1) >= iou_threshold))
+    return found / total if total else None
+
+
+def write_report(rows, output, fmt):
+    stream = open(output, "w", newline="") if output else sys.stdout
+    try:
+        if fmt == "json":
+            for row in rows:
+                stream.write(json.dumps({key: value for key, value in row.items() if key != "detections"}) + "\n")
+        else:
+            writer = csv.DictWriter(stream, fieldnames=FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({key: round(value, 3) if isinstance(value, float) else value
+                                 for key, value in row.items()})
+    finally:
+        if output:
+            stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export INT8 NCNN/TFLite models calibrated on site images and "
+                                                 "report accuracy and latency against the float export.")
+    parser.add_argument("--models", nargs="*", help="Model names to export, default all of "
+                                                    + ", ".join(name for name, _ in MODELS))
+    parser.add_argument("--formats", nargs="*", choices=["ncnn", "tflite"], default=["ncnn", "tflite"])
+    parser.add_argument("--calibration", default="datasets/data", help="Folder searched for calibration images")
+    parser.add_argument("--calibration-size", type=int, default=200, help="Calibration images used")
+    parser.add_argument("--dataset", default="datasets/data/20 Dec", help="Folder, zip or video for the report")
+    parser.add_argument("--labels", default=DEFAULT_LABELS,
+                        help='JSON {"image": [[x1, y1, x2, y2], ...]} person boxes of images in --dataset, '
+                             'recall is only measured with labels')
+    parser.add_argument("--exclude", nargs="*", default=["datasets/data/test"],
+                        help="Folders never used for calibration, --dataset is always excluded")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=None, help="Use only the first N report images")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    parser.add_argument("--output", help="Write the report to this file instead of stdout")
+    args = parser.parse_args()
+    check_labels(parser, args.labels)
+
+    exclude = list(args.exclude) + ([args.dataset] if os.path.isdir(args.dataset) else [])
+    images = calibration_images(args.calibration, args.calibration_size, exclude)
+    if not images:
+        raise SystemExit(f"No calibration images in {args.calibration}")
+    print(f"Calibrating on {len(images)} images from {args.calibration}, excluding {', '.join(exclude)}",
+          file=sys.stderr)
+
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for name, model_path in MODELS:
+        if args.models and name not in args.models:
+            continue
+        if not os.path.exists(model_path):
+            print(f"Skipping {name}: {model_path} not found", file=sys.stderr)
+            continue
+        for fmt in args.formats:
+            print(f"Exporting {name} to {fmt}", file=sys.stderr)
+            try:
+                if fmt == "tflite":
+                    paths = export_tflite(model_path, images, args.imgsz)
+                else:
+                    paths = export_ncnn(model_path, images, args.imgsz, args.threads)
+            except Exception as e:
+                rows.append({"model": name, "format": fmt, "error": f"{type(e).__name__}: {e}"})
+                continue
+
+            baseline = None
+            for precision, path in zip(("float", "int8"), paths):
+                print(f"Evaluating {path}", file=sys.stderr)
+                queue = context.Queue()
+                process = context.Process(target=run_isolated, args=(
+                    (path, args.imgsz, args.threads, args.dataset, args.labels, args.warmup, args.repeat,
+                     args.limit), queue))
+                process.start()
+                row = collect(process, queue, name, fmt, path, args.imgsz, args.threads)
+                process.join()
+                row.update({"model": name, "format": fmt, "precision": precision, "path": path})
+
+                if precision == "float":
+                    baseline = row
+                elif "error" not in row and baseline is not None and "error" not in baseline:
+                    row["speedup"] = row["fps"] / baseline["fps"]
+                    row["agreement"] = agreement(baseline["detections"], row["detections"])
+                rows.append(row)
+
+    write_report(rows, args.output, args.format)
+
+
+if __name__ == "__main__":
+    # python utils/quantize.py --models person pose --formats tflite --output int8_report.csv
+    main()
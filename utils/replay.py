@@ -0,0 +1,188 @@
+import os
+import re
+import time
+import zipfile
+from datetime import datetime
+import cv2
+import numpy as np
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+FILENAME_TIME = re.compile(r"(\d{8})_(\d{6})")
+
+
+class ReplaySource:
+    def __init__(self, path, pacing="fixed", fps=15.0, speed=1.0, max_gap=1.0, loop=True, start_time=0.0):
+        """
+        Offline frame source that replays recorded data instead of a live camera, for profiling and
+        regression tests of the detection -> zone -> robot state path on a workstation.
+
+        Timestamps are deterministic: "fixed" and "max" pacing space frames exactly 1/fps apart, "realtime"
+        uses the recorded times (video position, or the date and time in dataset file names such as
+        "20 Dec_20241220_120314.jpg") with idle gaps longer than max_gap compressed to max_gap.
+        :param path: Folder of images, zip archive of images or video file
+        :param pacing: "realtime" (recorded timing), "fixed" (fps) or "max" (as fast as possible)
+        :param fps: Frame rate for fixed pacing and timestamps of images without a time in the name
+        :param speed: Playback speed factor for realtime and fixed pacing
+        :param max_gap: Longest pause between two frames in seconds of recorded time
+        :param loop: Start over at the end, timestamps keep increasing across passes
+        :param start_time: Timestamp of the first frame
+        """
+        if pacing not in ("realtime", "fixed", "max"):
+            raise ValueError("Pacing must be 'realtime', 'fixed' or 'max'")
+        self.path = path
+        self.pacing = pacing
+        self.fps = fps
+        self.speed = speed
+        self.max_gap = max_gap
+        self.loop = loop
+        self.start_time = start_time
+        self.passes = 0
+        self.finished = False  # Set once a non-looping replay has been played, CameraStream then stops
+        self.next_timestamp = start_time
+
+        if os.path.isdir(path):
+            self.kind = "folder"
+            self.names = sorted(name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS))
+        elif zipfile.is_zipfile(path):
+            self.kind = "zip"
+            with zipfile.ZipFile(path) as archive:
+                self.names = sorted(name for name in archive.namelist() if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            self.kind = "video"
+            self.names = []
+
+        if self.kind != "video" and not self.names:
+            raise ValueError(f"No images found in {path}")
+
+    def open(self):
+        """
+        Start a pass over the recording.
+        :return: ReplayReader, or None once a non-looping replay has finished
+        """
+        if self.passes > 0 and not self.loop:
+            self.finished = True
+            return None
+        self.passes += 1
+        return ReplayReader(self, loop=self.loop)
+
+    def frames(self):
+        """
+        Iterate over one pass as fast as possible, independent of any pacing.
+        :return: generator of (frame, timestamp)
+        """
+        reader = ReplayReader(self, paced=False, loop=False)
+        try:
+            while True:
+                ret, frame, timestamp = reader.read()
+                if not ret:
+                    break
+                yield frame, timestamp
+        finally:
+            reader.release()
+
+
+class ReplayReader:
+    def __init__(self, source, paced=True, loop=False):
+        """
+        Reads a ReplaySource, once or over and over when loop is set.
+        """
+        self.source = source
+        self.paced = paced and source.pacing != "max"
+        self.loop = loop
+        self.index = 0
+        self.previous_recorded = None
+        self.wall_start = None
+        self.replay_start = source.next_timestamp
+        self.archive = zipfile.ZipFile(source.path) if source.kind == "zip" else None
+        self.cap = cv2.VideoCapture(source.path) if source.kind == "video" else None
+
+    def next_frame(self):
+        """
+        :return: (frame, recorded time in seconds or None)
+        """
+        source = self.source
+        if self.cap is not None:
+            ret, frame = self.cap.read()
+            if not ret:
+                return None, None
+            return frame, self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+
+        while self.index < len(source.names):
+            name = source.names[self.index]
+            self.index += 1
+            if self.archive is not None:
+                data = np.frombuffer(self.archive.read(name), dtype=np.uint8)
+                frame = cv2.imdecode(data, cv2.IMREAD_COLOR)
+            else:
+                frame = cv2.imread(os.path.join(source.path, name))
+            if frame is None:
+                print(f"Error: Unable to read image {name}. Skipping...")
+                continue
+            return frame, recorded_time(name)
+        return None, None
+
+    def read(self):
+        """
+        :return: (ret, frame, timestamp) with the same contract as CameraReader.read
+        """
+        source = self.source
+        frame, recorded = self.next_frame()
+        if frame is None and self.loop:
+            self.rewind()
+            frame, recorded = self.next_frame()
+        if frame is None:
+            return False, None, None
+
+        step = 1.0 / source.fps
+        if source.pacing == "realtime" and recorded is not None and self.previous_recorded is not None:
+            step = min(max(recorded - self.previous_recorded, 0.001), source.max_gap)
+        if recorded is not None:
+            self.previous_recorded = recorded
+
+        timestamp = source.next_timestamp
+        source.next_timestamp = timestamp + step
+
+        if self.paced:
+            if self.wall_start is None:
+                self.wall_start = time.time()
+            delay = self.wall_start + (timestamp - self.replay_start) / source.speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        return True, frame, timestamp
+
+    def rewind(self):
+        self.source.passes += 1
+        self.index = 0
+        self.previous_recorded = None
+        if self.cap is not None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+        if self.archive is not None:
+            self.archive.close()
+
+
+def recorded_time(name):
+    """
+    Capture time encoded in dataset file names like "9 Dec_20241209_115935.jpg".
+    """
+    match = FILENAME_TIME.search(os.path.basename(name))
+    if match is None:
+        return None
+    return datetime.strptime("".join(match.groups()), "%Y%m%d%H%M%S").timestamp()
+
+
+if __name__ == "__main__":
+    # Replay a dataset as fast as possible and report the decode throughput
+    import sys
+    source = ReplaySource(sys.argv[1] if len(sys.argv) > 1 else "datasets/data/20 Dec", pacing="max")
+    started = time.time()
+    count = 0
+    for frame, timestamp in source.frames():
+        count += 1
+    elapsed = time.time() - started
+    print(f"Replayed {count} frames in {elapsed:.2f}s ({count / elapsed:.1f} fps)")
@@ -0,0 +1,314 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+import cv2
+import numpy as np
+
+from utils.detectors import Detector, Detections
+from utils.telemetry import telemetry
+from utils.zones import zone_points
+
+
+def zone_roi(stop_zone, slow_zone, size=(400, 300), padding=0.1, head_room=0.5):
+    """
+    Region around the union of the zones, as fractions of the frame so it fits any resolution.
+
+    Zones are drawn on the floor, so the region is extended upwards by `head_room` of the frame height to
+    keep the bodies of people standing on the far edge of the zones inside the crop.
+    :param stop_zone: Corner dict of the stop zone or None
+    :param slow_zone: Corner dict of the slow zone or None
+    :param size: (width, height) the zone corners were drawn at
+    :param padding: Margin around the zones as a fraction of the frame size
+    :param head_room: Extra height above the zones as a fraction of the frame height
+    :return: (x, y, width, height) in [0, 1], or None without zones
+    """
+    corners = [point for zone in (stop_zone, slow_zone) if zone is not None for point in zone_points(zone)]
+    if not corners:
+        return None
+    corners = np.asarray(corners, dtype=np.float32) / np.asarray(size, dtype=np.float32)
+    x1, y1 = np.clip(corners.min(axis=0) - padding, 0.0, 1.0)
+    x2, y2 = np.clip(corners.max(axis=0) + padding, 0.0, 1.0)
+    y1 = max(0.0, y1 - head_room)
+    return float(x1), float(y1), float(x2 - x1), float(y2 - y1)
+
+
+class RoiDetector(Detector):
+    def __init__(self, detector, input_size=None, min_area=0.05):
+        """
+        Runs a detector on a crop around the zones instead of the whole frame.
+
+        Give it the full resolution frame: the crop is cut from it and only shrunk when it is larger than
+        the model input, so people near the slow zone keep far more pixels than in the 400x300 downscale
+        for the same or lower inference cost. Boxes come back in pixels of the frame passed to detect().
+        Without a region the whole frame is used.
+        :param detector: Detector doing the actual inference
+        :param input_size: (width, height) the model runs at, defaults to detector.input_size
+        :param min_area: Regions smaller than this fraction of the frame are grown to it
+        """
+        self.detector = detector
+        self.name = f"roi-{detector.name}"
+        self.input_size = input_size or detector.input_size
+        self.min_area = min_area
+        self.lock = threading.Lock()
+        self.region = None
+
+    @classmethod
+    def from_env(cls, detector, detector_factory=None):
+        """
+        Wrap the detector following CAPSTONE_ROI: "1" runs on one crop around the zones, "tiles" runs a
+        TiledDetector over the zones (CAPSTONE_TILE_OVERLAP, CAPSTONE_MAX_TILES, CAPSTONE_TILE_WORKERS).
+        CAPSTONE_ROI_INPUT ("320x320") sets the model input for backends that do not expose it.
+        Otherwise the detector is returned unchanged.
+        :param detector_factory: Creates the extra detectors of parallel tile workers
+        """
+        mode = os.environ.get("CAPSTONE_ROI", "0")
+        if mode not in ("1", "tiles"):
+            return detector
+        input_size = None
+        if "CAPSTONE_ROI_INPUT" in os.environ:
+            input_size = tuple(int(value) for value in os.environ["CAPSTONE_ROI_INPUT"].lower().split("x"))
+        if mode == "1":
+            return cls(detector, input_size=input_size)
+        return TiledDetector(detector, input_size=input_size, detector_factory=detector_factory,
+                             overlap=float(os.environ.get("CAPSTONE_TILE_OVERLAP", 0.25)),
+                             max_tiles=int(os.environ.get("CAPSTONE_MAX_TILES", 4)),
+                             workers=int(os.environ.get("CAPSTONE_TILE_WORKERS", 1)))
+
+    def set_region(self, region):
+        """
+        :param region: (x, y, width, height) as fractions of the frame, see zone_roi(), or None for the full frame
+        """
+        if region is not None:
+            x, y, width, height = region
+            if width * height < self.min_area:
+                grow = (self.min_area / max(width * height, 1e-6)) ** 0.5
+                cx, cy = x + width / 2, y + height / 2
+                width, height = min(1.0, width * grow), min(1.0, height * grow)
+                x = min(max(0.0, cx - width / 2), 1.0 - width)
+                y = min(max(0.0, cy - height / 2), 1.0 - height)
+            region = (x, y, width, height)
+        with self.lock:
+            self.region = region
+
+    def crop_rect(self, frame_width, frame_height):
+        """
+        :return: Pixel (x, y, width, height) of the region in a frame of this size
+        """
+        with self.lock:
+            region = self.region
+        if region is None:
+            return 0, 0, frame_width, frame_height
+        x = int(region[0] * frame_width)
+        y = int(region[1] * frame_height)
+        width = max(1, min(frame_width - x, int(round(region[2] * frame_width))))
+        height = max(1, min(frame_height - y, int(round(region[3] * frame_height))))
+        return x, y, width, height
+
+    def detect(self, frame):
+        frame_height, frame_width = frame.shape[:2]
+        x, y, width, height = self.crop_rect(frame_width, frame_height)
+        crop = frame[y:y + height, x:x + width]  # A view, no copy
+
+        # Shrink to the model input when the crop is larger, upscaling would add no detail
+        scale = 1.0
+        if self.input_size is not None:
+            scale = min(1.0, self.input_size[0] / width, self.input_size[1] / height)
+        if scale < 1.0:
+            crop = cv2.resize(crop, (max(1, int(width * scale)), max(1, int(height * scale))),
+                              interpolation=cv2.INTER_AREA)
+        telemetry.gauge("roi_area", width * height / float(frame_width * frame_height))
+
+        detections = self.detector.detect(crop)
+        mapped = detections.transformed(width / crop.shape[1], height / crop.shape[0], x, y)
+        if detections.masks is not None:
+            # Paste the instance masks back into the frame
+            masks = np.zeros((len(detections), frame_height, frame_width), dtype=bool)
+            for i, mask in enumerate(detections.masks):
+                resized = cv2.resize(mask.view(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+                masks[i, y:y + height, x:x + width] = resized > 0
+            mapped.masks = masks
+        return mapped
+
+    def close(self):
+        self.detector.close()
+
+
+class TiledDetector(RoiDetector):
+    def __init__(self, detector, input_size=None, detector_factory=None, overlap=0.25, max_tiles=4, workers=1,
+                 iou_threshold=0.5):
+        """
+        Runs a detector on overlapping full resolution tiles of the model input size, for wide cells where
+        people on the far edge shrink to a few pixels in the 400x300 downscale.
+
+        Only tiles touching the zone region (see set_region) are scheduled. When more than `max_tiles` do,
+        the extra ones take turns over the following frames so the cost per frame stays bounded. Tiles go
+        through detect_batch(), or a thread pool with one detector per worker, and the per-tile boxes are
+        merged with a cross-tile NMS (see merge_tiles). Pose keypoints are kept, instance masks are not.
+        :param detector: Detector of the first worker
+        :param input_size: Tile (width, height), defaults to detector.input_size or 640x640
+        :param detector_factory: Creates the detectors of the other workers, required for workers > 1
+        :param overlap: Fraction of a tile shared with its neighbour, should fit a person
+        :param max_tiles: Tiles run per frame
+        :param workers: Parallel tile workers, backends are not thread safe so each owns a detector
+        :param iou_threshold: Intersection over the smaller box above which boxes from two tiles are merged
+        """
+        super().__init__(detector, input_size=input_size or detector.input_size or (640, 640), min_area=0.0)
+        self.name = f"tiled-{detector.name}"
+        self.overlap = overlap
+        self.max_tiles = max_tiles
+        self.iou_threshold = iou_threshold
+        self.cursor = 0
+        self.grid = None
+        self.grid_shape = None
+        self.detectors = [detector]
+        if workers > 1 and detector_factory is not None:
+            self.detectors += [detector_factory() for _ in range(workers - 1)]
+        self.idle = Queue()
+        for worker_detector in self.detectors:
+            self.idle.put(worker_detector)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.detectors)) if len(self.detectors) > 1 else None
+
+    def tile_grid(self, frame_width, frame_height):
+        """
+        :return: int array (T, 4) of tile x, y, width, height covering the frame, cached per resolution
+        """
+        if self.grid_shape == (frame_width, frame_height):
+            return self.grid
+        tile_width = min(self.input_size[0], frame_width)
+        tile_height = min(self.input_size[1], frame_height)
+        xs = axis_positions(frame_width, tile_width, self.overlap)
+        ys = axis_positions(frame_height, tile_height, self.overlap)
+        self.grid = np.array([(x, y, tile_width, tile_height) for y in ys for x in xs], dtype=np.int32)
+        self.grid_shape = (frame_width, frame_height)
+        return self.grid
+
+    def schedule(self, frame_width, frame_height):
+        """
+        Tiles to run on this frame: those touching the region, most covered first, at most max_tiles.
+        """
+        grid = self.tile_grid(frame_width, frame_height)
+        x, y, width, height = self.crop_rect(frame_width, frame_height)
+        overlap_x = np.clip(np.minimum(grid[:, 0] + grid[:, 2], x + width) - np.maximum(grid[:, 0], x), 0, None)
+        overlap_y = np.clip(np.minimum(grid[:, 1] + grid[:, 3], y + height) - np.maximum(grid[:, 1], y), 0, None)
+        covered = overlap_x * overlap_y
+        active = np.flatnonzero(covered > 0)
+        active = active[np.argsort(covered[active])[::-1]]
+        if len(active) <= self.max_tiles:
+            return grid[active]
+
+        # The best covered tiles run every frame, the rest rotate through the remaining slots
+        fixed = max(1, self.max_tiles // 2)
+        rotating = active[fixed:]
+        slots = self.max_tiles - fixed
+        picked = rotating[(self.cursor + np.arange(slots)) % len(rotating)]
+        self.cursor = (self.cursor + slots) % len(rotating)
+        return grid[np.concatenate([active[:fixed], picked])]
+
+    def detect_tile(self, tile):
+        detector = self.idle.get()
+        try:
+            return detector.detect(tile)
+        finally:
+            self.idle.put(detector)
+
+    def detect(self, frame):
+        frame_height, frame_width = frame.shape[:2]
+        tiles = self.schedule(frame_width, frame_height)
+        crops = [frame[y:y + height, x:x + width] for x, y, width, height in tiles]
+        if self.executor is not None:
+            results = list(self.executor.map(self.detect_tile, crops))
+        else:
+            results = self.detector.detect_batch(crops)
+        telemetry.gauge("tiles_per_frame", len(crops))
+
+        names = {}
+        parts = []
+        sources = []
+        for tile, detections in zip(tiles, results):
+            names.update(detections.names)
+            if len(detections):
+                parts.append(detections.transformed(1.0, 1.0, float(tile[0]), float(tile[1])))
+                sources.append(np.repeat(tile[None], len(detections), axis=0))
+        if not parts:
+            return Detections.empty(names)
+        boxes = np.concatenate([part.boxes for part in parts])
+        scores = np.concatenate([part.scores for part in parts])
+        class_ids = np.concatenate([part.class_ids for part in parts])
+        keypoints = None
+        if all(part.keypoints is not None for part in parts):
+            keypoints = np.concatenate([part.keypoints for part in parts])
+        boxes, scores, class_ids, keypoints = merge_tiles(boxes, scores, class_ids, self.iou_threshold,
+                                                          np.concatenate(sources), keypoints)
+        return Detections(boxes, scores, class_ids, names, keypoints=keypoints)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        for detector in self.detectors:
+            detector.close()
+
+
+def merge_tiles(boxes, scores, class_ids, threshold, tiles, keypoints=None):
+    """
+    Cross-tile NMS. Overlap is measured as intersection over the smaller box, so the part of a person cut
+    off at a tile border is matched with the rest of that person found in the neighbouring tile, and each
+    kept box grows to the union of the boxes it suppressed.
+
+    Only boxes of two different tiles that both touch the band the two tiles share are merged. Two people
+    standing close together away from a seam were separated by the detector of their tile and stay apart.
+    Every keypoint of a merged person comes from the box that saw it with the highest confidence, so an ankle
+    found only in the neighbouring tile is not lost.
+    :param boxes: (N, 4) origin_x, origin_y, width, height in frame pixels
+    :param tiles: (N, 4) x, y, width, height of the tile every box was found in
+    :param keypoints: Optional (N, 17, 3) keypoints in frame pixels
+    :return: (boxes, scores, class_ids, keypoints) of the merged detections, highest score first
+    """
+    x1y1 = boxes[:, :2]
+    x2y2 = boxes[:, :2] + boxes[:, 2:]
+    areas = boxes[:, 2] * boxes[:, 3]
+    tile_x1y1 = tiles[:, :2]
+    tile_x2y2 = tiles[:, :2] + tiles[:, 2:]
+
+    order = np.argsort(scores)[::-1]
+    merged = []
+    merged_keypoints = []
+    keep = []
+    while len(order):
+        i = order[0]
+        rest = order[1:]
+        size = np.clip(np.minimum(x2y2[i], x2y2[rest]) - np.maximum(x1y1[i], x1y1[rest]), 0, None)
+        intersection = size[:, 0] * size[:, 1]
+        overlap = intersection / (np.minimum(areas[i], areas[rest]) + 1e-9)
+
+        # Shared band of the tile of box i and the tile of every other box, empty for the same tile
+        band_x1y1 = np.maximum(tile_x1y1[i], tile_x1y1[rest])
+        band_x2y2 = np.minimum(tile_x2y2[i], tile_x2y2[rest])
+        other_tile = (tiles[rest] != tiles[i]).any(axis=1) & (band_x2y2 > band_x1y1).all(axis=1)
+        touches = ((np.minimum(x2y2[i], band_x2y2) >= np.maximum(x1y1[i], band_x1y1)).all(axis=1)
+                   & (np.minimum(x2y2[rest], band_x2y2) >= np.maximum(x1y1[rest], band_x1y1)).all(axis=1))
+
+        same = (overlap > threshold) & (class_ids[rest] == class_ids[i]) & other_tile & touches
+        group = np.concatenate([[i], rest[same]])
+        top_left = x1y1[group].min(axis=0)
+        merged.append(np.concatenate([top_left, x2y2[group].max(axis=0) - top_left]))
+        if keypoints is not None:
+            best = np.argmax(keypoints[group, :, 2], axis=0)
+            merged_keypoints.append(keypoints[group[best], np.arange(keypoints.shape[1])])
+        keep.append(i)
+        order = rest[~same]
+    if keypoints is not None:
+        keypoints = np.asarray(merged_keypoints, dtype=np.float32).reshape(-1, keypoints.shape[1], 3)
+    return np.asarray(merged, dtype=np.float32), scores[keep], class_ids[keep], keypoints
+
+
+def axis_positions(length, tile, overlap):
+    """
+    Tile start positions along one axis, the last tile is aligned with the far edge.
+    """
+    if tile >= length:
+        return [0]
+    stride = max(1, int(tile * (1.0 - overlap)))
+    positions = list(range(0, length - tile, stride))
+    positions.append(length - tile)
+    return positions
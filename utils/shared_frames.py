@@ -0,0 +1,340 @@
+import os
+import threading
+import time
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from utils.telemetry import telemetry
+
+
+class SharedFrameRing:
+    def __init__(self, shape, slots=4, name=None, create=True):
+        """
+        Fixed-size ring of frames in shared memory, written by the capture stage and read zero-copy by
+        worker processes.
+
+        Every slot carries the sequence number of the frame it holds. The writer marks a slot as busy
+        (-1) while copying into it, so a reader can tell that a frame was overwritten by checking the
+        sequence number again once it is done with the view.
+        :param shape: Frame shape, e.g. (300, 400, 3)
+        :param slots: Number of frames kept, must be larger than the number of frames in flight
+        :param name: Base name of the shared memory blocks (generated when creating)
+        :param create: Create the blocks (capture side) or attach to existing ones (worker side)
+        """
+        self.shape = tuple(shape)
+        self.slots = slots
+        frame_bytes = int(np.prod(self.shape))
+        meta_bytes = (2 * slots + 1) * 8
+
+        if create:
+            self.frames_shm = shared_memory.SharedMemory(name=name, create=True, size=frame_bytes * slots)
+            self.meta_shm = shared_memory.SharedMemory(name=f"{self.frames_shm.name}_meta", create=True,
+                                                       size=meta_bytes)
+        else:
+            self.frames_shm = attach_shared_memory(name)
+            self.meta_shm = attach_shared_memory(f"{name}_meta")
+        self.name = self.frames_shm.name
+
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.frames_shm.buf)
+        self.slot_seq = np.ndarray((slots,), dtype=np.int64, buffer=self.meta_shm.buf)
+        self.slot_time = np.ndarray((slots,), dtype=np.float64, buffer=self.meta_shm.buf, offset=slots * 8)
+        self.latest = np.ndarray((1,), dtype=np.int64, buffer=self.meta_shm.buf, offset=2 * slots * 8)
+        if create:
+            self.slot_seq[:] = 0
+            self.latest[0] = 0
+
+    @classmethod
+    def attach(cls, name, shape, slots):
+        return cls(shape, slots, name=name, create=False)
+
+    def write(self, frame, timestamp):
+        """
+        Copy a frame into the next slot and publish it.
+        :return: Sequence number of the frame
+        """
+        seq = int(self.latest[0]) + 1
+        slot = seq % self.slots
+        self.slot_seq[slot] = -1
+        np.copyto(self.frames[slot], frame)
+        self.slot_time[slot] = timestamp
+        self.slot_seq[slot] = seq
+        self.latest[0] = seq
+        return seq
+
+    def read(self, seq):
+        """
+        Zero-copy view of a frame. Check is_valid(seq) after using it.
+        :return: (frame view, timestamp) or (None, None) if the slot was already reused
+        """
+        slot = seq % self.slots
+        if self.slot_seq[slot] != seq:
+            return None, None
+        return self.frames[slot], float(self.slot_time[slot])
+
+    def is_valid(self, seq):
+        return self.slot_seq[seq % self.slots] == seq
+
+    def close(self):
+        # Drop the numpy views before closing, otherwise the buffers stay exported
+        self.frames = self.slot_seq = self.slot_time = self.latest = None
+        self.frames_shm.close()
+        self.meta_shm.close()
+
+    def unlink(self):
+        self.frames_shm.unlink()
+        self.meta_shm.unlink()
+
+
+def attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # Before Python 3.13 attaching registers the block with this process' resource tracker,
+        # which would unlink it when the worker exits. Only the creating process owns it.
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class VisionResult:
+    def __init__(self, seq, timestamp, boxes, scores, stop_detected, slow_detected, inference_time, held=None):
+        """
+        Compact detection result sent back from a worker process.
+        :param boxes: int32 array (N, 4) of person boxes as origin_x, origin_y, width, height
+        :param scores: float32 array (N,)
+        :param held: (stop_held, slow_held), see ZoneEngine.held()
+        """
+        self.seq = seq
+        self.timestamp = timestamp
+        self.boxes = boxes
+        self.scores = scores
+        self.stop_detected = stop_detected
+        self.slow_detected = slow_detected
+        self.inference_time = inference_time
+        self.held = held
+
+
+def vision_worker(ring_name, shape, slots, backend, model, options, tasks, results, busy, index):
+    """
+    Worker process: person detection and zone evaluation on frames from the shared ring.
+
+    Every task gets exactly one answer on `results`, None when it failed, so the pool's in-flight count can
+    never leak. busy[index] holds the sequence number being worked on, the pool uses it when the process dies.
+    """
+    from utils.detectors import create_detector
+    from utils.floor import FloorCalibration
+    from utils.zone_engine import ZoneEngine
+    from utils.zones import feet
+
+    ring = SharedFrameRing.attach(ring_name, shape, slots)
+    try:
+        detector = create_detector(backend, model, **options)
+    except Exception as e:
+        print(f"Vision worker {index}: could not create the detector: {e}")
+        detector = None
+    zone_engine = ZoneEngine()
+    floor = None
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        seq, stop_zone, slow_zone, calibration = task
+        busy[index] = seq
+        result = None
+        try:
+            if detector is None:
+                continue  # Reported once above, the pool turns stale without results
+            frame, timestamp = ring.read(seq)
+            if frame is None:
+                continue
+
+            started = time.time()
+            persons = detector.detect(frame).persons()
+            if not ring.is_valid(seq):
+                continue  # Overwritten while we were reading it
+
+            zone_engine.set_zones({"stop": stop_zone, "slow": slow_zone})  # Only rebuilt when the zones changed
+            if calibration != floor:
+                floor = calibration
+                zone_engine.set_floor(FloorCalibration.from_dict(calibration) if calibration else None)
+            person_feet = feet(persons.boxes, persons.keypoints)
+            stop_detected, slow_detected = zone_engine.decide(zone_engine.membership(*person_feet))
+            result = VisionResult(seq, timestamp, persons.boxes.astype(np.int32), persons.scores,
+                                  stop_detected, slow_detected, time.time() - started, zone_engine.held(*person_feet))
+        except Exception as e:
+            print(f"Vision worker {index}: frame {seq} failed: {e}")
+        finally:
+            results.put(result)
+            busy[index] = 0
+
+    if detector is not None:
+        detector.close()
+    ring.close()
+
+
+class VisionProcessPool:
+    def __init__(self, bus, workers=None, backend=None, model=None, size=(400, 300), result_timeout=None,
+                 **options):
+        """
+        Runs detection and zone evaluation in separate processes so they scale with the number of cores
+        instead of sharing the GUI process' GIL.
+
+        A feeder thread subscribes to the frame bus and writes BGR frames into a SharedFrameRing. Each
+        worker takes one frame at a time, so up to `workers` consecutive frames are processed in parallel.
+        Results come back out of order and only the newest one is kept. A worker that dies, e.g. in a native
+        backend, is restarted and its frame is written off. When no result arrived for `result_timeout`
+        seconds is_stale() reports it, callers treat that like a lost camera.
+        :param bus: FrameBus to read frames from
+        :param workers: Number of worker processes, defaults to one per core minus the GUI core
+        :param backend: Detector backend, defaults to CAPSTONE_DETECTOR (see utils/detectors.py)
+        :param model: Model of the backend, defaults to CAPSTONE_DETECTOR_MODEL or the backend default
+        :param size: (width, height) frames are processed at
+        :param result_timeout: Seconds without a result before the pool counts as stale, defaults to
+                               CAPSTONE_VISION_TIMEOUT or 2
+        :param options: Passed on to the detector, e.g. score_threshold
+        """
+        self.bus = bus
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.backend = backend or os.environ.get("CAPSTONE_DETECTOR", "mediapipe")
+        self.model = model
+        self.size = size
+        self.options = options
+        self.result_timeout = float(result_timeout if result_timeout is not None
+                                    else os.environ.get("CAPSTONE_VISION_TIMEOUT", 2.0))
+
+        width, height = size
+        self.ring = SharedFrameRing((height, width, 3), slots=2 * self.workers + 2)
+        self.context = multiprocessing.get_context("spawn")
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        self.busy = self.context.Array("q", self.workers, lock=False)  # Sequence each worker is on, 0 when idle
+        self.processes = [self.spawn(index) for index in range(self.workers)]
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.zones = (None, None)
+        self.calibration = None
+        self.latest = None
+        self.processed = 0
+        self.restarts = 0
+        self.last_progress = None
+        self.running = False
+        self.threads = []
+
+    def spawn(self, index):
+        return self.context.Process(target=vision_worker, daemon=True,
+                                    args=(self.ring.name, self.ring.shape, self.ring.slots, self.backend, self.model,
+                                          self.options, self.tasks, self.results, self.busy, index))
+
+    def start(self):
+        self.running = True
+        self.last_progress = time.time()  # The model load counts against the first result
+        for process in self.processes:
+            process.start()
+        self.subscription = self.bus.subscribe("vision_pool", size=self.size)
+        self.threads = [threading.Thread(target=self.feed, daemon=True),
+                        threading.Thread(target=self.collect, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1)
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        self.bus.unsubscribe("vision_pool")
+        self.ring.close()
+        self.ring.unlink()
+
+    def set_zones(self, stop_zone, slow_zone):
+        """
+        Zones sent along with every frame, they are small dicts so this is cheap.
+        """
+        self.zones = (stop_zone, slow_zone)
+
+    def set_floor(self, calibration):
+        """
+        Floor calibration dict (FloorCalibration.to_dict()) or None, the workers rebuild it when it changes.
+        """
+        self.calibration = calibration
+
+    def supervise(self):
+        """
+        Restart dead workers. The frame a dead worker held never gets a result, so it leaves in_flight here.
+        """
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            print(f"Vision worker {index} exited with code {process.exitcode}, restarting it.")
+            process.join(timeout=0)
+            with self.lock:
+                if self.busy[index]:
+                    self.in_flight = max(0, self.in_flight - 1)
+                self.busy[index] = 0
+            self.processes[index] = self.spawn(index)
+            self.processes[index].start()
+            self.restarts += 1
+            telemetry.count("vision_worker_restarts")
+
+    def is_stale(self):
+        """
+        True when frames are waiting but the workers returned no result for result_timeout seconds.
+        """
+        with self.lock:
+            waiting = self.in_flight > 0
+            last = self.last_progress
+            # Loading the models before the first result may take longer
+            timeout = self.result_timeout if self.processed else max(self.result_timeout, 30.0)
+        return self.running and waiting and last is not None and time.time() - last > timeout
+
+    def feed(self):
+        last_check = 0.0
+        while self.running:
+            if time.time() - last_check > 0.5:
+                last_check = time.time()
+                self.supervise()
+            with self.lock:
+                busy = self.in_flight >= self.workers
+            packet = None if busy else self.subscription.poll()
+            if packet is None:
+                time.sleep(0.002)
+                continue
+
+            seq = self.ring.write(self.subscription.get(packet), packet.timestamp)
+            with self.lock:
+                if self.in_flight == 0 and self.processed:
+                    self.last_progress = time.time()  # Idle until now, the wait starts with this frame
+                self.in_flight += 1
+            self.tasks.put((seq,) + self.zones + (self.calibration,))
+
+    def collect(self):
+        while self.running:
+            try:
+                result = self.results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if result is not None:
+                telemetry.observe("detector_inference", result.inference_time)
+            with self.lock:
+                self.in_flight = max(0, self.in_flight - 1)  # supervise() may have counted it out already
+                telemetry.gauge("detector_queue_depth", self.in_flight)
+                if result is not None:
+                    self.last_progress = time.time()
+                if result is not None and (self.latest is None or result.seq > self.latest.seq):
+                    self.latest = result
+                    self.processed += 1
+
+    def latest_result(self):
+        """
+        Newest finished VisionResult or None.
+        """
+        with self.lock:
+            return self.latest
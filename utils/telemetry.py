@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Telemetry:
+    def __init__(self, window=500, rate_window=5.0):
+        """
+        Process-wide registry of per-stage counters, gauges, rates and latency percentiles.
+
+        Counters only go up (dropped frames, reconnects), gauges hold the current value (queue depth),
+        rates count events per second over the last `rate_window` seconds (decode fps) and latencies keep
+        the last `window` samples of a stage in seconds (inference, zone evaluation, Modbus, DB writes).
+        Recording is a dict lookup and an append under a lock, cheap enough for the frame loop.
+        :param window: Latency samples kept per stage
+        :param rate_window: Seconds of events used for rates
+        """
+        self.window = window
+        self.rate_window = rate_window
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.rates = {}
+        self.latencies = {}
+        self.collectors = []
+        self.server = None
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def mark(self, name):
+        """
+        Record one event of a rate, e.g. a decoded frame.
+        """
+        now = time.time()
+        with self.lock:
+            events = self.rates.get(name)
+            if events is None:
+                events = self.rates[name] = deque()
+            events.append(now)
+            while events[0] < now - self.rate_window:
+                events.popleft()
+
+    def observe(self, name, seconds):
+        """
+        Record one latency sample of a stage.
+        """
+        with self.lock:
+            samples = self.latencies.get(name)
+            if samples is None:
+                samples = self.latencies[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def timer(self, name):
+        """
+        Context manager that observes the time spent in the block: `with telemetry.timer("zones"): ...`
+        """
+        return StageTimer(self, name)
+
+    def add_collector(self, callback):
+        """
+        Register callback() -> {name: value}, polled for gauges that are cheaper to read on demand,
+        e.g. the frame bus drop counters.
+        """
+        self.collectors.append(callback)
+
+    def snapshot(self):
+        """
+        :return: {"counters": {...}, "gauges": {...}, "rates": {name: per second},
+                  "latencies": {name: {"count", "p50_ms", "p90_ms", "p99_ms", "max_ms"}}}
+        """
+        now = time.time()
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            rates = {name: sum(1 for t in events if t >= now - self.rate_window) / self.rate_window
+                     for name, events in self.rates.items()}
+            latencies = {name: sorted(samples) for name, samples in self.latencies.items()}
+
+        for callback in self.collectors:
+            try:
+                gauges.update(callback())
+            except Exception as e:
+                print(f"Error in telemetry collector: {e}")
+
+        return {
+            "counters": counters,
+            "gauges": gauges,
+            "rates": rates,
+            "latencies": {name: summarize(samples) for name, samples in latencies.items() if samples},
+        }
+
+    def render_text(self):
+        """
+        One "name value" line per metric, easy to scrape or read with curl.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"{name}_total {value}")
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"{name} {value}")
+        for name, value in sorted(snapshot["rates"].items()):
+            lines.append(f"{name}_per_second {value:.2f}")
+        for name, summary in sorted(snapshot["latencies"].items()):
+            for key, value in summary.items():
+                lines.append(f"{name}_{key} {value:.2f}" if key != "count" else f"{name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9100, host="127.0.0.1"):
+        """
+        Serve render_text() at http://host:port/metrics on a daemon thread.
+        """
+        if self.server is not None:
+            return self.server
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep scrapes out of the console
+
+        try:
+            self.server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"Unable to start telemetry endpoint on {host}:{port}: {e}")
+            return None
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Telemetry available at http://{host}:{port}/metrics")
+        return self.server
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class StageTimer:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def summarize(samples):
+    """
+    Percentiles of sorted latency samples in milliseconds.
+    """
+    last = len(samples) - 1
+    return {
+        "count": len(samples),
+        "p50_ms": 1000.0 * samples[int(0.50 * last)],
+        "p90_ms": 1000.0 * samples[int(0.90 * last)],
+        "p99_ms": 1000.0 * samples[int(0.99 * last)],
+        "max_ms": 1000.0 * samples[last],
+    }
+
+
+# Shared registry of this process
+telemetry = Telemetry()
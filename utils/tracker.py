@@ -0,0 +1,249 @@
+import os
+import numpy as np
+
+
+def iou_matrix(a, b):
+    """
+    IoU between (N, 4) and (M, 4) origin_x, origin_y, width, height boxes.
+    """
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, :2] + a[:, None, 2:], b[None, :, :2] + b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = a[:, 2] * a[:, 3]
+    area_b = b[:, 2] * b[:, 3]
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def greedy_match(iou, threshold):
+    """
+    Match rows to columns by descending IoU, each used at most once.
+    :return: (row indices, column indices) of the matched pairs
+    """
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(iou[rows, cols])[::-1]
+    used_rows, used_cols = set(), set()
+    matched_rows, matched_cols = [], []
+    for row, col in zip(rows[order], cols[order]):
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matched_rows.append(row)
+        matched_cols.append(col)
+    return np.asarray(matched_rows, dtype=np.int64), np.asarray(matched_cols, dtype=np.int64)
+
+
+class PersonTracker:
+    def __init__(self, iou_threshold=0.3, high_score=0.3, max_age=1.5, min_hits=1, process_noise=50.0,
+                 measurement_noise=4.0):
+        """
+        SORT/ByteTrack style multi-person tracker in plain NumPy.
+
+        Every track has a constant velocity Kalman filter over (cx, cy, w, h) with time based steps, so the
+        detector may run at any rate: update() is called with each detection result and boxes_at() extrapolates
+        the tracks to the frame on screen. Confident detections are matched to the tracks first and the
+        remaining weak ones are only used to keep existing tracks alive. A track that misses detections
+        keeps coasting for `max_age` seconds, a single dropped detection no longer flips the zone state.
+        :param iou_threshold: Lowest IoU between a predicted track and a detection to match them
+        :param high_score: Detections at or above this score may start new tracks. Keep it at the detector's
+                           score threshold, a person the detector reports must always get a track, otherwise
+                           nobody checks them against the zones
+        :param max_age: Seconds a track survives without a matching detection, longer than the longest time
+                        the motion gate lets pass between two detector runs
+        :param min_hits: Matched detections before a track is reported, 1 reports new people right away
+        :param process_noise: Acceleration noise in pixels per second squared
+        :param measurement_noise: Box noise of the detector in pixels
+        """
+        self.iou_threshold = iou_threshold
+        self.high_score = high_score
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+
+        self.state = np.zeros((0, 8))  # cx, cy, w, h and their velocities per second
+        self.covariance = np.zeros((0, 8, 8))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.first_seen = np.zeros(0)
+        self.last_seen = np.zeros(0)
+        self.feet = np.zeros((0, 2, 2))  # Right and left foot relative to the box, NaN when unknown
+        self.timestamp = None
+        self.next_id = 1
+        self.created = 0
+        self.removed = 0
+
+    @classmethod
+    def from_env(cls, score_threshold=0.3, detect_interval=1.0):
+        """
+        Build the tracker from CAPSTONE_TRACK_* environment variables, CAPSTONE_TRACKER=0 turns it off.
+        :param score_threshold: Score threshold of the detector, the default and upper bound of CAPSTONE_TRACK_HIGH
+        :param detect_interval: Longest time between two detector runs (MotionGate.max_interval), tracks live at
+                                least half a second longer
+        :return: PersonTracker or None
+        """
+        if os.environ.get("CAPSTONE_TRACKER", "1") != "1":
+            return None
+        return cls(
+            iou_threshold=float(os.environ.get("CAPSTONE_TRACK_IOU", 0.3)),
+            high_score=min(float(os.environ.get("CAPSTONE_TRACK_HIGH", score_threshold)), score_threshold),
+            max_age=max(float(os.environ.get("CAPSTONE_TRACK_MAX_AGE", 1.5)), detect_interval + 0.5),
+            min_hits=int(os.environ.get("CAPSTONE_TRACK_MIN_HITS", 1)),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def transition(self, dt):
+        transition = np.eye(8)
+        transition[:4, 4:] = dt * np.eye(4)
+        # Piecewise white acceleration noise
+        q = self.process_noise ** 2
+        noise = np.zeros((8, 8))
+        noise[:4, :4] = q * dt ** 4 / 4 * np.eye(4)
+        noise[:4, 4:] = noise[4:, :4] = q * dt ** 3 / 2 * np.eye(4)
+        noise[4:, 4:] = q * dt ** 2 * np.eye(4)
+        return transition, noise
+
+    def predict(self, timestamp):
+        """
+        Advance all filters to the timestamp of a new detection result.
+        """
+        if self.timestamp is not None and len(self.ids):
+            dt = max(0.0, timestamp - self.timestamp)
+            transition, noise = self.transition(dt)
+            self.state = self.state @ transition.T
+            self.covariance = transition @ self.covariance @ transition.T + noise
+            self.state[:, 2:4] = np.maximum(self.state[:, 2:4], 1.0)
+        self.timestamp = timestamp
+
+    def correct(self, tracks, measurements):
+        """
+        Kalman update of the given tracks with (cx, cy, w, h) measurements, batched over the tracks.
+        """
+        if not len(tracks):
+            return
+        covariance = self.covariance[tracks]
+        innovation = measurements - self.state[tracks, :4]
+        s = covariance[:, :4, :4] + self.measurement_noise ** 2 * np.eye(4)
+        gain = np.linalg.solve(s, covariance[:, :4, :]).transpose(0, 2, 1)  # P H^T S^-1, S is symmetric
+        self.state[tracks] += np.einsum("nij,nj->ni", gain, innovation)
+        self.covariance[tracks] = covariance - gain @ covariance[:, :4, :]
+
+    def update(self, boxes, scores, timestamp, feet=None):
+        """
+        Feed one detection result.
+        :param boxes: (N, 4) person boxes as origin_x, origin_y, width, height
+        :param scores: (N,) detection scores
+        :param timestamp: Capture timestamp of the frame the detections were computed on
+        :param feet: Optional (right (N, 2), left (N, 2)) measured feet, e.g. from pose keypoints. They are kept
+                     relative to the box so they move with the track between detector runs.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.predict(timestamp)
+        measurements = np.concatenate([boxes[:, :2] + boxes[:, 2:] / 2, boxes[:, 2:]], axis=1)
+        relative_feet = np.full((len(boxes), 2, 2), np.nan)
+        if feet is not None and len(boxes):
+            relative_feet = (np.stack(feet, axis=1) - boxes[:, None, :2]) / np.maximum(boxes[:, None, 2:], 1.0)
+
+        # 1) Confident detections against all tracks, 2) weak detections against the tracks left over
+        unmatched_tracks = np.arange(len(self.ids))
+        strong = np.flatnonzero(scores >= self.high_score)
+        weak = np.flatnonzero(scores < self.high_score)
+        unmatched_strong = strong
+        for detections in (strong, weak):
+            if not len(detections) or not len(unmatched_tracks):
+                continue
+            iou = iou_matrix(self.boxes()[unmatched_tracks], boxes[detections])
+            rows, cols = greedy_match(iou, self.iou_threshold)
+            tracks = unmatched_tracks[rows]
+            self.correct(tracks, measurements[detections[cols]])
+            self.scores[tracks] = scores[detections[cols]]
+            self.feet[tracks] = relative_feet[detections[cols]]
+            self.hits[tracks] += 1
+            self.last_seen[tracks] = timestamp
+            unmatched_tracks = np.delete(unmatched_tracks, rows)
+            if detections is strong:
+                unmatched_strong = np.delete(strong, cols)
+
+        # New tracks for confident detections nobody claimed
+        count = len(unmatched_strong)
+        if count:
+            state = np.zeros((count, 8))
+            state[:, :4] = measurements[unmatched_strong]
+            covariance = np.tile(np.diag([10.0, 10.0, 10.0, 10.0, 200.0, 200.0, 100.0, 100.0]) ** 2, (count, 1, 1))
+            self.state = np.concatenate([self.state, state])
+            self.covariance = np.concatenate([self.covariance, covariance])
+            self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + count)])
+            self.scores = np.concatenate([self.scores, scores[unmatched_strong]])
+            self.hits = np.concatenate([self.hits, np.ones(count, dtype=np.int64)])
+            self.first_seen = np.concatenate([self.first_seen, np.full(count, timestamp)])
+            self.last_seen = np.concatenate([self.last_seen, np.full(count, timestamp)])
+            self.feet = np.concatenate([self.feet, relative_feet[unmatched_strong]])
+            self.next_id += count
+            self.created += count
+
+        # Forget tracks that coasted too long
+        alive = timestamp - self.last_seen <= self.max_age
+        if not alive.all():
+            self.removed += int(np.count_nonzero(~alive))
+            for name in ("state", "covariance", "ids", "scores", "hits", "first_seen", "last_seen", "feet"):
+                setattr(self, name, getattr(self, name)[alive])
+
+    def boxes(self, state=None):
+        """
+        :return: (N, 4) origin_x, origin_y, width, height of the filter states
+        """
+        state = self.state if state is None else state
+        return np.concatenate([state[:, :2] - state[:, 2:4] / 2, state[:, 2:4]], axis=1)
+
+    def boxes_at(self, timestamp):
+        """
+        Reported tracks extrapolated to a frame timestamp, without touching the filters.
+        Tracks that lost their detections longer than max_age ago are left out.
+        :return: (ids, boxes (N, 4) float32 as origin_x, origin_y, width, height, scores)
+        """
+        if self.timestamp is None or not len(self.ids):
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32)
+        dt = max(0.0, timestamp - self.timestamp)
+        state = self.state.copy()
+        state[:, :4] += dt * state[:, 4:]
+        state[:, 2:4] = np.maximum(state[:, 2:4], 1.0)
+        reported = (self.hits >= self.min_hits) & (timestamp - self.last_seen <= self.max_age)
+        return self.ids[reported], self.boxes(state[reported]).astype(np.float32), self.scores[reported]
+
+    def feet_at(self, timestamp):
+        """
+        Measured feet of the tracks reported by boxes_at(), moved along with their boxes.
+        :return: (right (N, 2), left (N, 2)), NaN for tracks without measured feet
+        """
+        _, boxes, _ = self.boxes_at(timestamp)
+        reported = (self.hits >= self.min_hits) & (timestamp - self.last_seen <= self.max_age)
+        feet = boxes[:, None, :2] + self.feet[reported] * boxes[:, None, 2:]
+        return feet[:, 0], feet[:, 1]
+
+    def dwell_times(self, timestamp):
+        """
+        :return: {track id: seconds since the person was first seen} for logging and dwell time analysis
+        """
+        return {int(track_id): float(timestamp - first_seen) for track_id, first_seen in zip(self.ids, self.first_seen)}
+
+    def reset(self):
+        """
+        Drop all tracks, e.g. after the camera was lost. Ids keep counting up so logs stay unambiguous.
+        """
+        self.removed += len(self.ids)
+        self.state = np.zeros((0, 8))
+        self.covariance = np.zeros((0, 8, 8))
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.first_seen = np.zeros(0)
+        self.last_seen = np.zeros(0)
+        self.feet = np.zeros((0, 2, 2))
+        self.timestamp = None
+
+    def stats(self):
+        return {"active": len(self.ids), "created": self.created, "removed": self.removed}
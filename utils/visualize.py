@@ -56,4 +56,29 @@ def visualize(
       cv2.putText(image, result_text, text_location, cv2.FONT_HERSHEY_DUPLEX,
                   FONT_SIZE, TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
 
-  return image, person_detected
\ No newline at end of file
+  return image, person_detected
+
+def visualize_boxes(
+    image,
+    boxes,
+    scores
+) -> np.ndarray:
+  """Draws person boxes given as arrays on the input image and return it.
+  Args:
+    image: The input image.
+    boxes: (N, 4) array of origin_x, origin_y, width, height.
+    scores: (N,) array of confidence scores.
+  Returns:
+    Image with bounding boxes and whether a person was drawn.
+  """
+  for (origin_x, origin_y, width, height), score in zip(boxes, scores):
+    start_point = int(origin_x), int(origin_y)
+    end_point = int(origin_x + width), int(origin_y + height)
+    cv2.rectangle(image, start_point, end_point, (255, 0, 255), 3)
+    result_text = 'person (' + str(round(float(score), 2)) + ')'
+    text_location = (MARGIN + int(origin_x),
+                    MARGIN + ROW_SIZE + int(origin_y))
+    cv2.putText(image, result_text, text_location, cv2.FONT_HERSHEY_DUPLEX,
+                FONT_SIZE, TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
+
+  return image, len(boxes) > 0
@@ -0,0 +1,326 @@
+import os
+import time
+import cv2
+import numpy as np
+
+from utils.floor import floor_margins, floor_radii
+from utils.zones import feet, zone_points
+
+
+# Side-of-line margin of each zone kind, the same thresholds inside_stop_zone/inside_slow_zone use
+MARGINS = {"stop": 500.0, "slow": 0.0}
+
+
+class ZoneEngine:
+    def __init__(self, margins=None, size=(400, 300), exit_pixels=None, exit_metres=None):
+        """
+        Evaluates all foot points against all zones in one NumPy call.
+
+        A zone given as corners only is checked against its left (top_left -> bottom_left) and bottom
+        (bottom_left -> bottom_right) edges exactly like inside_stop_zone/inside_slow_zone. The side-of-line test
+        of an edge is a linear function a*x + b*y + c, its coefficients are computed once in set_zones() instead
+        of every frame.
+
+        A zone with a 'polygon' is rasterized once into a uint8 label mask at the processing resolution, one bit
+        per zone so nested zones can overlap. Its membership is then a single pixel lookup per foot, whatever
+        the number of vertices.
+
+        With a floor calibration (set_floor) the zones are checked in metres on the floor instead: the drawn
+        outline of every zone is projected onto the floor, grown by its metric margin, and everybody closer
+        to the robot than the radius of a zone is in it as well. The result is baked into a second label mask
+        through the calibration's floor position table, so it costs the same single lookup. Feet that have no
+        floor position (outside the calibrated floor) and zones reaching above the horizon keep the image
+        checks.
+
+        Every zone also gets an exit band, its outline grown by `exit_pixels` in the image or `exit_metres` on
+        the floor. held() reports who is still inside these bands, so the debounce (utils/zone_state.py) only
+        lets a person leave a zone once they are clearly outside it, with or without a floor calibration.
+        :param margins: dict zone kind -> side-of-line margin, defaults to MARGINS
+        :param size: (width, height) the zone coordinates and feet are given in
+        :param exit_pixels: Width of the exit band in the image, defaults to CAPSTONE_ZONE_HYSTERESIS_PX or 12
+        :param exit_metres: Width of the exit band on the floor, defaults to CAPSTONE_ZONE_HYSTERESIS or 0.3
+        """
+        self.margins = dict(MARGINS if margins is None else margins)
+        self.size = size
+        if exit_pixels is None:
+            exit_pixels = int(os.environ.get("CAPSTONE_ZONE_HYSTERESIS_PX", 12))
+        if exit_metres is None:
+            exit_metres = float(os.environ.get("CAPSTONE_ZONE_HYSTERESIS", 0.3))
+        self.exit_pixels = exit_pixels
+        self.exit_metres = exit_metres
+        self.zones = {}
+        self.names = []
+        self.coefficients = np.zeros((0, 2, 3), dtype=np.float32)  # zone, (left edge, bottom edge), (a, b, c)
+        self.matrix = np.zeros((3, 0), dtype=np.float32)  # (a, b, c) x (zone, edge), for one matmul per foot
+        self.thresholds = np.zeros(0, dtype=np.float32)
+        self.labels = np.zeros((size[1], size[0]), dtype=np.uint8)
+        self.bits = np.zeros(0, dtype=np.uint8)  # Label bit of every polygon zone, 0 for edge checked zones
+        self.areas = np.zeros((size[0] * size[1], 0), dtype=np.float32)  # Flat filled outline of every zone
+        self.exit_labels = np.zeros((size[1], size[0]), dtype=np.uint8)  # Outlines grown by the exit band
+        self.exit_bits = np.zeros(0, dtype=np.uint8)
+        self.floor = None
+        self.radii = {}
+        self.floor_margins = {}
+        self.floor_labels = np.zeros((size[1], size[0]), dtype=np.uint8)
+        self.floor_bits = np.zeros(0, dtype=np.uint8)  # Label bit of every zone checked on the floor
+        self.floor_exit_labels = np.zeros((size[1], size[0]), dtype=np.uint8)
+        self.version = 0
+
+    def set_zones(self, zones):
+        """
+        Precompute the edge coefficients and the label mask, nothing happens when the zones did not change.
+        Everything is computed and validated first, a bad zone leaves the engine on its previous zones.
+        :param zones: dict zone kind ("stop", "slow") -> corner dict, optionally with a 'polygon', or None
+        :return: True when the zones changed
+        """
+        zones = {name: dict(zone) for name, zone in zones.items() if zone is not None}
+        if zones == self.zones:
+            return False
+
+        names = list(zones)
+        coefficients = np.zeros((len(names), 2, 3), dtype=np.float32)
+        for i, name in enumerate(names):
+            zone = zones[name]
+            for j, (start, end) in enumerate(((zone['top_left'], zone['bottom_left']),
+                                              (zone['bottom_left'], zone['bottom_right']))):
+                # (y - y1) * dx - (x - x1) * dy, see point_side_of_line
+                dx = float(end[0] - start[0])
+                dy = float(end[1] - start[1])
+                coefficients[i, j] = (-dy, dx, start[0] * dy - start[1] * dx)
+
+        width, height = self.size
+        labels = np.zeros((height, width), dtype=np.uint8)
+        bits = np.zeros(len(names), dtype=np.uint8)
+        areas = np.zeros((len(names), height, width), dtype=np.uint8)
+        exit_labels = np.zeros((height, width), dtype=np.uint8)
+        exit_bits = np.zeros(len(names), dtype=np.uint8)
+        band = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * self.exit_pixels + 1, 2 * self.exit_pixels + 1))
+        for i, name in enumerate(names):
+            outline = np.round(np.asarray(zone_points(zones[name]), dtype=np.float32)).astype(np.int32)
+            cv2.fillPoly(areas[i], [outline], 1)
+            if zones[name].get('polygon') and i < 8:
+                bits[i] = 1 << i
+                labels |= areas[i] * bits[i]
+            if i < 8:
+                exit_bits[i] = 1 << i
+                exit_labels |= cv2.dilate(areas[i], band) * exit_bits[i]
+        floor_labels, floor_bits, floor_exit_labels = self.build_floor_labels(names, zones, self.floor, self.radii,
+                                                                              self.floor_margins)
+
+        self.zones = zones
+        self.names = names
+        self.labels = labels
+        self.bits = bits
+        self.areas = areas.reshape(len(names), -1).T.astype(np.float32)
+        self.exit_labels = exit_labels
+        self.exit_bits = exit_bits
+        self.floor_labels = floor_labels
+        self.floor_bits = floor_bits
+        self.floor_exit_labels = floor_exit_labels
+        self.coefficients = coefficients
+        self.matrix = coefficients.reshape(-1, 3).T.copy()
+        self.thresholds = np.array([self.margins.get(name, 0.0) for name in names], dtype=np.float32)
+        self.version += 1
+        return True
+
+    def set_floor(self, calibration, radii=None, margins=None):
+        """
+        Use a FloorCalibration (utils/floor.py) for metric zone checks and distances, None turns it off.
+        :param radii: dict zone kind -> radius around the robot in metres, defaults to CAPSTONE_*_DISTANCE
+        :param margins: dict zone kind -> margin around the drawn zone in metres, defaults to CAPSTONE_*_MARGIN
+        :return: True when the calibration, the radii or the margins changed
+        """
+        radii = floor_radii() if radii is None else dict(radii)
+        margins = floor_margins() if margins is None else dict(margins)
+        same = calibration is self.floor or (calibration is not None and self.floor is not None
+                                             and calibration.to_dict() == self.floor.to_dict())
+        if same and radii == self.radii and margins == self.floor_margins:
+            return False
+        floor_labels, floor_bits, floor_exit_labels = self.build_floor_labels(self.names, self.zones, calibration,
+                                                                              radii, margins)
+        self.floor = calibration
+        self.radii = radii
+        self.floor_margins = margins
+        self.floor_labels = floor_labels
+        self.floor_bits = floor_bits
+        self.floor_exit_labels = floor_exit_labels
+        self.version += 1
+        return True
+
+    def build_floor_labels(self, names, zones, floor, radii, margins):
+        """
+        Floor label mask and the label bit of every zone checked on the floor, nothing is assigned here.
+        :return: (labels (height, width) uint8, bits (zones,) uint8, exit labels (height, width) uint8)
+        """
+        width, height = self.size
+        labels = np.zeros((height, width), dtype=np.uint8)
+        bits = np.zeros(len(names), dtype=np.uint8)
+        exit_labels = np.zeros((height, width), dtype=np.uint8)
+        if floor is not None:
+            if floor.size != self.size:
+                raise ValueError(f"Floor calibration is {floor.size}, zones are {self.size}")
+            for i, name in enumerate(names[:8]):
+                outline = zone_points(zones[name])
+                mask = floor.zone_mask(outline, margins.get(name, 0.0), radii.get(name))
+                if mask is None:
+                    print(f"The {name} zone reaches above the horizon of the floor calibration, "
+                          f"it is checked in the image.")
+                    continue
+                bits[i] = 1 << i
+                labels |= mask.astype(np.uint8) * bits[i]
+                radius = radii[name] + self.exit_metres if name in radii else None
+                exit_mask = floor.zone_mask(outline, margins.get(name, 0.0) + self.exit_metres, radius)
+                exit_labels |= exit_mask.astype(np.uint8) * bits[i]
+        return labels, bits, exit_labels
+
+    def distances(self, right_feet, left_feet):
+        """
+        :return: (N,) metres between the robot and the nearer foot, None without a floor calibration
+        """
+        return None if self.floor is None else self.floor.distances(right_feet, left_feet)
+
+    def index(self, name):
+        return self.names.index(name) if name in self.names else None
+
+    def membership(self, right_feet, left_feet):
+        """
+        :param right_feet: (N, 2) right foot points
+        :param left_feet: (N, 2) left foot points
+        :return: bool array (N, zones), columns in the order of self.names
+        """
+        count = len(right_feet)
+        zones = len(self.names)
+
+        # (N, zones, edges) side of both feet against both edges of every zone, as x * a + y * b + c
+        right = (np.asarray(right_feet, dtype=np.float32).reshape(-1, 2) @ self.matrix[:2]
+                 + self.matrix[2]).reshape(count, zones, 2)
+        left = (np.asarray(left_feet, dtype=np.float32).reshape(-1, 2) @ self.matrix[:2]
+                + self.matrix[2]).reshape(count, zones, 2)
+
+        inside = (right[:, :, 0] < self.thresholds) & (left[:, :, 1] < self.thresholds)
+        confirm = (right[:, :, 1] > 0) & (left[:, :, 0] > 0)
+        membership = inside & ~confirm
+
+        polygons = self.bits > 0
+        if polygons.any():
+            # A person stands in a polygon zone when either foot is on it
+            labels = self.lookup(right_feet) | self.lookup(left_feet)
+            membership[:, polygons] = (labels[:, None] & self.bits[polygons]) > 0
+
+        floor_zones = self.floor_bits > 0
+        if floor_zones.any():
+            # Feet on the calibrated floor are checked in metres, either foot inside puts the person in the zone
+            on_floor = ~(np.isnan(self.floor.lookup(right_feet)[:, 2]) & np.isnan(self.floor.lookup(left_feet)[:, 2]))
+            near = self.lookup(right_feet, self.floor_labels) | self.lookup(left_feet, self.floor_labels)
+            metric = (near[:, None] & self.floor_bits[floor_zones]) > 0
+            membership[:, floor_zones] = np.where(on_floor[:, None], metric, membership[:, floor_zones])
+        return membership
+
+    def held(self, right_feet, left_feet):
+        """
+        Who is still within the exit band of a zone: inside it, or outside by less than the band width.
+        :return: (stop_held, slow_held), True when anybody is held by the stop / slow zone
+        """
+        held = self.membership(right_feet, left_feet)
+        near = self.lookup(right_feet, self.exit_labels) | self.lookup(left_feet, self.exit_labels)
+        grown = (near[:, None] & self.exit_bits) > 0
+
+        floor_zones = self.floor_bits > 0
+        if floor_zones.any():
+            on_floor = ~(np.isnan(self.floor.lookup(right_feet)[:, 2]) & np.isnan(self.floor.lookup(left_feet)[:, 2]))
+            near = self.lookup(right_feet, self.floor_exit_labels) | self.lookup(left_feet, self.floor_exit_labels)
+            metric = (near[:, None] & self.floor_bits[floor_zones]) > 0
+            grown[:, floor_zones] = np.where(on_floor[:, None], metric, grown[:, floor_zones])
+        held |= grown
+
+        stop = self.index("stop")
+        slow = self.index("slow")
+        return (stop is not None and bool(held[:, stop].any()),
+                slow is not None and bool(held[:, slow].any()))
+
+    def metric(self):
+        """
+        :return: True when every zone is checked in metres on the floor
+        """
+        return bool(len(self.names)) and bool((self.floor_bits > 0).all())
+
+    def lookup(self, points, labels=None):
+        """
+        :param points: (N, 2) x, y points
+        :param labels: Label mask to read, defaults to the zone outlines
+        :return: (N,) uint8 label of every point, 0 outside the frame
+        """
+        labels = self.labels if labels is None else labels
+        points = np.round(np.asarray(points, dtype=np.float32).reshape(-1, 2))
+        width, height = self.size
+        valid = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+        x = np.clip(points[:, 0], 0, width - 1).astype(np.intp)
+        y = np.clip(points[:, 1], 0, height - 1).astype(np.intp)
+        return np.where(valid, labels[y, x], 0).astype(np.uint8)
+
+    def mask_overlap(self, masks):
+        """
+        Share of every segmentation mask that lies inside every zone, one matrix product for all of them.
+        :param masks: (N, height, width) bool masks at the processing resolution
+        :return: float32 array (N, zones), columns in the order of self.names
+        """
+        masks = np.asarray(masks, dtype=np.float32).reshape(len(masks), -1)
+        if masks.shape[1] != self.areas.shape[0]:
+            raise ValueError(f"Masks must be {self.size[0]}x{self.size[1]} like the zones")
+        return (masks @ self.areas) / np.maximum(masks.sum(axis=1, keepdims=True), 1.0)
+
+    def evaluate(self, boxes, keypoints=None):
+        """
+        Membership of person boxes, feet from the pose keypoints when given, see zones.feet().
+        """
+        return self.membership(*feet(boxes, keypoints))
+
+    def decide(self, membership):
+        """
+        :return: (stop_detected, slow_detected), slow is only reported when nobody is in the stop zone
+        """
+        stop = self.index("stop")
+        slow = self.index("slow")
+        stop_detected = stop is not None and bool(membership[:, stop].any())
+        slow_detected = not stop_detected and slow is not None and bool(membership[:, slow].any())
+        return stop_detected, slow_detected
+
+
+def benchmark(counts=(1, 10, 100), repeat=2000):
+    """
+    Microbenchmark of the engine against the per-person loop of evaluate_zones().
+    :return: list of (persons, engine microseconds, loop microseconds)
+    """
+    from utils.zones import evaluate_zones
+
+    stop_zone = {'top_left': (120, 120), 'top_right': (300, 120), 'bottom_left': (100, 280), 'bottom_right': (320, 280)}
+    slow_zone = {'top_left': (60, 80), 'top_right': (340, 80), 'bottom_left': (40, 295), 'bottom_right': (380, 295)}
+    engine = ZoneEngine()
+    engine.set_zones({"stop": stop_zone, "slow": slow_zone})
+    rng = np.random.default_rng(0)
+
+    rows = []
+    for count in counts:
+        boxes = np.column_stack([rng.uniform(0, 360, count), rng.uniform(0, 200, count),
+                                 rng.uniform(20, 40, count), rng.uniform(60, 100, count)]).astype(np.float32)
+        stop_detected, slow_detected = evaluate_zones(boxes, stop_zone, slow_zone)
+        assert engine.decide(engine.evaluate(boxes)) == (stop_detected, slow_detected and not stop_detected)
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            engine.decide(engine.evaluate(boxes))
+        engine_us = 1e6 * (time.perf_counter() - started) / repeat
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            evaluate_zones(boxes, stop_zone, slow_zone)
+        loop_us = 1e6 * (time.perf_counter() - started) / repeat
+        rows.append((count, engine_us, loop_us))
+    return rows
+
+
+if __name__ == "__main__":
+    # python -m utils.zone_engine, from the repository root
+    print("persons  engine_us  loop_us")
+    for count, engine_us, loop_us in benchmark():
+        print(f"{count:7d}  {engine_us:9.1f}  {loop_us:7.1f}")
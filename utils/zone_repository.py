@@ -0,0 +1,135 @@
+import json
+import threading
+
+
+def zones_from_row(result):
+    """
+    Convert a RobotZones row into the (stop_zone, slow_zone) corner dicts used by the zone checks.
+    Zones drawn as polygons also carry their vertices under 'polygon'.
+    """
+    stop_zone = {
+        'top_left': (result['stop_zone_tl_x'], result['stop_zone_tl_y']),
+        'top_right': (result['stop_zone_tr_x'], result['stop_zone_tr_y']),
+        'bottom_left': (result['stop_zone_bl_x'], result['stop_zone_bl_y']),
+        'bottom_right': (result['stop_zone_br_x'], result['stop_zone_br_y']),
+    }
+    slow_zone = {
+        'top_left': (result['slow_zone_tl_x'], result['slow_zone_tl_y']),
+        'top_right': (result['slow_zone_tr_x'], result['slow_zone_tr_y']),
+        'bottom_left': (result['slow_zone_bl_x'], result['slow_zone_bl_y']),
+        'bottom_right': (result['slow_zone_br_x'], result['slow_zone_br_y']),
+    }
+    for zone, column in ((stop_zone, 'stop_zone_polygon'), (slow_zone, 'slow_zone_polygon')):
+        if result.get(column):
+            zone['polygon'] = [tuple(point) for point in json.loads(result[column])]
+    return stop_zone, slow_zone
+
+
+class ZoneRepository:
+    def __init__(self, db):
+        """
+        In-memory copy of the zones and floor calibrations of all robots.
+
+        Everything is read from the database once in load(). Pages read from memory afterwards, and saves go
+        through save_zones()/save_calibration(), which write the database, refresh that robot and bump its
+        version. Subscribers get one call per actual change, so zone coefficients, masks and lookup tables
+        are rebuilt once per change instead of on every page show.
+        :param db: Connected MySQLHandler
+        """
+        self.db = db
+        self.lock = threading.Lock()
+        self.zones = {}  # robot_id -> (stop_zone, slow_zone)
+        self.calibrations = {}  # robot_id -> FloorCalibration.to_dict()
+        self.versions = {}  # robot_id -> number of changes seen
+        self.listeners = []
+
+    def load(self):
+        """
+        Read the zones and calibrations of all robots in one query each. When a query fails the cached
+        zones are kept and nobody is notified.
+        """
+        if self.db.connection is None:
+            print("No database connection, zone repository is not refreshed.")
+            return
+        try:
+            zones = {row['robot_id']: zones_from_row(row) for row in self.db.get_all_zone_data(strict=True)}
+            calibrations = self.db.get_all_calibrations(strict=True)
+        except Exception as e:
+            print(f"Keeping the cached zones, reading them failed: {e}")
+            return
+        for robot_id in set(zones) | set(calibrations) | set(self.zones) | set(self.calibrations):
+            self.update(robot_id, zones.get(robot_id), calibrations.get(robot_id))
+
+    def refresh(self, robot_id):
+        """
+        Re-read one robot after it was saved, subscribers are only notified when something changed.
+        A failed query keeps the cached zones of the robot, only an answer without a row removes them.
+        """
+        try:
+            results = self.db.get_zone_data(robot_id, strict=True)
+            calibration = self.db.get_calibration(robot_id, strict=True)
+        except Exception as e:
+            print(f"Keeping the cached zones of robot {robot_id}, reading them failed: {e}")
+            return
+        self.update(robot_id, zones_from_row(results[0]) if results else None, calibration)
+
+    def update(self, robot_id, zones, calibration):
+        with self.lock:
+            if self.zones.get(robot_id) == zones and self.calibrations.get(robot_id) == calibration:
+                return
+            if zones is None:
+                self.zones.pop(robot_id, None)
+            else:
+                self.zones[robot_id] = zones
+            if calibration is None:
+                self.calibrations.pop(robot_id, None)
+            else:
+                self.calibrations[robot_id] = calibration
+            version = self.versions.get(robot_id, 0) + 1
+            self.versions[robot_id] = version
+            listeners = list(self.listeners)
+        for callback in listeners:
+            try:
+                callback(robot_id, version)
+            except Exception as e:
+                print(f"Error notifying zone change of robot {robot_id}: {e}")
+
+    def subscribe(self, callback):
+        """
+        :param callback: Called as callback(robot_id, version) after every change
+        """
+        with self.lock:
+            self.listeners.append(callback)
+
+    def get(self, robot_id):
+        """
+        :return: (stop_zone, slow_zone), (None, None) when the robot has no zones
+        """
+        with self.lock:
+            return self.zones.get(robot_id, (None, None))
+
+    def available(self, robot_id):
+        with self.lock:
+            return robot_id in self.zones
+
+    def calibration(self, robot_id):
+        with self.lock:
+            return self.calibrations.get(robot_id)
+
+    def version(self, robot_id):
+        with self.lock:
+            return self.versions.get(robot_id, 0)
+
+    def save_zones(self, robot_id, data, polygons=None):
+        """
+        Write the zones of a robot (see MySQLHandler.insert_zone) and publish them.
+        """
+        self.db.insert_zone(data, polygons=polygons)
+        self.refresh(robot_id)
+
+    def save_calibration(self, robot_id, calibration):
+        """
+        Write the floor calibration of a robot (FloorCalibration.to_dict()) and publish it.
+        """
+        self.db.insert_calibration(robot_id, calibration)
+        self.refresh(robot_id)
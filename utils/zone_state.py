@@ -0,0 +1,101 @@
+import os
+
+
+# Escalation order of the robot states driven by the zone checks, any other state ranks like "stop"
+SEVERITY = {"normal": 0, "slow": 1, "stop": 2}
+
+
+class ZoneStateMachine:
+    def __init__(self, enter_dwell=0.0, exit_dwell=1.0):
+        """
+        Debounces the per-frame zone decision before it reaches the robot.
+
+        Every state change costs a Modbus write, a ZoneLogs insert, a log query and a spoken message, and a
+        person wavering on a zone boundary or a single missed detection used to flip the state back and forth.
+        Escalation to stop is always immediate. Escalation to slow waits `enter_dwell` seconds, and going back
+        to a milder state waits until the milder decision held for `exit_dwell` seconds. A zone is also only
+        left once nobody is within its exit band any more, see ZoneEngine.held(): the outline grown by
+        CAPSTONE_ZONE_HYSTERESIS_PX pixels, or CAPSTONE_ZONE_HYSTERESIS metres on a calibrated floor.
+        :param enter_dwell: Seconds the slow decision must hold before the robot slows down
+        :param exit_dwell: Seconds a milder decision must hold before the robot speeds up again
+        """
+        self.enter_dwell = enter_dwell
+        self.exit_dwell = exit_dwell
+
+        self.state = "normal"
+        self.pending = None  # (state, first timestamp) of a decision waiting for its dwell time
+        self.last_decision = None
+        self.decisions = 0
+        self.transitions = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build the state machine from CAPSTONE_*_DWELL, CAPSTONE_DEBOUNCE=0 turns it off.
+        :return: ZoneStateMachine or None
+        """
+        if os.environ.get("CAPSTONE_DEBOUNCE", "1") != "1":
+            return None
+        return cls(
+            enter_dwell=float(os.environ.get("CAPSTONE_ENTER_DWELL", 0.0)),
+            exit_dwell=float(os.environ.get("CAPSTONE_EXIT_DWELL", 1.0)),
+        )
+
+    def update(self, stop_detected, slow_detected, timestamp, held=None):
+        """
+        Feed the zone decision of one frame.
+        :param held: (stop_held, slow_held) from ZoneEngine.held(), whether anybody is still within the exit
+                     band of the stop / slow zone. None turns the hysteresis off for this frame.
+        :return: The debounced state, "stop", "slow" or "normal"
+        """
+        decision = "stop" if stop_detected else "slow" if slow_detected else "normal"
+        if self.last_decision is not None and decision != self.last_decision:
+            self.decisions += 1
+        self.last_decision = decision
+
+        # Hysteresis: a zone is only left once nobody is within its exit band any more
+        if held is not None:
+            for zone, zone_held in zip(("stop", "slow"), held):
+                if SEVERITY[decision] < SEVERITY[zone] <= self.severity(self.state) and zone_held:
+                    decision = zone
+                    break
+
+        if decision == self.state:
+            self.pending = None
+            return self.state
+        if decision == "stop":
+            return self.change(decision)
+
+        if self.pending is None or self.pending[0] != decision:
+            self.pending = (decision, timestamp)
+        dwell = self.enter_dwell if SEVERITY[decision] > self.severity(self.state) else self.exit_dwell
+        if timestamp - self.pending[1] >= dwell:
+            return self.change(decision)
+        return self.state
+
+    def severity(self, state):
+        return SEVERITY.get(state, SEVERITY["stop"])
+
+    def change(self, state):
+        self.state = state
+        self.pending = None
+        self.transitions += 1
+        return state
+
+    def reset(self, state="normal"):
+        """
+        Continue from a state set from outside, e.g. after start/disable or when vision came back.
+        """
+        self.state = state
+        self.pending = None
+
+    def stats(self):
+        """
+        :return: dict with the decision changes seen, the transitions passed on and the suppressed difference
+        """
+        return {
+            "state": self.state,
+            "decisions": self.decisions,
+            "transitions": self.transitions,
+            "suppressed": max(0, self.decisions - self.transitions),
+        }
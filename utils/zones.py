@@ -0,0 +1,147 @@
+import numpy as np
+
+
+# COCO keypoint indices of the pose models
+LEFT_ANKLE = 15
+RIGHT_ANKLE = 16
+
+
+def zone_points(zone):
+    """
+    Outline of a zone in drawing order: its polygon when it has one, otherwise the four corners.
+    :param zone: Corner dict, optionally with a 'polygon' list of (x, y) vertices
+    """
+    if zone.get('polygon'):
+        return [tuple(point) for point in zone['polygon']]
+    return [zone['top_left'], zone['top_right'], zone['bottom_right'], zone['bottom_left']]
+
+
+def corners_from_polygon(polygon):
+    """
+    Corner dict stored next to a polygon for the corner columns and the edge checks: the vertices themselves
+    for a quadrilateral drawn as top_left, top_right, bottom_right, bottom_left, otherwise the bounding box.
+    """
+    if len(polygon) == 4:
+        top_left, top_right, bottom_right, bottom_left = [tuple(point) for point in polygon]
+    else:
+        xs = [point[0] for point in polygon]
+        ys = [point[1] for point in polygon]
+        top_left, top_right = (min(xs), min(ys)), (max(xs), min(ys))
+        bottom_left, bottom_right = (min(xs), max(ys)), (max(xs), max(ys))
+    return {'top_left': top_left, 'top_right': top_right, 'bottom_left': bottom_left, 'bottom_right': bottom_right}
+
+
+def point_side_of_line(line_x1, line_y1, line_x2, line_y2, x, y):
+    """
+    Cross product telling on which side of the line (x1, y1) -> (x2, y2) the point (x, y) lies.
+    """
+    # Cross product: (y - y1)*dx - (x - x1)*dy
+    dx = line_x2 - line_x1
+    dy = line_y2 - line_y1
+    return (y - line_y1)*dx - (x - line_x1)*dy
+
+
+def foot_points(origin_x, origin_y, width, height):
+    """
+    Estimate the ground contact points of a person from the bounding box.
+    :return: (right foot (x, y), left foot (x, y))
+    """
+    right_foot = (origin_x + width, origin_y + height * 7 / 8)
+    left_foot = (origin_x + width / 6, origin_y + height)
+    return right_foot, left_foot
+
+
+def feet(boxes, keypoints=None, min_confidence=0.5):
+    """
+    Ground contact points of all persons at once.
+
+    With pose keypoints the ankles are used, so crouching or partly occluded people are placed correctly.
+    The image-rightmost ankle takes the role of the right foot of foot_points(). When only one ankle is
+    visible it is used for both feet, without any the box estimate of foot_points() is the fallback.
+    :param boxes: (N, 4) origin_x, origin_y, width, height
+    :param keypoints: Optional (N, 17, 3) x, y, confidence
+    :param min_confidence: Lowest keypoint confidence to trust an ankle
+    :return: (right feet (N, 2), left feet (N, 2))
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    origin_x, origin_y, width, height = boxes.T
+    right = np.stack([origin_x + width, origin_y + height * 7 / 8], axis=1)
+    left = np.stack([origin_x + width / 6, origin_y + height], axis=1)
+    if keypoints is None or not len(boxes):
+        return right, left
+
+    ankles = keypoints[:, [LEFT_ANKLE, RIGHT_ANKLE], :]  # (N, 2, 3)
+    visible = ankles[:, :, 2] >= min_confidence
+    # Sort the two ankles by image x, invisible ones take the position of the other
+    order = np.argsort(np.where(visible, ankles[:, :, 0], np.inf), axis=1)
+    ankles = np.take_along_axis(ankles[:, :, :2], order[:, :, None], axis=1)
+    visible = np.take_along_axis(visible, order, axis=1)
+    leftmost = ankles[:, 0]
+    rightmost = np.where(visible[:, 1:2], ankles[:, 1], leftmost)
+
+    any_visible = visible[:, 0]  # Visible ankles sort first
+    right = np.where(any_visible[:, None], rightmost, right)
+    left = np.where(any_visible[:, None], leftmost, left)
+    return right, left
+
+
+def inside_stop_zone(stop_zone, right_foot, left_foot):
+    """
+    Check the feet against the left (top_left to bottom_left) and bottom (bottom_left to bottom_right)
+    edges of the stop zone.
+    :param stop_zone: dict with 'top_left', 'bottom_left' and 'bottom_right' corners
+    """
+    X_stop_tl, Y_stop_tl = stop_zone['top_left']
+    X_stop_bl, Y_stop_bl = stop_zone['bottom_left']
+    X_stop_br, Y_stop_br = stop_zone['bottom_right']
+
+    # 1) Vertical stop line (top_left to bottom_left)
+    inside_right_stop_vert = point_side_of_line(X_stop_tl, Y_stop_tl, X_stop_bl, Y_stop_bl, *right_foot) < 500
+
+    # 2) Horizontal stop line (bottom_left to bottom_right)
+    inside_left_stop_horz = point_side_of_line(X_stop_bl, Y_stop_bl, X_stop_br, Y_stop_br, *left_foot) < 500
+
+    stop_confirm_right = point_side_of_line(X_stop_bl, Y_stop_bl, X_stop_br, Y_stop_br, *right_foot)
+    stop_confirm_front = point_side_of_line(X_stop_tl, Y_stop_tl, X_stop_bl, Y_stop_bl, *left_foot)
+    stop_confirm = (stop_confirm_right > 0) and (stop_confirm_front > 0)
+
+    return inside_left_stop_horz and inside_right_stop_vert and not stop_confirm
+
+
+def inside_slow_zone(slow_zone, right_foot, left_foot):
+    """
+    Same edge checks as inside_stop_zone but with the strict slow zone thresholds.
+    :param slow_zone: dict with 'top_left', 'bottom_left' and 'bottom_right' corners
+    """
+    X_slow_tl, Y_slow_tl = slow_zone['top_left']
+    X_slow_bl, Y_slow_bl = slow_zone['bottom_left']
+    X_slow_br, Y_slow_br = slow_zone['bottom_right']
+
+    # 1) Vertical slow line (top_left to bottom_left), inside if < 0
+    inside_right_slow_vert = point_side_of_line(X_slow_tl, Y_slow_tl, X_slow_bl, Y_slow_bl, *right_foot) < 0
+
+    # 2) Horizontal slow line (bottom_left to bottom_right), inside if < 0
+    inside_left_slow_horz = point_side_of_line(X_slow_bl, Y_slow_bl, X_slow_br, Y_slow_br, *left_foot) < 0
+
+    slow_confirm_right = point_side_of_line(X_slow_bl, Y_slow_bl, X_slow_br, Y_slow_br, *right_foot)
+    slow_confirm_front = point_side_of_line(X_slow_tl, Y_slow_tl, X_slow_bl, Y_slow_bl, *left_foot)
+    slow_confirm = (slow_confirm_right > 0) and (slow_confirm_front > 0)
+
+    return inside_right_slow_vert and inside_left_slow_horz and not slow_confirm
+
+
+def evaluate_zones(boxes, stop_zone, slow_zone, keypoints=None):
+    """
+    Run the zone checks for a list of person boxes.
+    :param boxes: (N, 4) array of origin_x, origin_y, width, height
+    :param keypoints: Optional (N, 17, 3) pose keypoints, the ankles replace the estimated feet
+    :return: (stop_detected, slow_detected), slow is only reported when nobody is in the stop zone
+    """
+    stop_detected = False
+    slow_detected = False
+    for right_foot, left_foot in zip(*feet(boxes, keypoints)):
+        if stop_zone is not None and inside_stop_zone(stop_zone, right_foot, left_foot):
+            stop_detected = True
+        if slow_zone is not None and not stop_detected and inside_slow_zone(slow_zone, right_foot, left_foot):
+            slow_detected = True
+    return stop_detected, slow_detected